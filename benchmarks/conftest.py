@@ -0,0 +1,80 @@
+# fixtures of the benchmarks, see docs/testing.md
+
+import asyncio
+import os
+
+import aiosqlite
+import pytest
+from synthetic import generate
+
+from gantry.__main__ import apply_migrations
+from gantry.clients.db import configure
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--bench-jobs",
+        default="100000",
+        help="comma separated numbers of jobs in the benchmarked databases",
+    )
+    parser.addoption(
+        "--bench-dir",
+        default=None,
+        help="where the databases are kept between runs, a temporary directory "
+        "by default. delete them when benchmarks/synthetic.py changes",
+    )
+    parser.addoption(
+        "--update-plans",
+        action="store_true",
+        help="record the current query plans in benchmarks/plans.json",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "jobs" in metafunc.fixturenames:
+        sizes = [int(n) for n in metafunc.config.getoption("bench_jobs").split(",")]
+        metafunc.parametrize("jobs", sizes, scope="session")
+
+
+@pytest.fixture(scope="session")
+def loop():
+    """
+    The benchmarks are synchronous, so they run the queries on their own event loop
+    """
+
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def db(request, loop, jobs, tmp_path_factory):
+    """Connection to a database of synthetic jobs, configured like gantry's"""
+
+    directory = request.config.getoption("bench_dir") or tmp_path_factory.mktemp("db")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"gantry-{jobs}.db")
+
+    if not os.path.exists(path):
+        # so an interrupted run doesn't leave a partial database behind
+        partial = f"{path}.partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+
+        async def create():
+            async with aiosqlite.connect(partial) as conn:
+                await generate(conn, jobs)
+
+        loop.run_until_complete(create())
+        os.replace(partial, path)
+
+    async def connect():
+        conn = await aiosqlite.connect(path)
+        await configure(conn, wal=True)
+        # databases kept from an earlier run are brought up to date
+        await apply_migrations(conn)
+        return conn
+
+    conn = loop.run_until_complete(connect())
+    yield conn
+    loop.run_until_complete(conn.close())
@@ -0,0 +1,92 @@
+# reports what the indexes of the jobs table cost: their size on disk, and the time
+# spent inserting develop and pull request jobs, as insert_job does, with them
+#
+# the database is copied, brought up to date with the migrations, and the inserts
+# are rolled back, so it can be a production database or one from synthetic.py
+#
+# usage: PYTHONPATH=. python benchmarks/index_report.py gantry.db [--inserts 5000]
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+import aiosqlite
+from synthetic import Synthetic
+
+from gantry.__main__ import apply_migrations
+from gantry.clients.db import configure, insert_job
+
+
+def sizes(path: str) -> dict:
+    """returns: {table or index: bytes} of the jobs table, from the dbstat table"""
+
+    db = sqlite3.connect(path)
+    try:
+        return dict(
+            db.execute(
+                """
+                SELECT schema.name, SUM(pgsize) FROM dbstat
+                JOIN sqlite_master AS schema ON schema.name = dbstat.name
+                WHERE tbl_name = 'jobs' GROUP BY schema.name ORDER BY 2 DESC
+                """
+            )
+        )
+    finally:
+        db.close()
+
+
+async def insert_cost(path: str, inserts: int, ref: str) -> float:
+    """returns: mean seconds per insert_job of jobs of a ref, without commits"""
+
+    async with aiosqlite.connect(path) as db:
+        await configure(db)
+        async with db.execute("SELECT MAX(gitlab_id) FROM jobs") as cursor:
+            (last,) = await cursor.fetchone()
+
+        synthetic = Synthetic(seed=1)
+        jobs = [
+            {
+                **synthetic.job(i),
+                # not in the database, whichever jobs it has
+                "pod": f"index-report-{i}",
+                "gitlab_id": last + 1 + i,
+                "ref": ref,
+            }
+            for i in range(inserts)
+        ]
+        start = time.perf_counter()
+        for job in jobs:
+            await insert_job(db, job)
+        elapsed = time.perf_counter() - start
+        await db.rollback()
+
+    return elapsed / inserts
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db", help="gantry database, which is only read")
+    parser.add_argument("--inserts", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "gantry.db")
+        async with aiosqlite.connect(f"file:{args.db}?mode=ro", uri=True) as source:
+            async with aiosqlite.connect(path) as db:
+                await source.backup(db)
+                await apply_migrations(db)
+
+        print(f"{'table/index':<28} {'MB':>9}")
+        for name, size in sizes(path).items():
+            print(f"{name:<28} {size / 1e6:>9.1f}")
+        print()
+        for ref in ("develop", "pr42264_index-report"):
+            cost = await insert_cost(path, args.inserts, ref)
+            print(f"insert_job ({ref.split('_')[0]}): {cost * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
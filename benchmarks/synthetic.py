@@ -0,0 +1,231 @@
+# fills a gantry database with synthetic jobs, distributed like spack CI builds
+#
+# a few packages are built far more often than the rest, each package has a handful
+# of versions (the newest built the most) and of variant configurations, and most
+# builds use one of two gcc versions. about a third of the jobs are develop builds,
+# the rest are built for pull requests. the same seed always generates the same jobs.
+#
+# usage: PYTHONPATH=. python benchmarks/synthetic.py gantry.db [--jobs 1000000]
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import aiosqlite
+
+from gantry.__main__ import apply_migrations
+from gantry.clients.db import insert_dict, insert_node
+from gantry.util.spec import canonical_variants, variants_hash
+
+PACKAGES = 6000
+# the nth most built package is built about 1 / n ** ZIPF as often as the first
+ZIPF = 1.1
+# compilers, with how often they are used
+COMPILERS = {
+    ("gcc", "11.4.0"): 45,
+    ("gcc", "12.3.0"): 20,
+    ("gcc", "13.2.0"): 10,
+    ("oneapi", "2024.1.0"): 10,
+    ("clang", "17.0.6"): 5,
+    ("nvhpc", "24.3"): 5,
+    ("aocc", "4.2.0"): 5,
+}
+STACKS = ["e4s", "e4s-oneapi", "e4s-rocm-external", "data-vis-sdk", "ml-linux-x86_64"]
+ARCHS = ["linux-ubuntu22.04-x86_64_v3", "linux-ubuntu22.04-neoverse_v1"]
+# variants packages are configured with, and their possible values
+VARIANTS = {
+    "shared": [True, False],
+    "pic": [True, False],
+    "mpi": [True, False],
+    "cuda": [True, False],
+    "rocm": [True, False],
+    "openmp": [True, False],
+    "python": [True, False],
+    "fortran": [True, False],
+    "hdf5": [True, False, "none"],
+    "sycl": [True, False],
+    "build_system": ["cmake", "autotools", "generic"],
+    "build_type": ["Release", "RelWithDebInfo"],
+    "cuda_arch": ["80", "90", ["80", "90"]],
+    "patches": [["0f1e2d3", "a4b5c6d"]],
+}
+# fraction of the jobs built on develop
+DEVELOP = 0.35
+NODES = 200
+# a job starts about every minute, so a million jobs span two years
+JOB_INTERVAL = 60
+EPOCH = 1_650_000_000
+INSERT_BATCH = 10_000
+
+
+class Synthetic:
+    """
+    Generates the packages of a seed, then jobs and specs of these packages.
+    Jobs are generated in the order they started.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        rng = self.rng
+        self.names = [f"pkg-{i}" for i in range(PACKAGES)]
+        self.popularity = list(
+            itertools.accumulate(1 / (n + 1) ** ZIPF for n in range(PACKAGES))
+        )
+
+        self.versions = {}
+        self.configs = {}
+        self.usage = {}
+        for name in self.names:
+            # newest first
+            versions = [f"{rng.randint(1, 30)}.{minor}.0" for minor in range(9, 0, -1)]
+            self.versions[name] = versions[: rng.randint(1, 6)]
+            variants = rng.sample(sorted(VARIANTS), rng.randint(0, 6))
+            self.configs[name] = [
+                canonical_variants({v: rng.choice(VARIANTS[v]) for v in variants})
+                for _ in range(rng.randint(1, 4))
+            ]
+            # cores and bytes, some packages are far more expensive to build
+            self.usage[name] = (
+                rng.lognormvariate(0.5, 0.8),
+                rng.lognormvariate(20.5, 1.0),
+            )
+
+    def spec(self) -> dict:
+        """a spec as parsed by parse_alloc_spec, mostly of packages that were built"""
+
+        rng = self.rng
+        (name,) = rng.choices(self.names, cum_weights=self.popularity)
+        versions = self.versions[name]
+        (version,) = rng.choices(
+            versions, weights=[1 / (i + 1) for i in range(len(versions))]
+        )
+        ((compiler_name, compiler_version),) = rng.choices(
+            list(COMPILERS), weights=list(COMPILERS.values())
+        )
+        pkg_variants = rng.choice(self.configs[name])
+
+        return {
+            "pkg_name": name,
+            "pkg_version": version,
+            "pkg_variants": pkg_variants,
+            "pkg_variants_dict": json.loads(pkg_variants),
+            "compiler_name": compiler_name,
+            "compiler_version": compiler_version,
+            "arch": rng.choice(ARCHS),
+        }
+
+    def job(self, i: int) -> dict:
+        """the ith job, a row of the jobs table as passed to insert_job"""
+
+        rng = self.rng
+        spec = self.spec()
+        cpu, mem = self.usage[spec["pkg_name"]]
+        cpu_mean = cpu * rng.lognormvariate(0, 0.2)
+        mem_mean = mem * rng.lognormvariate(0, 0.2)
+        start = EPOCH + i * JOB_INTERVAL + rng.randrange(JOB_INTERVAL)
+
+        return {
+            "pod": f"runner-{i}-concurrent-0",
+            "node": rng.randint(1, NODES),
+            "start": start,
+            "end": start + int(rng.lognormvariate(6.5, 1.0)),
+            "gitlab_id": 9_000_000 + i,
+            "job_status": "success",
+            "ref": (
+                "develop"
+                if rng.random() < DEVELOP
+                else f"pr{rng.randint(30000, 47000)}_{spec['pkg_name']}"
+            ),
+            "pkg_name": spec["pkg_name"],
+            "pkg_version": spec["pkg_version"],
+            "pkg_variants": spec["pkg_variants"],
+            "compiler_name": spec["compiler_name"],
+            "compiler_version": spec["compiler_version"],
+            "arch": spec["arch"],
+            "stack": rng.choice(STACKS),
+            "build_jobs": 16,
+            "cpu_request": 1,
+            "cpu_limit": None,
+            "cpu_mean": cpu_mean,
+            "cpu_median": cpu_mean,
+            "cpu_max": cpu_mean * rng.uniform(1.2, 3),
+            "cpu_min": cpu_mean / 4,
+            "cpu_stddev": cpu_mean / 10,
+            "mem_request": 2e9,
+            "mem_limit": 64e9,
+            "mem_mean": mem_mean,
+            "mem_median": mem_mean,
+            "mem_max": mem_mean * rng.uniform(1.2, 2),
+            "mem_min": mem_mean / 4,
+            "mem_stddev": mem_mean / 10,
+        }
+
+
+async def generate(db: aiosqlite.Connection, jobs: int, seed: int = 0) -> Synthetic:
+    """
+    Creates the schema and inserts synthetic jobs into an empty database.
+
+    args:
+        db: connection to the database
+        jobs: number of jobs to insert
+        seed: selects the packages and jobs
+    returns:
+        the generator, which continues with the job after the last inserted one
+    """
+
+    await apply_migrations(db)
+    for i in range(1, NODES + 1):
+        await insert_node(
+            db,
+            {
+                "uuid": f"node-{i}",
+                "hostname": f"ip-10-0-{i // 256}-{i % 256}",
+                "cores": 32,
+                "mem": 128e9,
+                "arch": "amd64",
+                "os": "linux",
+                "instance_type": "i3en.6xlarge",
+            },
+        )
+
+    # the rollup is built once the jobs are inserted, like it was for the jobs
+    # that existed when it was added, rather than updated for each job
+    with open("migrations/006_sample_rollup.sql") as f:
+        rollup, backfill = f.read().split("-- existing builds")
+    await db.execute("DROP TRIGGER sample_rollup_insert")
+
+    synthetic = Synthetic(seed)
+    for first in range(0, jobs, INSERT_BATCH):
+        batch = []
+        for i in range(first, min(first + INSERT_BATCH, jobs)):
+            job = synthetic.job(i)
+            # as in insert_job, which would take a round trip per job
+            job["pkg_variants_hash"] = variants_hash(json.loads(job["pkg_variants"]))
+            batch.append(job)
+        query, _ = insert_dict("jobs", batch[0])
+        await db.executemany(query, [tuple(job.values()) for job in batch])
+    await db.executescript(backfill)
+    await db.executescript(rollup[rollup.index("CREATE TRIGGER") :])
+    await db.commit()
+
+    return synthetic
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db", help="path of the database, which must not exist")
+    parser.add_argument("--jobs", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    async with aiosqlite.connect(args.db) as db:
+        await generate(db, args.jobs, args.seed)
+    print(f"inserted {args.jobs} jobs in {time.perf_counter() - start:.0f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+# latency and query plans of the database operations on the hot paths of gantry,
+# on databases of increasing size. see docs/testing.md
+
+import itertools
+import json
+import re
+from typing import Iterator
+
+import pytest
+from synthetic import Synthetic
+
+from gantry.clients.db import insert_job, job_exists
+from gantry.routes.prediction import SAMPLERS, predict
+
+pytest.importorskip("pytest_benchmark")
+
+PLANS_FILE = "benchmarks/plans.json"
+# specs predicted in turn by the prediction benchmarks
+SPECS = 1000
+
+
+def specs() -> itertools.cycle:
+    """
+    specs of the same packages as the synthetic jobs. most were built before,
+    the others are of new versions, which are predicted from the lower tiers
+    """
+
+    synthetic = Synthetic()
+    specs = [synthetic.spec() for _ in range(SPECS)]
+    for spec in specs[::10]:
+        spec["pkg_version"] = "100.0.0"
+    return itertools.cycle(specs)
+
+
+def new_jobs(jobs: int) -> Iterator[dict]:
+    """jobs that aren't in a database of this size yet"""
+
+    synthetic = Synthetic()
+    return (synthetic.job(i) for i in itertools.count(jobs))
+
+
+@pytest.mark.parametrize("sampler", SAMPLERS)
+def test_predict(benchmark, loop, db, jobs, sampler):
+    spec = specs()
+    benchmark.extra_info["jobs"] = jobs
+    benchmark(lambda: loop.run_until_complete(predict(db, next(spec), sampler)))
+
+
+def test_insert_job(benchmark, loop, db, jobs):
+    """the insert, and the rollup update of develop builds, without the commit"""
+
+    job = new_jobs(jobs)
+    benchmark.extra_info["jobs"] = jobs
+    try:
+        benchmark(lambda: loop.run_until_complete(insert_job(db, next(job))))
+    finally:
+        # the database is kept for the next run
+        loop.run_until_complete(db.rollback())
+
+
+def test_job_exists(benchmark, loop, db, jobs):
+    """the check of every webhook, for jobs that weren't collected yet"""
+
+    gitlab_id = (job["gitlab_id"] for job in new_jobs(jobs))
+    benchmark.extra_info["jobs"] = jobs
+    benchmark(lambda: loop.run_until_complete(job_exists(db, next(gitlab_id))))
+
+
+def test_plans(request, loop, db, jobs):
+    """
+    The plans of the statements of each operation are those in PLANS_FILE,
+    whatever the size of the database, and none of them reads the whole jobs table.
+    Run with --update-plans to record changes to the plans.
+    """
+
+    spec = next(specs())
+    operations = {
+        **{
+            f"predict[{sampler}]": lambda sampler=sampler: predict(db, spec, sampler)
+            for sampler in SAMPLERS
+        },
+        "insert_job": lambda: insert_job(db, next(new_jobs(jobs))),
+        "job_exists": lambda: job_exists(db, 1),
+    }
+
+    plans = {}
+    for name, operation in operations.items():
+        plans[name] = loop.run_until_complete(query_plans(db, operation))
+    loop.run_until_complete(db.rollback())
+
+    for name, plan in plans.items():
+        for line in itertools.chain(*plan):
+            assert not re.match(r"\s*SCAN jobs\b", line), f"{name} scans jobs"
+
+    if request.config.getoption("update_plans"):
+        with open(PLANS_FILE, "w") as f:
+            json.dump(plans, f, indent=2)
+            f.write("\n")
+        return
+
+    with open(PLANS_FILE) as f:
+        assert plans == json.load(f)
+
+
+async def query_plans(db, operation) -> list[list[str]]:
+    """
+    Runs an operation and explains the statements it ran.
+
+    returns: for each statement, the lines of EXPLAIN QUERY PLAN,
+        indented like the output of the sqlite3 shell
+    """
+
+    statements = []
+    # the callback receives statements with their parameters bound
+    await db.set_trace_callback(statements.append)
+    try:
+        await operation()
+    finally:
+        await db.set_trace_callback(None)
+
+    plans = []
+    for statement in statements:
+        async with db.execute(f"EXPLAIN QUERY PLAN {statement}") as cursor:
+            rows = await cursor.fetchall()
+        depth = {0: -1}
+        lines = []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append("  " * depth[node] + detail)
+        # transactions and the statements of triggers aren't explained
+        if lines:
+            plans.append(lines)
+
+    return plans
@@ -0,0 +1,179 @@
+# measures /v1/allocation latency while jobs are being collected
+#
+# a synthetic database is created in a temporary directory, then predictions are
+# requested by concurrent clients while collection workers insert jobs.
+# this is done with the previous setup (one connection serving reads and writes,
+# one commit per job) and with the current one (WAL, a read pool and the DB writer)
+#
+# usage: python dev/bench_allocation.py [--jobs 50000] [--seconds 10]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import aiosqlite
+
+from gantry.__main__ import apply_migrations
+from gantry.clients import db
+from gantry.routes.prediction import predict
+
+PACKAGES = [f"pkg-{i}" for i in range(500)]
+VERSIONS = ["1.0", "1.1", "2.0"]
+COMPILERS = [("gcc", "11.4.0"), ("gcc", "12.3.0"), ("oneapi", "2024.1.0")]
+
+
+def variants() -> dict:
+    return {
+        "mpi": random.random() < 0.5,
+        "cuda": random.random() < 0.2,
+        "shared": True,
+        "build_system": "cmake",
+    }
+
+
+def job(gitlab_id: int) -> dict:
+    compiler_name, compiler_version = random.choice(COMPILERS)
+    mean = random.uniform(0.5, 16)
+    return {
+        "pod": f"pod-{gitlab_id}",
+        "node": 1,
+        "start": 1_700_000_000 + gitlab_id * 10,
+        "end": 1_700_000_000 + gitlab_id * 10 + 600,
+        "gitlab_id": gitlab_id,
+        "job_status": "success",
+        "ref": "develop",
+        "pkg_name": random.choice(PACKAGES),
+        "pkg_version": random.choice(VERSIONS),
+        "pkg_variants": json.dumps(variants()),
+        "compiler_name": compiler_name,
+        "compiler_version": compiler_version,
+        "arch": "linux-ubuntu20.04-x86_64_v3",
+        "stack": "e4s",
+        "build_jobs": 16,
+        "cpu_request": 1,
+        "cpu_limit": None,
+        "cpu_mean": mean,
+        "cpu_median": mean,
+        "cpu_max": mean * 1.5,
+        "cpu_min": mean / 2,
+        "cpu_stddev": 0.1,
+        "mem_request": 2e9,
+        "mem_limit": 64e9,
+        "mem_mean": mean * 1e9,
+        "mem_median": mean * 1e9,
+        "mem_max": mean * 1.5e9,
+        "mem_min": mean * 0.5e9,
+        "mem_stddev": 1e8,
+    }
+
+
+def spec() -> dict:
+    compiler_name, compiler_version = random.choice(COMPILERS)
+    pkg_variants = variants()
+    return {
+        "pkg_name": random.choice(PACKAGES),
+        "pkg_version": random.choice(VERSIONS),
+        "pkg_variants": json.dumps(pkg_variants),
+        "pkg_variants_dict": pkg_variants,
+        "compiler_name": compiler_name,
+        "compiler_version": compiler_version,
+    }
+
+
+async def create(path: str, jobs: int):
+    conn = await aiosqlite.connect(path)
+    await apply_migrations(conn)
+    await db.insert_node(
+        conn,
+        {
+            "uuid": "node",
+            "hostname": "node",
+            "cores": 32,
+            "mem": 128e9,
+            "arch": "amd64",
+            "os": "linux",
+            "instance_type": "i3en.6xlarge",
+        },
+    )
+    for gitlab_id in range(jobs):
+        await db.insert_job(conn, job(gitlab_id))
+    await conn.commit()
+    await conn.close()
+
+
+async def run(path: str, pooled: bool, args) -> list[float]:
+    writer_conn = await aiosqlite.connect(path)
+    if pooled:
+        await db.configure(writer_conn, wal=True)
+        writer = db.DBWriter(writer_conn)
+        writer.start()
+        reader = db.ReadPool(path, args.readers)
+        await reader.open()
+    else:
+        writer = None
+
+    latencies = []
+    next_id = args.jobs
+    deadline = time.monotonic() + args.seconds
+
+    async def collect():
+        nonlocal next_id
+        while time.monotonic() < deadline:
+            next_id += 1
+            await db.write(writer_conn, writer, db.insert_job, job(next_id))
+
+    async def allocate():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            if pooled:
+                async with reader.acquire() as conn:
+                    await predict(conn, spec())
+            else:
+                await predict(writer_conn, spec())
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(
+        *(collect() for _ in range(args.collectors)),
+        *(allocate() for _ in range(args.clients)),
+    )
+
+    if pooled:
+        await writer.stop()
+        await reader.close()
+    await writer_conn.close()
+    return latencies
+
+
+def report(name: str, latencies: list[float]):
+    cuts = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<10} {len(latencies):>8} {cuts[49] * 1000:>9.2f} "
+        f"{cuts[98] * 1000:>9.2f} {max(latencies) * 1000:>9.2f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=50_000)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--collectors", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'setup':<10} {'requests':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, pooled in (("single", False), ("pooled", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "gantry.db")
+            random.seed(0)
+            await create(path, args.jobs)
+            report(name, await run(path, pooled, args))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
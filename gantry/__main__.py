@@ -1,11 +1,23 @@
+import argparse
+import asyncio
+import json
 import logging
 import os
 
 import aiosqlite
 from aiohttp import web
 
+from gantry.clients.db import DBWriter, ReadPool, configure
 from gantry.clients.gitlab import GitlabClient
+from gantry.clients.http import create_session
 from gantry.clients.prometheus import PrometheusClient
+from gantry.routes.artifact import export_predictions
+from gantry.routes.bench import bench_predict, format_report
+from gantry.routes.collection import Collector
+from gantry.routes.prediction import SAMPLERS
+from gantry.util.cache import AllocationCache, NodeCache
+from gantry.util.profiling import Profiler, ProfileStore, profile_requests
+from gantry.util.spec import canonical_variants, variants_hash
 from gantry.views import routes
 
 logger = logging.getLogger(__name__)
@@ -28,8 +40,27 @@ async def apply_migrations(db: aiosqlite.Connection):
         # and not inadvertently added to the migrations folder
         ("001_initial.sql", 1),
         ("002_spec_index.sql", 2),
+        ("003_inbox.sql", 3),
+        ("004_exp_variants.sql", 4),
+        ("005_variants_hash.sql", 5),
+        ("006_sample_rollup.sql", 6),
+        ("007_develop_indexes.sql", 7),
     ]
 
+    # rewriting rows needs the same serialization as the application
+    await db.create_function(
+        "canonical_variants",
+        1,
+        lambda variants: canonical_variants(json.loads(variants)),
+        deterministic=True,
+    )
+    await db.create_function(
+        "variants_hash",
+        1,
+        lambda variants: variants_hash(json.loads(variants)),
+        deterministic=True,
+    )
+
     # apply migrations that have not been applied
     # by comparing the current version to the version of the migration
     for migration, version in migrations:
@@ -44,28 +75,177 @@ async def apply_migrations(db: aiosqlite.Connection):
 
 async def init_db(app: web.Application):
     db = await aiosqlite.connect(os.environ["DB_FILE"])
+    await configure(db, wal=True)
     await apply_migrations(db)
     app["db"] = db
+    # allocation queries run on their own connections so they don't queue
+    # behind collection writes or each other
+    reader = ReadPool(
+        os.environ["DB_FILE"], size=int(os.environ.get("DB_READ_CONNECTIONS", 4))
+    )
+    await reader.open()
+    app["db_read"] = reader
+    # collected jobs are committed in groups by a single writer task
+    writer = DBWriter(
+        db,
+        max_batch=int(os.environ.get("DB_WRITE_BATCH_SIZE", 100)),
+        max_delay=float(os.environ.get("DB_WRITE_DELAY_MS", 50)) / 1000,
+    )
+    writer.start()
+    app["db_writer"] = writer
+    app["prediction_snapshot"] = None
+    if app["prediction_sampler"] == "columnar":
+        # numpy is only needed for this sampler
+        from gantry.routes.columnar import ColumnarSnapshot
+
+        snapshot = ColumnarSnapshot()
+        logger.info(f"loaded {await snapshot.load(db)} builds into memory")
+        app["prediction_snapshot"] = snapshot
     yield
+    await writer.stop()
+    await reader.close()
     await db.close()
 
 
 async def init_clients(app: web.Application):
+    # one pooled session is shared by all clients so connections are reused
+    session = create_session()
+    app["http"] = session
     app["gitlab"] = GitlabClient(
-        os.environ["GITLAB_URL"], os.environ["GITLAB_API_TOKEN"]
+        os.environ["GITLAB_URL"],
+        os.environ["GITLAB_API_TOKEN"],
+        session=session,
+        log_max_bytes=int(os.environ.get("GITLAB_LOG_MAX_BYTES", 0)),
     )
     app["prometheus"] = PrometheusClient(
-        os.environ["PROMETHEUS_URL"], os.environ.get("PROMETHEUS_COOKIE", "")
+        os.environ["PROMETHEUS_URL"],
+        os.environ.get("PROMETHEUS_COOKIE", ""),
+        session=session,
+        usage_mode=os.environ.get("PROMETHEUS_USAGE_MODE", "range"),
     )
+    yield
+    await session.close()
 
 
-def main():
+async def init_collector(app: web.Application):
+    # bounds the number of concurrent collections and jobs waiting for one
+    collector = Collector(
+        app["db"],
+        app["gitlab"],
+        app["prometheus"],
+        workers=int(os.environ.get("COLLECT_WORKERS", 8)),
+        max_depth=int(os.environ.get("COLLECT_QUEUE_SIZE", 5000)),
+        poll_interval=float(os.environ.get("COLLECT_POLL_INTERVAL", 30)),
+        batch_size=int(os.environ.get("COLLECT_BATCH_SIZE", 1)),
+        writer=app["db_writer"],
+        node_cache=NodeCache(
+            size=int(os.environ.get("NODE_CACHE_SIZE", 1000)),
+            ttl=float(os.environ.get("NODE_CACHE_TTL", 600)),
+        ),
+        allocation_cache=app["allocation_cache"],
+        snapshot=app["prediction_snapshot"],
+    )
+    await collector.start()
+    app["collector"] = collector
+    yield
+    await collector.stop()
+
+
+async def export(args: argparse.Namespace):
+    # the database is only read, so this can run next to the application
+    db = await aiosqlite.connect(f"file:{args.db}?mode=ro", uri=True)
+    try:
+        exported = await export_predictions(db, args.output)
+    finally:
+        await db.close()
+    print(f"exported {exported} predictions to {args.output}")
+
+
+async def bench(args: argparse.Namespace):
+    report = await bench_predict(args.db, args.jobs, args.concurrency, args.sampler)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+def serve():
     app = web.Application()
     app.add_routes(routes)
+    # how allocation requests select the builds they are based on
+    sampler = os.environ.get("PREDICTION_SAMPLER", "rollup")
+    # columnar is not in SAMPLERS as it reads from memory rather than a connection
+    if sampler not in SAMPLERS and sampler != "columnar":
+        raise ValueError(f"unknown prediction sampler {sampler}")
+    app["prediction_sampler"] = sampler
+    # predictions are dropped when collection inserts a build of their package
+    app["allocation_cache"] = AllocationCache(
+        size=int(os.environ.get("ALLOCATION_CACHE_SIZE", 10000))
+    )
+    # requests are only profiled when their profiles can be downloaded,
+    # otherwise the middleware isn't installed and costs nothing
+    if token := os.environ.get("PROFILE_TOKEN"):
+        store = ProfileStore(size=int(os.environ.get("PROFILE_KEEP", 20)))
+        app["profiles"] = store
+        app["profile_token"] = token
+        app.middlewares.append(
+            profile_requests(
+                store,
+                Profiler(
+                    interval=float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+                ),
+                sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+                header=os.environ.get("PROFILE_HEADER", "X-Gantry-Profile"),
+                token=token,
+            )
+        )
     app.cleanup_ctx.append(init_db)
-    app.on_startup.append(init_clients)
+    app.cleanup_ctx.append(init_clients)
+    app.cleanup_ctx.append(init_collector)
     web.run_app(app)
 
 
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m gantry", description="runs the application by default"
+    )
+    commands = parser.add_subparsers(dest="command")
+
+    export_parser = commands.add_parser(
+        "export-predictions",
+        help="write the current predictions to a file clients can read them from",
+    )
+    export_parser.add_argument("output", help="path of the artifact")
+    export_parser.add_argument(
+        "--db", default=os.environ.get("DB_FILE"), help="defaults to $DB_FILE"
+    )
+
+    bench_parser = commands.add_parser(
+        "bench-predict",
+        help="predict the most recent jobs from the ones before them and report "
+        "latency and accuracy",
+    )
+    bench_parser.add_argument(
+        "--db", default=os.environ.get("DB_FILE"), help="defaults to $DB_FILE"
+    )
+    bench_parser.add_argument(
+        "--jobs", type=int, default=4000, help="number of jobs to predict"
+    )
+    bench_parser.add_argument(
+        "--concurrency", type=int, default=16, help="predictions running at once"
+    )
+    bench_parser.add_argument(
+        "--sampler",
+        default=os.environ.get("PREDICTION_SAMPLER", "rollup"),
+        help="defaults to $PREDICTION_SAMPLER",
+    )
+    bench_parser.add_argument("--json", action="store_true", help="print JSON")
+
+    args = parser.parse_args()
+    if args.command == "export-predictions":
+        asyncio.run(export(args))
+    elif args.command == "bench-predict":
+        asyncio.run(bench(args))
+    else:
+        serve()
+
+
 if __name__ == "__main__":
     main()
@@ -1,3 +1,6 @@
 # flake8: noqa
 from .get import *
+from .inbox import *
 from .insert import *
+from .pool import *
+from .writer import *
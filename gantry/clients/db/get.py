@@ -2,8 +2,16 @@ import logging
 
 import aiosqlite
 
+from gantry.util.metrics import Histogram
+
 logger = logging.getLogger(__name__)
 
+query_seconds = Histogram(
+    "gantry_db_query_seconds",
+    "seconds spent in queries on the hot paths, by query",
+    ["query"],
+)
+
 
 async def get_node(db: aiosqlite.Connection, uuid: str) -> int | None:
     """return the primary key if found, otherwise return None"""
@@ -15,14 +23,35 @@ async def get_node(db: aiosqlite.Connection, uuid: str) -> int | None:
     return None
 
 
-async def job_exists(db: aiosqlite.Connection, gl_id: int) -> bool:
-    """return if the job exists in the database"""
+async def recent_nodes(
+    db: aiosqlite.Connection, limit: int
+) -> list[tuple[str, str, int, int]]:
+    """
+    return (hostname, uuid, id, end of the node's last job) of the nodes
+    with the most recent jobs, most recent first
+    """
 
     async with db.execute(
-        "select id from jobs where gitlab_id = ?", (gl_id,)
+        """
+        select nodes.hostname, nodes.uuid, nodes.id, max(jobs.end) as last_seen
+        from nodes join jobs on jobs.node = nodes.id
+        group by nodes.id order by last_seen desc limit ?
+        """,
+        (limit,),
     ) as cursor:
-        if await cursor.fetchone():
-            logger.warning(f"job {gl_id} exists. look into duplicate webhook calls.")
-            return True
+        return await cursor.fetchall()
+
+
+async def job_exists(db: aiosqlite.Connection, gl_id: int) -> bool:
+    """return if the job exists in the database"""
+
+    with query_seconds.time("job_exists"):
+        async with db.execute(
+            "select id from jobs where gitlab_id = ?", (gl_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+    if row:
+        logger.warning(f"job {gl_id} exists. look into duplicate webhook calls.")
+        return True
 
     return False
@@ -0,0 +1,110 @@
+import json
+import time
+
+import aiosqlite
+
+# collections interrupted this many times are not resumed again
+MAX_INBOX_ATTEMPTS = 3
+# done and failed rows are kept around this long for debugging
+INBOX_RETENTION = 7 * 24 * 60 * 60  # 7 days in seconds
+
+
+async def append_inbox(db: aiosqlite.Connection, payload: dict) -> int:
+    """Stores a webhook payload as pending and returns its inbox id."""
+
+    now = int(time.time())
+    async with db.execute(
+        "INSERT INTO inbox (payload, received, updated) VALUES (?, ?, ?)",
+        (json.dumps(payload), now, now),
+    ) as cursor:
+        return cursor.lastrowid
+
+
+async def claim_inbox(db: aiosqlite.Connection, inbox_id: int) -> dict | None:
+    """
+    Marks a pending row as running.
+
+    returns: the stored payload, or None if the row was not pending
+    """
+
+    async with db.execute(
+        """
+        UPDATE inbox SET status='running', attempts=attempts+1, updated=?
+        WHERE id=? AND status='pending' RETURNING payload
+        """,
+        (int(time.time()), inbox_id),
+    ) as cursor:
+        row = await cursor.fetchone()
+
+    return json.loads(row[0]) if row else None
+
+
+async def finish_inbox(db: aiosqlite.Connection, inbox_id: int, status: str) -> None:
+    """Marks a row as done or failed."""
+
+    await db.execute(
+        "UPDATE inbox SET status=?, updated=? WHERE id=?",
+        (status, int(time.time()), inbox_id),
+    )
+
+
+async def retry_inbox(db: aiosqlite.Connection, inbox_id: int) -> None:
+    """
+    Returns a row to pending after an attempt that failed on something
+    temporary, unless it has been attempted too many times.
+    """
+
+    await db.execute(
+        """
+        UPDATE inbox
+        SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, updated=?
+        WHERE id=?
+        """,
+        (MAX_INBOX_ATTEMPTS, int(time.time()), inbox_id),
+    )
+
+
+async def pending_inbox(db: aiosqlite.Connection, limit: int) -> list[int]:
+    """Returns the ids of the oldest pending rows."""
+
+    async with db.execute(
+        "SELECT id FROM inbox WHERE status='pending' ORDER BY id LIMIT ?", (limit,)
+    ) as cursor:
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def reset_inbox(db: aiosqlite.Connection) -> int:
+    """
+    Returns rows left running by a previous process to pending, unless they
+    have been attempted too many times.
+
+    returns: number of rows that will be resumed
+    """
+
+    now = int(time.time())
+    await db.execute(
+        "UPDATE inbox SET status='failed', updated=? "
+        "WHERE status='running' AND attempts >= ?",
+        (now, MAX_INBOX_ATTEMPTS),
+    )
+    async with db.execute(
+        "UPDATE inbox SET status='pending', updated=? WHERE status='running'",
+        (now,),
+    ) as cursor:
+        resumed = cursor.rowcount
+
+    return resumed
+
+
+async def prune_inbox(db: aiosqlite.Connection) -> int:
+    """
+    Deletes done and failed rows older than INBOX_RETENTION.
+
+    returns: number of deleted rows
+    """
+
+    async with db.execute(
+        "DELETE FROM inbox WHERE status IN ('done', 'failed') AND updated < ?",
+        (int(time.time()) - INBOX_RETENTION,),
+    ) as cursor:
+        return cursor.rowcount
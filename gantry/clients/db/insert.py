@@ -1,8 +1,10 @@
+import json
 import logging
 
 import aiosqlite
 
 from gantry.clients.db.get import get_node
+from gantry.util.spec import variants_hash
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +65,11 @@ async def insert_node(db: aiosqlite.Connection, node: dict) -> int:
 async def insert_job(db: aiosqlite.Connection, job: dict) -> int:
     """Inserts a job into the database."""
 
+    # derived here so that every job is stored with it
+    if "pkg_variants" in job:
+        variants = json.loads(job["pkg_variants"])
+        job = {**job, "pkg_variants_hash": variants_hash(variants)}
+
     async with db.execute(
         *insert_dict(
             "jobs",
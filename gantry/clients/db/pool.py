@@ -0,0 +1,112 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import aiosqlite
+
+from gantry.util.metrics import Histogram
+
+# applied to every connection of the application
+PRAGMAS = {
+    # with WAL, NORMAL only syncs at checkpoints. commits survive application
+    # crashes but the most recent ones may be lost on power failure
+    "synchronous": "NORMAL",
+    # negative values are in KiB, this is 64MB of page cache per connection
+    "cache_size": -64_000,
+    # read the database through the OS page cache instead of copying pages
+    "mmap_size": 256 * 1024 * 1024,
+    # wait for locks held by other connections instead of failing
+    "busy_timeout": 5_000,
+}
+
+read_wait_seconds = Histogram(
+    "gantry_db_read_wait_seconds",
+    "seconds waited for a connection of the read pool",
+)
+
+
+async def configure(db: aiosqlite.Connection, wal: bool = False) -> None:
+    """
+    Applies PRAGMAS to a connection.
+
+    args:
+        wal: switch the database to write-ahead logging, so reads from other
+            connections don't wait for writes and vice versa. this is stored
+            in the database file and only needs to be done by the writer
+    """
+
+    if wal:
+        await db.execute("PRAGMA journal_mode=WAL")
+    for pragma, value in PRAGMAS.items():
+        await db.execute(f"PRAGMA {pragma}={value}")
+
+
+class ReadPool:
+    """
+    A fixed set of read-only connections to the database.
+
+    Each aiosqlite connection runs its queries on its own thread, so reads on
+    different connections of the pool run in parallel with each other and with
+    the writer connection.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.idle = []
+        # futures of callers waiting for a connection, first come first served
+        self.waiters = deque()
+        self.connections = []
+
+    async def open(self) -> None:
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(f"file:{self.path}?mode=ro", uri=True)
+            await configure(conn)
+            self.connections.append(conn)
+            self.idle.append(conn)
+
+    async def close(self) -> None:
+        for conn in self.connections:
+            await conn.close()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Waits for an idle connection and lends it out."""
+
+        if self.idle and not self.waiters:
+            conn = self.idle.pop()
+            read_wait_seconds.observe(0)
+        else:
+            start = time.perf_counter()
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                conn = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # a connection was handed over just before the cancellation
+                    self._release(waiter.result())
+                elif waiter in self.waiters:
+                    # otherwise a release already skipped it
+                    self.waiters.remove(waiter)
+                raise
+            read_wait_seconds.observe(time.perf_counter() - start)
+
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def _release(self, conn: aiosqlite.Connection) -> None:
+        # connections are handed directly to the longest waiting caller,
+        # otherwise a busy caller could take it back before the waiter wakes up
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            # the caller was cancelled but hasn't woken up to leave the queue yet
+            if not waiter.done():
+                waiter.set_result(conn)
+                return
+
+        self.idle.append(conn)
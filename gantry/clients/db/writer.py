@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+import aiosqlite
+
+from gantry.util.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+write_seconds = Histogram(
+    "gantry_db_write_seconds",
+    "seconds to run and commit a group of writes of the database writer",
+)
+
+
+class DBWriter:
+    """
+    Runs all writes to a connection from a single task and commits them in groups.
+
+    Callers submit an operation and wait for its result. The writer takes
+    operations from its queue until max_batch of them are waiting or max_delay
+    seconds have passed since the first one, runs each in its own savepoint and
+    commits the group at once. Results are only handed back after the commit,
+    so a returned row id is durable.
+    """
+
+    def __init__(
+        self,
+        db_conn: aiosqlite.Connection,
+        max_batch: int = 100,
+        max_delay: float = 0.05,
+    ):
+        """
+        args:
+            max_batch: maximum number of operations per commit
+            max_delay: seconds an operation may wait for others to share its commit
+        """
+        self.db = db_conn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.commits = 0
+        self.writes = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self._write_forever())
+
+    async def stop(self):
+        """
+        Writes the operations that are still queued and stops. If the writer task
+        has died, the operations left in the queue fail instead.
+        """
+        if not self.task.done():
+            written = asyncio.create_task(self.queue.join())
+            await asyncio.wait(
+                [written, self.task], return_when=asyncio.FIRST_COMPLETED
+            )
+            written.cancel()
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+        while not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            self.queue.task_done()
+            if not future.done():
+                future.set_exception(RuntimeError("database writer stopped"))
+
+    async def submit(self, func: Callable[..., Awaitable], *args) -> Any:
+        """
+        Runs func(connection, *args) in the next group and returns its result
+        once the group is committed. Exceptions raised by func are re-raised here
+        and only roll back its own changes.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((func, args, future))
+        return await future
+
+    async def _write_forever(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                with write_seconds.time():
+                    await self._write(batch)
+            except Exception as e:
+                # e.g. the rollback of a failed commit failed as well. the group
+                # fails, but the writer must keep serving the next groups
+                logger.exception("group write failed")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write(self, batch: list):
+        outcomes = []
+        try:
+            # otherwise releasing the first savepoint would commit on its own
+            if not self.db.in_transaction:
+                await self.db.execute("BEGIN")
+
+            for func, args, future in batch:
+                await self.db.execute("SAVEPOINT write")
+                try:
+                    result = await func(self.db, *args)
+                except Exception as e:
+                    await self.db.execute("ROLLBACK TO write")
+                    outcomes.append((future, e))
+                else:
+                    outcomes.append((future, result))
+                await self.db.execute("RELEASE write")
+
+            await self.db.commit()
+            self.commits += 1
+        except Exception as e:
+            logger.exception("group commit failed")
+            await self.db.rollback()
+            outcomes = [(future, e) for _, _, future in batch]
+
+        self.writes += len(batch)
+        for future, outcome in outcomes:
+            # the caller may have stopped waiting
+            if future.done():
+                continue
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+
+async def write(
+    db_conn: aiosqlite.Connection,
+    writer: DBWriter | None,
+    func: Callable[..., Awaitable],
+    *args,
+) -> Any:
+    """
+    Runs func(connection, *args) through the writer if there is one,
+    otherwise directly on db_conn followed by a commit.
+    """
+
+    if writer:
+        return await writer.submit(func, *args)
+
+    result = await func(db_conn, *args)
+    await db_conn.commit()
+    return result
@@ -1,10 +1,39 @@
+import re
+from contextlib import aclosing
+from typing import AsyncIterator
+
 import aiohttp
 
+from gantry.clients import http
+
+# size of the pieces job logs are read in
+LOG_CHUNK_SIZE = 64 * 1024
+# bytes of a chunk kept to find matches that continue into the next one
+LOG_MATCH_OVERLAP = 256
+
 
 class GitlabClient:
-    def __init__(self, base_url: str, api_token: str):
+    def __init__(
+        self,
+        base_url: str,
+        api_token: str,
+        session: aiohttp.ClientSession | None = None,
+        log_max_bytes: int = 0,
+    ):
+        """
+        args:
+            log_max_bytes: when set, log scans only request this many bytes
+                from the start of the log (0 reads until a marker is found)
+        """
         self.base_url = base_url
         self.headers = {"PRIVATE-TOKEN": api_token}
+        # shared session (see gantry.clients.http.create_session),
+        # without one each request opens its own
+        self.session = session
+        self.log_max_bytes = log_max_bytes
+        # totals across all log scans
+        self.logs_scanned = 0
+        self.log_bytes_read = 0
 
     async def _request(self, url: str, response_type: str) -> dict | str:
         """
@@ -17,15 +46,71 @@ class GitlabClient:
         returns: the response from Gitlab in the specified format
         """
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.headers) as resp:
-                if response_type == "json":
-                    return await resp.json()
-                if response_type == "text":
-                    return await resp.text()
+        async with http.get(self.session, url, headers=self.headers) as resp:
+            if response_type == "json":
+                return await resp.json()
+            if response_type == "text":
+                return await resp.text()
+
+    async def _stream(self, url: str, headers: dict) -> AsyncIterator[bytes]:
+        """Yields the body of a response in chunks as it arrives."""
+
+        async with http.get(self.session, url, headers=self.headers | headers) as resp:
+            # a range starting past the end of an empty log
+            if resp.status == 416:
+                return
+            async for chunk in resp.content.iter_chunked(LOG_CHUNK_SIZE):
+                yield chunk
 
     async def job_log(self, gl_id: int) -> str:
         """Given a job id, returns the log from that job"""
 
         url = f"{self.base_url}/jobs/{gl_id}/trace"
         return await self._request(url, "text")
+
+    async def scan_log(
+        self, gl_id: int, patterns: list[re.Pattern]
+    ) -> tuple[re.Pattern | None, int]:
+        """
+        Reads a job's log until one of the patterns matches, without keeping
+        the log in memory. The rest of the log is not downloaded.
+
+        args:
+            gl_id: gitlab job id
+            patterns: compiled bytes patterns, each expected to match
+                less than LOG_MATCH_OVERLAP bytes
+
+        returns: (the pattern that matches first or None, number of bytes read)
+        """
+
+        url = f"{self.base_url}/jobs/{gl_id}/trace"
+        headers = {}
+        if self.log_max_bytes:
+            # servers that don't support ranges send the whole log,
+            # which is cut off below instead
+            headers["Range"] = f"bytes=0-{self.log_max_bytes - 1}"
+
+        # enough of the previous chunk to find matches split between two chunks
+        tail = b""
+        read = 0
+        found = None
+
+        async with aclosing(self._stream(url, headers)) as chunks:
+            async for chunk in chunks:
+                read += len(chunk)
+                window = tail + chunk
+                positions = [
+                    (match.start(), i)
+                    for i, pattern in enumerate(patterns)
+                    if (match := pattern.search(window))
+                ]
+                if positions:
+                    found = patterns[min(positions)[1]]
+                    break
+                if self.log_max_bytes and read >= self.log_max_bytes:
+                    break
+                tail = window[-LOG_MATCH_OVERLAP:]
+
+        self.logs_scanned += 1
+        self.log_bytes_read += read
+        return found, read
@@ -0,0 +1,163 @@
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import aiohttp
+
+from gantry.util.metrics import Histogram
+
+# connection pool defaults, each can be overridden through the environment
+DEFAULT_POOL_LIMIT = 100
+DEFAULT_POOL_LIMIT_PER_HOST = 30
+# seconds an idle connection is kept open for reuse
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+# seconds a full request (including reading the body) is allowed to take
+DEFAULT_TIMEOUT = 120
+DEFAULT_CONNECT_TIMEOUT = 10
+
+upstream_seconds = Histogram(
+    "gantry_upstream_request_seconds",
+    "seconds until the response headers of an upstream request were received, "
+    "by host and status (error when no response was received)",
+    ["host", "status"],
+)
+
+
+class PoolStats(aiohttp.TraceConfig):
+    """
+    Records connection pool utilization of a ClientSession.
+
+    Counters are kept per upstream host and updated through aiohttp's
+    request tracing signals, so no request code needs to be aware of them.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.hosts = defaultdict(
+            lambda: {
+                "requests": 0,
+                "in_flight": 0,
+                "peak_in_flight": 0,
+                "connections_created": 0,
+                "connections_reused": 0,
+                # requests that had to wait for a free connection in the pool
+                "queued": 0,
+                "queued_seconds": 0.0,
+            }
+        )
+
+        self.on_request_start.append(self._request_start)
+        self.on_request_end.append(self._request_end)
+        self.on_request_exception.append(self._request_exception)
+        self.on_connection_queued_start.append(self._queued_start)
+        self.on_connection_queued_end.append(self._queued_end)
+        self.on_connection_create_end.append(self._connection_created)
+        self.on_connection_reuseconn.append(self._connection_reused)
+
+    async def _request_start(self, session, ctx, params):
+        ctx.host = params.url.host
+        ctx.queued_at = None
+        ctx.started_at = time.perf_counter()
+        host = self.hosts[ctx.host]
+        host["requests"] += 1
+        host["in_flight"] += 1
+        host["peak_in_flight"] = max(host["peak_in_flight"], host["in_flight"])
+
+    async def _request_end(self, session, ctx, params):
+        self.hosts[ctx.host]["in_flight"] -= 1
+        upstream_seconds.observe(
+            time.perf_counter() - ctx.started_at, ctx.host, str(params.response.status)
+        )
+
+    async def _request_exception(self, session, ctx, params):
+        self.hosts[ctx.host]["in_flight"] -= 1
+        upstream_seconds.observe(
+            time.perf_counter() - ctx.started_at, ctx.host, "error"
+        )
+
+    async def _queued_start(self, session, ctx, params):
+        self.hosts[ctx.host]["queued"] += 1
+        ctx.queued_at = session.loop.time()
+
+    async def _queued_end(self, session, ctx, params):
+        if ctx.queued_at is not None:
+            self.hosts[ctx.host]["queued_seconds"] += (
+                session.loop.time() - ctx.queued_at
+            )
+
+    async def _connection_created(self, session, ctx, params):
+        self.hosts[ctx.host]["connections_created"] += 1
+
+    async def _connection_reused(self, session, ctx, params):
+        self.hosts[ctx.host]["connections_reused"] += 1
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Creates a long-lived ClientSession with a shared connection pool.
+    The session is meant to be created once at startup and closed on cleanup,
+    so connections (and TLS handshakes) are reused across requests.
+
+    Pool limits and timeouts are configured through the environment:
+    HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT
+    """
+
+    connector = aiohttp.TCPConnector(
+        limit=int(os.environ.get("HTTP_POOL_LIMIT", DEFAULT_POOL_LIMIT)),
+        limit_per_host=int(
+            os.environ.get("HTTP_POOL_LIMIT_PER_HOST", DEFAULT_POOL_LIMIT_PER_HOST)
+        ),
+        keepalive_timeout=float(
+            os.environ.get("HTTP_KEEPALIVE_TIMEOUT", DEFAULT_KEEPALIVE_TIMEOUT)
+        ),
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=float(os.environ.get("HTTP_TIMEOUT", DEFAULT_TIMEOUT)),
+        connect=float(os.environ.get("HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+    )
+
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        # clients pass their credentials with each request, responses
+        # should not leave cookies behind that leak into requests to other hosts
+        cookie_jar=aiohttp.DummyCookieJar(),
+        trace_configs=[PoolStats()],
+    )
+
+
+def pool_stats(session: aiohttp.ClientSession) -> dict:
+    """
+    Returns the pool configuration and per-host utilization of a session
+    created with create_session.
+    """
+
+    stats = next(t for t in session.trace_configs if isinstance(t, PoolStats))
+
+    return {
+        "limit": session.connector.limit,
+        "limit_per_host": session.connector.limit_per_host,
+        "hosts": {host: dict(counters) for host, counters in stats.hosts.items()},
+    }
+
+
+@asynccontextmanager
+async def get(
+    session: aiohttp.ClientSession | None, url: str, **kwargs
+) -> AsyncIterator[aiohttp.ClientResponse]:
+    """
+    Makes a GET request through the shared session. Clients created without one
+    (e.g. in scripts) fall back to a session of their own for the request.
+    """
+
+    if session is not None:
+        async with session.get(url, **kwargs) as resp:
+            yield resp
+        return
+
+    async with aiohttp.ClientSession() as own_session:
+        async with own_session.get(url, **kwargs) as resp:
+            yield resp
@@ -1,7 +1,6 @@
-import json
-
 from gantry.clients.prometheus import util
-from gantry.util.spec import spec_variants
+from gantry.util.spec import canonical_variants, spec_variants
+from gantry.util.tasks import gather
 
 
 class PrometheusJobClient:
@@ -24,39 +23,7 @@ class PrometheusJobClient:
             time=time,
         )
 
-        if not res:
-            raise util.IncompleteData("annotation data is missing")
-
-        annotations = res[0]["labels"]
-
-        try:
-            return {
-                "pod": annotations["pod"],
-                # if build jobs is not set, defaults to 16 due to spack config
-                "build_jobs": annotations.get(
-                    "annotation_metrics_spack_job_build_jobs", 16
-                ),
-                "arch": annotations["annotation_metrics_spack_job_spec_arch"],
-                "pkg_name": annotations["annotation_metrics_spack_job_spec_pkg_name"],
-                "pkg_version": annotations[
-                    "annotation_metrics_spack_job_spec_pkg_version"
-                ],
-                "pkg_variants": json.dumps(
-                    spec_variants(
-                        annotations["annotation_metrics_spack_job_spec_variants"]
-                    )
-                ),
-                "compiler_name": annotations[
-                    "annotation_metrics_spack_job_spec_compiler_name"
-                ],
-                "compiler_version": annotations[
-                    "annotation_metrics_spack_job_spec_compiler_version"
-                ],
-                "stack": annotations["annotation_metrics_spack_ci_stack_name"],
-            }
-        except KeyError as e:
-            # if any of the annotations are missing, raise an error
-            raise util.IncompleteData(f"missing annotation: {e}")
+        return process_annotations(res)
 
     async def get_resources(self, pod: str, time: float) -> tuple[dict, str]:
         """
@@ -66,51 +33,33 @@ class PrometheusJobClient:
         returns: dict of resources and node hostname
         """
 
-        requests = util.process_resources(
-            await self.client.query_single(
+        requests_res, limits_res = await gather(
+            self.client.query_single(
                 query={
                     "metric": "kube_pod_container_resource_requests",
                     "filters": {"container": "build", "pod": pod},
                 },
                 time=time,
-            )
-        )
-
-        limits_res = await self.client.query_single(
-            query={
-                "metric": "kube_pod_container_resource_limits",
-                "filters": {"container": "build", "pod": pod},
-            },
-            time=time,
+            ),
+            self.client.query_single(
+                query={
+                    "metric": "kube_pod_container_resource_limits",
+                    "filters": {"container": "build", "pod": pod},
+                },
+                time=time,
+            ),
         )
 
-        if not limits_res:
-            raise util.IncompleteData("missing limits")
-
-        # instead of needing to fetch the node where the pod ran from kube_pod_info
-        # we can grab it from kube_pod_container_resource_limits
-        # weirdly, it's not available in kube_pod_labels or annotations
-        # https://github.com/kubernetes/kube-state-metrics/issues/1148
-        try:
-            node = limits_res[0]["labels"]["node"]
-        except KeyError:
-            raise util.IncompleteData("missing node label")
-        limits = util.process_resources(limits_res)
-
-        return (
-            {
-                "cpu_request": requests["cpu"]["value"],
-                "mem_request": requests["memory"]["value"],
-                "cpu_limit": limits.get("cpu", {}).get("value"),
-                "mem_limit": limits["memory"]["value"],
-            },
-            node,
-        )
+        return process_job_resources(requests_res, limits_res)
 
     async def get_usage(self, pod: str, start: float, end: float) -> dict:
         """
         Gets resource usage attributes for a job.
 
+        In the default "range" usage mode, every sample of the job is downloaded
+        and summarized here. In "aggregate" mode, Prometheus computes the statistics
+        and only returns the results.
+
         args:
             pod: pod name
             start: start time (unix timestamp)
@@ -118,37 +67,249 @@ class PrometheusJobClient:
         returns: dict of usage stats
         """
 
-        mem_usage = util.process_usage(
-            await self.client.query_range(
+        mem_query = util.query_to_str(
+            metric="container_memory_working_set_bytes",
+            filters={"container": "build", "pod": pod},
+        )
+        cpu_query = (
+            f"rate(container_cpu_usage_seconds_total{{"
+            f"pod='{pod}', container='build'}}[90s])"
+        )
+
+        if self.client.usage_mode == "aggregate":
+            mem_res, cpu_res = await gather(
+                *(
+                    self.client.query_single(
+                        query=util.usage_stats_query(query, start, end), time=end
+                    )
+                    for query in (mem_query, cpu_query)
+                )
+            )
+            return process_job_usage(mem_res, cpu_res, util.process_usage_stats)
+
+        mem_res, cpu_res = await gather(
+            *(
+                self.client.query_range(query=query, start=start, end=end)
+                for query in (mem_query, cpu_query)
+            )
+        )
+
+        return process_job_usage(mem_res, cpu_res)
+
+    # the batch variants below fetch the data of many jobs with one query per metric.
+    # all jobs passed to them should fall within [start, end], and results are
+    # returned per job, with missing data represented by an IncompleteData instance
+
+    async def get_annotations_batch(
+        self, gl_ids: list[int], start: float, end: float
+    ) -> dict[int, dict | util.IncompleteData]:
+        """
+        args:
+            gl_ids: gitlab job ids
+            start, end: window containing all of the jobs (unix timestamps)
+        returns: {gl_id: dict of annotations}
+        """
+
+        res = await self.client.query_single(
+            query=util.last_over_window(
+                {
+                    "metric": "kube_pod_annotations",
+                    "filters": {"annotation_gitlab_ci_job_id": list(gl_ids)},
+                },
+                start,
+                end,
+            ),
+            time=end,
+        )
+
+        by_job = util.group_by_label(res, "annotation_gitlab_ci_job_id")
+        return {
+            gl_id: capture(process_annotations, by_job.get(str(gl_id), []))
+            for gl_id in gl_ids
+        }
+
+    async def get_resources_batch(
+        self, pods: list[str], start: float, end: float
+    ) -> dict[str, tuple[dict, str] | util.IncompleteData]:
+        """
+        args:
+            pods: pod names
+            start, end: window containing all of the pods (unix timestamps)
+        returns: {pod: (dict of resources, node hostname)}
+        """
+
+        requests_res, limits_res = await gather(
+            *(
+                self.client.query_single(
+                    query=util.last_over_window(
+                        {
+                            "metric": metric,
+                            "filters": {"container": "build", "pod": list(pods)},
+                        },
+                        start,
+                        end,
+                    ),
+                    time=end,
+                )
+                for metric in (
+                    "kube_pod_container_resource_requests",
+                    "kube_pod_container_resource_limits",
+                )
+            )
+        )
+
+        requests_by_pod = util.group_by_label(requests_res, "pod")
+        limits_by_pod = util.group_by_label(limits_res, "pod")
+        return {
+            pod: capture(
+                process_job_resources,
+                requests_by_pod.get(pod, []),
+                limits_by_pod.get(pod, []),
+            )
+            for pod in pods
+        }
+
+    async def get_usage_batch(
+        self, windows: dict[str, tuple[float, float]]
+    ) -> dict[str, dict | util.IncompleteData]:
+        """
+        Gets resource usage attributes for multiple jobs with one range query
+        per metric spanning all of the jobs.
+        Jobs have different windows, so this always uses the "range" usage mode.
+
+        args:
+            windows: {pod: (start, end)} of each job
+        returns: {pod: dict of usage stats}
+        """
+
+        start = min(s for s, _ in windows.values())
+        end = max(e for _, e in windows.values())
+        pods = list(windows)
+
+        mem_res, cpu_res = await gather(
+            self.client.query_range(
                 query={
                     "metric": "container_memory_working_set_bytes",
-                    "filters": {"container": "build", "pod": pod},
+                    "filters": {"container": "build", "pod": pods},
                 },
                 start=start,
                 end=end,
-            )
-        )
-
-        cpu_usage = util.process_usage(
-            await self.client.query_range(
+            ),
+            self.client.query_range(
                 query=(
                     f"rate(container_cpu_usage_seconds_total{{"
-                    f"pod='{pod}', container='build'}}[90s])"
+                    f'pod=~"{util.match_any(pods)}", container="build"}}[90s])'
                 ),
                 start=start,
                 end=end,
-            )
+            ),
         )
 
+        mem_by_pod = util.group_by_label(mem_res, "pod")
+        cpu_by_pod = util.group_by_label(cpu_res, "pod")
         return {
-            "cpu_mean": cpu_usage["mean"],
-            "cpu_median": cpu_usage["median"],
-            "cpu_max": cpu_usage["max"],
-            "cpu_min": cpu_usage["min"],
-            "cpu_stddev": cpu_usage["stddev"],
-            "mem_mean": mem_usage["mean"],
-            "mem_median": mem_usage["median"],
-            "mem_max": mem_usage["max"],
-            "mem_min": mem_usage["min"],
-            "mem_stddev": mem_usage["stddev"],
+            pod: capture(
+                process_job_usage,
+                # only keep the samples that fall within the job's own window
+                util.slice_range(mem_by_pod.get(pod, []), pod_start, pod_end),
+                util.slice_range(cpu_by_pod.get(pod, []), pod_start, pod_end),
+            )
+            for pod, (pod_start, pod_end) in windows.items()
         }
+
+
+def capture(process, *args):
+    """Returns the result of process, or the IncompleteData it raised"""
+    try:
+        return process(*args)
+    except util.IncompleteData as e:
+        return e
+
+
+def process_annotations(res: list) -> dict:
+    """Turns a kube_pod_annotations response into the job's attributes"""
+
+    if not res:
+        raise util.IncompleteData("annotation data is missing")
+
+    annotations = res[0]["labels"]
+
+    try:
+        return {
+            "pod": annotations["pod"],
+            # if build jobs is not set, defaults to 16 due to spack config
+            "build_jobs": annotations.get(
+                "annotation_metrics_spack_job_build_jobs", 16
+            ),
+            "arch": annotations["annotation_metrics_spack_job_spec_arch"],
+            "pkg_name": annotations["annotation_metrics_spack_job_spec_pkg_name"],
+            "pkg_version": annotations["annotation_metrics_spack_job_spec_pkg_version"],
+            "pkg_variants": canonical_variants(
+                spec_variants(annotations["annotation_metrics_spack_job_spec_variants"])
+            ),
+            "compiler_name": annotations[
+                "annotation_metrics_spack_job_spec_compiler_name"
+            ],
+            "compiler_version": annotations[
+                "annotation_metrics_spack_job_spec_compiler_version"
+            ],
+            "stack": annotations["annotation_metrics_spack_ci_stack_name"],
+        }
+    except KeyError as e:
+        # if any of the annotations are missing, raise an error
+        raise util.IncompleteData(f"missing annotation: {e}")
+
+
+def process_job_resources(requests_res: list, limits_res: list) -> tuple[dict, str]:
+    """Turns resource request and limit responses into the job's attributes"""
+
+    requests = util.process_resources(requests_res)
+
+    if not limits_res:
+        raise util.IncompleteData("missing limits")
+
+    # instead of needing to fetch the node where the pod ran from kube_pod_info
+    # we can grab it from kube_pod_container_resource_limits
+    # weirdly, it's not available in kube_pod_labels or annotations
+    # https://github.com/kubernetes/kube-state-metrics/issues/1148
+    try:
+        node = limits_res[0]["labels"]["node"]
+    except KeyError:
+        raise util.IncompleteData("missing node label")
+    limits = util.process_resources(limits_res)
+
+    return (
+        {
+            "cpu_request": requests["cpu"]["value"],
+            "mem_request": requests["memory"]["value"],
+            "cpu_limit": limits.get("cpu", {}).get("value"),
+            "mem_limit": limits["memory"]["value"],
+        },
+        node,
+    )
+
+
+def process_job_usage(mem_res: list, cpu_res: list, process=util.process_usage) -> dict:
+    """
+    Turns memory and cpu usage responses into the job's attributes
+
+    args:
+        process: util.process_usage for range responses,
+            util.process_usage_stats for aggregated responses
+    """
+
+    mem_usage = process(mem_res)
+    cpu_usage = process(cpu_res)
+
+    return {
+        "cpu_mean": cpu_usage["mean"],
+        "cpu_median": cpu_usage["median"],
+        "cpu_max": cpu_usage["max"],
+        "cpu_min": cpu_usage["min"],
+        "cpu_stddev": cpu_usage["stddev"],
+        "mem_mean": mem_usage["mean"],
+        "mem_median": mem_usage["median"],
+        "mem_max": mem_usage["max"],
+        "mem_min": mem_usage["min"],
+        "mem_stddev": mem_usage["stddev"],
+    }
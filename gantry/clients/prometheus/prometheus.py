@@ -1,8 +1,8 @@
 import logging
-import math
 
 import aiohttp
 
+from gantry.clients import http
 from gantry.clients.prometheus import util
 from gantry.clients.prometheus.job import PrometheusJobClient
 from gantry.clients.prometheus.node import PrometheusNodeClient
@@ -11,7 +11,13 @@ logger = logging.getLogger(__name__)
 
 
 class PrometheusClient:
-    def __init__(self, base_url: str, auth_cookie: str = ""):
+    def __init__(
+        self,
+        base_url: str,
+        auth_cookie: str = "",
+        session: aiohttp.ClientSession | None = None,
+        usage_mode: str = "range",
+    ):
         # cookie will only be used if set
         if auth_cookie:
             self.cookies = {"_oauth2_proxy": auth_cookie}
@@ -19,6 +25,14 @@ class PrometheusClient:
             self.cookies = {}
 
         self.base_url = base_url
+        # shared session (see gantry.clients.http.create_session),
+        # without one each request opens its own
+        self.session = session
+
+        if usage_mode not in ("range", "aggregate"):
+            raise ValueError(f"unknown usage mode {usage_mode}")
+        # how job usage statistics are computed, see PrometheusJobClient.get_usage
+        self.usage_mode = usage_mode
 
     async def query_single(self, query: str | dict, time: int) -> list:
         """Query Prometheus for a single value
@@ -53,10 +67,7 @@ class PrometheusClient:
         """
 
         query = util.process_query(query)
-        # prometheus will only return this many frames
-        max_resolution = 10_000
-        # calculating the max step size to get the desired resolution
-        step = math.ceil((end - start) / max_resolution)
+        step = util.range_step(start, end)
         url = (
             f"{self.base_url}/query_range?"
             f"query={query}&"
@@ -68,17 +79,16 @@ class PrometheusClient:
 
     async def _query(self, url: str) -> list:
         """Query Prometheus with a query string"""
-        async with aiohttp.ClientSession() as session:
-            # submit cookie with request
-            async with session.get(url, cookies=self.cookies) as resp:
-                try:
-                    return await resp.json()
-                except aiohttp.ContentTypeError:
-                    # this will get caught in collection.py and fetch_job won't continue
-                    raise aiohttp.ClientError(
-                        """Prometheus query failed with unexpected
-                        response, cookie may have expired."""
-                    )
+        # submit cookie with request
+        async with http.get(self.session, url, cookies=self.cookies) as resp:
+            try:
+                return await resp.json()
+            except aiohttp.ContentTypeError:
+                # this will get caught in collection.py and fetch_job won't continue
+                raise aiohttp.ClientError(
+                    """Prometheus query failed with unexpected
+                    response, cookie may have expired."""
+                )
 
     def prettify_res(self, response: dict) -> list:
         """Process Prometheus response into a list of dicts with {label: value}"""
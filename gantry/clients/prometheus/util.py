@@ -1,7 +1,11 @@
 import math
+import re
 import statistics
 import urllib.parse
 
+# prometheus will only return this many frames per series
+MAX_RESOLUTION = 10_000
+
 
 class IncompleteData(Exception):
     pass
@@ -22,13 +26,66 @@ def process_query(query: dict | str) -> str:
 
 def query_to_str(metric: str, filters: dict) -> str:
     """
-    In: "metric", {key1: value1, key2: value2}
-    Out: "metric{key1="value1", key2="value2"}"
+    In: "metric", {key1: value1, key2: [value2, value3]}
+    Out: "metric{key1="value1", key2=~"value2|value3"}"
+
+    List values are matched with a regex, so a single query can select
+    the series of multiple jobs or pods.
     """
-    filters_str = ", ".join([f'{key}="{value}"' for key, value in filters.items()])
+    filters_str = ", ".join(
+        (
+            f'{key}=~"{match_any(value)}"'
+            if isinstance(value, list)
+            else f'{key}="{value}"'
+        )
+        for key, value in filters.items()
+    )
     return f"{metric}{{{filters_str}}}"
 
 
+def match_any(values: list) -> str:
+    """Regex (as a PromQL string) that fully matches any of the values"""
+    # prometheus regexes are anchored, so alternation is enough.
+    # backslashes from escaping need to be escaped again inside the PromQL string
+    return "|".join(re.escape(str(value)) for value in values).replace("\\", "\\\\")
+
+
+def group_by_label(res: list, label: str) -> dict:
+    """
+    Splits a Prometheus response for multiple jobs or pods by a label.
+
+    returns: dict with {label value: [results]} format
+    """
+    grouped = {}
+    for item in res:
+        grouped.setdefault(item["labels"].get(label), []).append(item)
+    return grouped
+
+
+def slice_range(res: list, start: float, end: float) -> list:
+    """Keeps the values of a range response that fall within [start, end]"""
+    sliced = []
+    for item in res:
+        values = [v for v in item["values"] if start <= v[0] <= end]
+        # series without samples in the window count as missing
+        if values:
+            sliced.append({"labels": item["labels"], "values": values})
+    return sliced
+
+
+def last_over_window(query: dict, start: float, end: float) -> str:
+    """
+    Wraps a query so that, evaluated at end, it returns the last sample of every
+    series present between start and end, even those that ended before end.
+    """
+    return f"last_over_time({query_to_str(**query)}[{math.ceil(end - start)}s])"
+
+
+def range_step(start: float, end: float) -> int:
+    """Step (in seconds) that covers start to end within MAX_RESOLUTION frames"""
+    return math.ceil((end - start) / MAX_RESOLUTION)
+
+
 def process_resources(res: list) -> dict:
     """
     Processes the resource limits and requests from a Prometheus response into
@@ -71,15 +128,64 @@ def process_usage(res: list) -> dict:
 
     usage = [float(value) for timestamp, value in res[0]["values"]]
 
-    sum_stats = {
-        "mean": statistics.fmean(usage),
-        # pstdev because we have the whole population
-        "stddev": statistics.pstdev(usage),
-        "max": max(usage),
-        "min": min(usage),
-        "median": statistics.median(usage),
-    }
+    return validate_usage(
+        {
+            "mean": statistics.fmean(usage),
+            # pstdev because we have the whole population
+            "stddev": statistics.pstdev(usage),
+            "max": max(usage),
+            "min": min(usage),
+            "median": statistics.median(usage),
+        }
+    )
+
+
+# PromQL functions that compute the statistics of process_usage within Prometheus.
+# stddev_over_time is the population standard deviation, and the 0.5 quantile
+# interpolates between the middle values the same way as statistics.median
+USAGE_AGGREGATIONS = {
+    "mean": "avg_over_time",
+    "stddev": "stddev_over_time",
+    "max": "max_over_time",
+    "min": "min_over_time",
+    "median": "quantile_over_time",
+}
+
+
+def usage_stats_query(selector: str, start: float, end: float) -> str:
+    """
+    Builds a query that, evaluated at end, returns one series per statistic
+    of the selector between start and end, told apart by a "stat" label.
+
+    The selector is sampled with a subquery at the step query_range would use,
+    so the statistics are computed over (nearly) the same frames as process_usage.
+    """
+
+    window = f"{selector}[{math.ceil(end - start)}s:{range_step(start, end)}s]"
+    return " or ".join(
+        f'label_replace({func}({"0.5, " if stat == "median" else ""}{window}), '
+        f'"stat", "{stat}", "", "")'
+        for stat, func in USAGE_AGGREGATIONS.items()
+    )
+
+
+def process_usage_stats(res: list) -> dict:
+    """
+    Processes the response of a usage_stats_query into the format of process_usage.
+    """
+
+    sum_stats = {}
+    for item in res:
+        # duplicate series are ignored, like process_usage does
+        sum_stats.setdefault(item["labels"].get("stat"), float(item["values"][1]))
+
+    if any(stat not in sum_stats for stat in USAGE_AGGREGATIONS):
+        raise IncompleteData("usage data is missing")
+
+    return validate_usage(sum_stats)
+
 
+def validate_usage(sum_stats: dict) -> dict:
     if (
         sum_stats["stddev"] == 0
         or sum_stats["mean"] == 0
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import time
+from itertools import groupby
+from operator import itemgetter
+
+import aiosqlite
+
+from gantry.routes.prediction import IDEAL_SAMPLE, allocate, tier_lookups
+from gantry.util.spec import parse_alloc_spec
+
+# changes whenever the layout of the artifact changes, loaders refuse other versions
+ARTIFACT_VERSION = 1
+# the first version of the database with the sample_rollup table
+MIN_DB_VERSION = 6
+
+ARTIFACT_SCHEMA = """
+CREATE TABLE metadata (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+-- the response of the allocation API for every key of sample_rollup
+-- with enough builds for a prediction
+CREATE TABLE predictions (
+    tier INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    variables TEXT NOT NULL,
+    PRIMARY KEY (tier, key)
+) WITHOUT ROWID;
+"""
+
+
+async def export_predictions(db: aiosqlite.Connection, path: str) -> int:
+    """
+    Writes the predictions of every spec with builds to a read-only SQLite file,
+    which PredictionArtifact can answer allocation requests from.
+
+    The file is written next to path and moved into place once complete,
+    so readers never see a partial artifact.
+
+    args:
+        db: connection to the gantry database
+        path: where the artifact is written
+    returns:
+        number of exported predictions
+    """
+
+    async with db.execute("PRAGMA user_version") as cursor:
+        (db_version,) = await cursor.fetchone()
+    if db_version < MIN_DB_VERSION:
+        raise ValueError(f"database version {db_version} is too old, run gantry")
+
+    # each sample is ordered as in get_sample_rollup
+    async with db.execute(
+        f"""
+        SELECT tier, sample_rollup.key, cpu_mean, cpu_max, mem_mean, mem_max
+        FROM sample_rollup, json_each(sample) JOIN jobs ON jobs.id=json_each.value
+        WHERE json_array_length(sample) >= {IDEAL_SAMPLE - 1}
+        ORDER BY tier, sample_rollup.key, end DESC, jobs.id DESC
+        """
+    ) as cursor:
+        rows = await cursor.fetchall()
+
+    predictions = [
+        (
+            tier,
+            key,
+            json.dumps(
+                allocate(
+                    {"tier": tier, "key": key},
+                    [build[2:] for build in sample],
+                )["variables"]
+            ),
+        )
+        for (tier, key), sample in groupby(rows, key=itemgetter(0, 1))
+    ]
+    metadata = {
+        "version": ARTIFACT_VERSION,
+        "created": time.time(),
+        "db_version": db_version,
+        # the answer for specs without a sample
+        "default_variables": json.dumps(allocate({}, [])["variables"]),
+    }
+
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    async with aiosqlite.connect(partial) as artifact:
+        await artifact.executescript(ARTIFACT_SCHEMA)
+        await artifact.executemany(
+            "INSERT INTO metadata VALUES (?, ?)", list(metadata.items())
+        )
+        await artifact.executemany(
+            "INSERT INTO predictions VALUES (?, ?, ?)", predictions
+        )
+        await artifact.commit()
+    os.replace(partial, path)
+
+    return len(predictions)
+
+
+class PredictionArtifact:
+    """
+    Answers allocation requests from a file written by export_predictions,
+    without a running gantry.
+
+    Answers are those gantry gave when the artifact was exported. Callers that
+    need newer predictions should compare created to their tolerance and ask
+    the allocation API instead.
+    """
+
+    def __init__(self, path: str):
+        """
+        args:
+            path: the artifact, which is never written to while it is open
+        """
+
+        # immutable skips locking, the file is only replaced as a whole
+        self.db = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+        # lookups read the index pages straight from the OS page cache
+        self.db.execute(f"PRAGMA mmap_size={os.path.getsize(path)}")
+        metadata = dict(self.db.execute("SELECT name, value FROM metadata"))
+
+        if int(metadata["version"]) != ARTIFACT_VERSION:
+            self.db.close()
+            raise ValueError(f"unsupported artifact version {metadata['version']}")
+        # unix time of the export
+        self.created = float(metadata["created"])
+        self.default = {"variables": json.loads(metadata["default_variables"])}
+
+    def allocation(self, spec: str) -> dict | None:
+        """
+        Predicts the resource usage of a spec, see the allocation API
+
+        args:
+            spec: in the format of the allocation API
+        returns:
+            the response of the allocation API, None if the spec is invalid
+        """
+
+        if not (parsed_spec := parse_alloc_spec(spec)):
+            return None
+        return self.predict(parsed_spec)
+
+    def predict(self, spec: dict) -> dict:
+        """
+        args:
+            spec: see gantry.routes.prediction.predict
+        returns:
+            see gantry.routes.prediction.predict
+        """
+
+        lookups, values = tier_lookups(spec)
+        row = self.db.execute(
+            f"SELECT variables FROM predictions WHERE {lookups} ORDER BY tier LIMIT 1",
+            values,
+        ).fetchone()
+        if row is None:
+            return self.default
+        return {"variables": json.loads(row[0])}
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import aiosqlite
+
+from gantry.clients import db
+from gantry.clients.db import ReadPool, configure
+from gantry.routes.prediction import (
+    IDEAL_SAMPLE,
+    SAMPLERS,
+    allocate,
+    predict,
+    tier_lookups,
+)
+from gantry.util.k8s import BYTES_TO_MEGABYTES, CORES_TO_MILLICORES
+
+PERCENTILES = (1, 10, 50, 90, 99)
+
+
+async def bench_predict(
+    db_file: str, jobs: int, concurrency: int, sampler: str = "rollup"
+) -> dict:
+    """
+    Replays the most recent jobs of a database against the prediction code.
+
+    The database is copied with only the jobs that ended before the first of
+    these jobs started. The jobs are then predicted in the order they started,
+    and the builds that ended in the meantime are inserted between predictions,
+    so each job is predicted from the builds that existed when it started.
+    Jobs that started between the same two inserts are predicted concurrently.
+
+    args:
+        db_file: gantry database, which is only read
+        jobs: number of jobs to predict
+        concurrency: maximum number of predictions running at once
+        sampler: name of a function in SAMPLERS, or columnar
+    returns:
+        see report
+    """
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        source = await aiosqlite.connect(f"file:{db_file}?mode=ro", uri=True)
+        writer = await aiosqlite.connect(path)
+        try:
+            await source.backup(writer)
+            test_jobs, replayed = await split(writer, jobs)
+            return await replay(writer, path, test_jobs, replayed, concurrency, sampler)
+        finally:
+            await source.close()
+            await writer.close()
+
+
+async def split(writer: aiosqlite.Connection, jobs: int) -> tuple[list, list]:
+    """
+    Removes the jobs that ended after the first of the predicted jobs started
+    from the copy of the database.
+
+    returns: the predicted jobs, by start, and the removed develop builds,
+        which are inserted again during the replay, by end
+    """
+
+    writer.row_factory = aiosqlite.Row
+    async with writer.execute(
+        "SELECT * FROM jobs ORDER BY end DESC, id DESC LIMIT ?", (jobs,)
+    ) as cursor:
+        test_jobs = sorted(
+            map(dict, await cursor.fetchall()),
+            key=lambda job: (job["start"], job["id"]),
+        )
+    if not test_jobs:
+        raise ValueError("no jobs to predict")
+
+    split_time = test_jobs[0]["start"]
+    async with writer.execute(
+        "SELECT * FROM jobs WHERE end >= ? AND ref='develop' ORDER BY end, id",
+        (split_time,),
+    ) as cursor:
+        replayed = list(map(dict, await cursor.fetchall()))
+    writer.row_factory = None
+
+    await writer.execute("DELETE FROM jobs WHERE end >= ?", (split_time,))
+    # the rollup is only maintained on insert, so it is built again like it was
+    # for the builds that existed when it was added
+    with open("migrations/006_sample_rollup.sql") as f:
+        backfill = f.read().split("-- existing builds")[1]
+    await writer.execute("DELETE FROM sample_rollup")
+    await writer.executescript(backfill)
+    await writer.commit()
+
+    return test_jobs, replayed
+
+
+async def replay(
+    writer: aiosqlite.Connection,
+    path: str,
+    test_jobs: list[dict],
+    replayed: list[dict],
+    concurrency: int,
+    sampler: str,
+) -> dict:
+    """Predicts test_jobs while inserting the replayed builds, see bench_predict"""
+
+    snapshot = None
+    if sampler == "columnar":
+        from gantry.routes.columnar import ColumnarSnapshot
+
+        snapshot = ColumnarSnapshot()
+        await snapshot.load(writer)
+    elif sampler not in SAMPLERS:
+        raise ValueError(f"unknown prediction sampler {sampler}")
+
+    await configure(writer, wal=True)
+    reader = ReadPool(path, size=concurrency)
+    await reader.open()
+    slots = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def run(job: dict) -> None:
+        spec = job_spec(job)
+        async with slots, reader.acquire() as conn:
+            start = time.perf_counter()
+            if snapshot:
+                prediction = allocate(spec, snapshot.sample(spec))
+            else:
+                prediction = await predict(conn, spec, sampler)
+            latency = time.perf_counter() - start
+            results.append((job, prediction, latency, await sample_tier(conn, spec)))
+
+    try:
+        started = time.perf_counter()
+        inserted = 0
+        batch = []
+        for job in test_jobs:
+            # builds that ended before this job started
+            pending = inserted
+            while pending < len(replayed) and replayed[pending]["end"] <= job["start"]:
+                pending += 1
+            if pending > inserted:
+                await asyncio.gather(*map(run, batch))
+                batch = []
+                for build in replayed[inserted:pending]:
+                    # the generated column can't be inserted
+                    build = {k: v for k, v in build.items() if k != "exp_variants"}
+                    await db.insert_job(writer, build)
+                    if snapshot:
+                        snapshot.add(build["id"], build)
+                await writer.commit()
+                inserted = pending
+            batch.append(job)
+        await asyncio.gather(*map(run, batch))
+        elapsed = time.perf_counter() - started
+    finally:
+        await reader.close()
+
+    return report(results, elapsed)
+
+
+async def sample_tier(conn: aiosqlite.Connection, spec: dict) -> int | None:
+    """the tier of sample_tiers the sample of a spec was selected from"""
+
+    lookups, values = tier_lookups(spec)
+    async with conn.execute(
+        f"""
+        SELECT tier FROM sample_rollup
+        WHERE ({lookups}) AND json_array_length(sample) >= {IDEAL_SAMPLE - 1}
+        ORDER BY tier LIMIT 1
+        """,
+        values,
+    ) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+def report(results: list[tuple], elapsed: float) -> dict:
+    """
+    Summarizes the replay.
+
+    The ratios are usage over prediction, so jobs above 1 used more than they
+    were allocated (under-allocation) and jobs below 1 less (over-allocation).
+
+    returns: dict with
+        jobs, elapsed (seconds) and throughput (predictions per second)
+        latency: percentiles of the prediction latency in milliseconds
+        tiers: fraction of jobs predicted from each tier, None for the default
+        cpu, mem: for the ratio of each resource, its mean, percentiles, and the
+            fraction and percentiles of the jobs that were under and over-allocated
+    """
+
+    latencies = [latency * 1000 for _, _, latency, _ in results]
+    tiers = {}
+    for _, _, _, tier in results:
+        tiers[tier] = tiers.get(tier, 0) + 1
+
+    ratios = {"cpu": [], "mem": []}
+    for job, prediction, _, _ in results:
+        variables = prediction["variables"]
+        cpu = int(variables["KUBERNETES_CPU_REQUEST"][:-1]) / CORES_TO_MILLICORES
+        mem = int(variables["KUBERNETES_MEMORY_REQUEST"][:-1]) / BYTES_TO_MEGABYTES
+        ratios["cpu"].append(job["cpu_mean"] / cpu)
+        ratios["mem"].append(job["mem_mean"] / mem)
+
+    return {
+        "jobs": len(results),
+        "elapsed": elapsed,
+        "throughput": len(results) / elapsed,
+        "latency": percentiles(latencies),
+        "tiers": {
+            tier: count / len(results)
+            # the default last
+            for tier, count in sorted(
+                tiers.items(), key=lambda item: (item[0] is None, item[0] or 0)
+            )
+        },
+        **{
+            resource: {
+                "mean": statistics.fmean(values),
+                "ratio": percentiles(values),
+                "under": {
+                    "fraction": sum(v > 1 for v in values) / len(values),
+                    "ratio": percentiles([v for v in values if v > 1]),
+                },
+                "over": {
+                    "fraction": sum(v < 1 for v in values) / len(values),
+                    "ratio": percentiles([v for v in values if v < 1]),
+                },
+            }
+            for resource, values in ratios.items()
+        },
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['jobs']} jobs in {report['elapsed']:.2f}s"
+        f" ({report['throughput']:.0f} predictions/s)",
+        f"latency (ms): {format_percentiles(report['latency'], '.3f')}",
+        "tiers: "
+        + ", ".join(
+            f"{'default' if tier is None else tier}={fraction:.1%}"
+            for tier, fraction in report["tiers"].items()
+        ),
+    ]
+    for resource in ("cpu", "mem"):
+        ratios = report[resource]
+        lines += [
+            f"{resource} usage/prediction: mean={ratios['mean']:.3f}"
+            f" {format_percentiles(ratios['ratio'], '.3f')}",
+            f"  under-allocated {ratios['under']['fraction']:.1%}:"
+            f" {format_percentiles(ratios['under']['ratio'], '.3f')}",
+            f"  over-allocated {ratios['over']['fraction']:.1%}:"
+            f" {format_percentiles(ratios['over']['ratio'], '.3f')}",
+        ]
+    return "\n".join(lines)
+
+
+def format_percentiles(values: dict, spec: str) -> str:
+    return " ".join(f"p{p}={v:{spec}}" for p, v in values.items()) or "-"
+
+
+def percentiles(values: list[float]) -> dict:
+    """returns: {percentile: value} for PERCENTILES, empty without values"""
+
+    if not values:
+        return {}
+    if len(values) == 1:
+        return dict.fromkeys(PERCENTILES, values[0])
+    # n=100 returns the 99 cut points between percentiles
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {p: cuts[p - 1] for p in PERCENTILES}
+
+
+def job_spec(job: dict) -> dict:
+    """the spec of a row of the jobs table, as parsed by parse_alloc_spec"""
+
+    return {
+        "pkg_name": job["pkg_name"],
+        "pkg_version": job["pkg_version"],
+        "pkg_variants": job["pkg_variants"],
+        "pkg_variants_dict": json.loads(job["pkg_variants"]),
+        "compiler_name": job["compiler_name"],
+        "compiler_version": job["compiler_version"],
+        "arch": job["arch"],
+    }
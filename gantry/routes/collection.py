@@ -1,5 +1,7 @@
+import asyncio
 import logging
 import re
+from typing import TYPE_CHECKING
 
 import aiohttp
 import aiosqlite
@@ -7,107 +9,552 @@ import aiosqlite
 from gantry.clients import db
 from gantry.clients.gitlab import GitlabClient
 from gantry.clients.prometheus import PrometheusClient
-from gantry.clients.prometheus.util import IncompleteData
+from gantry.clients.prometheus.util import MAX_RESOLUTION, IncompleteData
 from gantry.models import Job
+from gantry.util.cache import AllocationCache, NodeCache
+from gantry.util.metrics import Counter, Histogram
+from gantry.util.tasks import SingleFlight, gather
+from gantry.util.workers import WorkerPool
+
+if TYPE_CHECKING:
+    # needs numpy, which is optional
+    from gantry.routes.columnar import ColumnarSnapshot
 
 MB_IN_BYTES = 1_000_000
 BUILD_STAGE_REGEX = r"^stage-\d+$"
+# seconds between deletions of old rows from the inbox
+INBOX_PRUNE_INTERVAL = 60 * 60
+# printed by `spack ci rebuild` when the spec is already in the build cache
+GHOST_LOG_MARKER = re.compile(rb"No need to rebuild")
+# printed once spack has started installing the job's specs, after the check above.
+# the optional escape sequence appears when the log is colored. spack can bootstrap
+# its own tools before the check, which is printed with the spec in quotes
+# (==> Installing "clingo-bootstrap@spack..." from a buildcache) and not matched
+BUILD_LOG_MARKER = re.compile(rb"==>(?:\x1b\[0m)? Installing [^\"\s]")
 
 logger = logging.getLogger(__name__)
 
+# hostnames are reused by new nodes, so lookups of a hostname are only shared
+# by jobs that ran within this many seconds of each other
+NODE_LOOKUP_WINDOW = 10 * 60
+
+# concurrent collections of the same job (duplicate webhooks) and lookups of the
+# same node (jobs finishing together on a new node) share one execution
+job_flights = SingleFlight()
+node_flights = SingleFlight()
+
+# batched collections (see fetch_jobs) observe each stage once per group of jobs
+stage_seconds = Histogram(
+    "gantry_collection_stage_seconds",
+    "seconds spent in each stage of the collection of a job",
+    ["stage"],
+)
+skipped_jobs = Counter(
+    "gantry_collection_skipped_total",
+    "jobs that were not collected, by reason",
+    ["reason"],
+)
+
 
 async def fetch_job(
     payload: dict,
     db_conn: aiosqlite.Connection,
     gitlab: GitlabClient,
     prometheus: PrometheusClient,
-) -> None:
+    node_cache: NodeCache | None = None,
+    writer: db.DBWriter | None = None,
+    allocation_cache: AllocationCache | None = None,
+    snapshot: "ColumnarSnapshot | None" = None,
+) -> int | None:
     """
     Fetches a job's information from Prometheus and inserts it into the database.
-    If there is data missing at any point, the function will still return so the webhook
-    responds as expected. If an exception is thrown, that behavior was unanticipated by
-    this program and should be investigated.
+    If there is data missing at any point, the function will still return.
+    Failed requests to Gitlab or Prometheus (aiohttp.ClientError, asyncio.TimeoutError)
+    are raised so the collection can be retried later. Any other exception was
+    unanticipated by this program and should be investigated.
 
     args:
         payload: a dictionary containing the information from the Gitlab job hook
         db: an active aiosqlite connection
+        node_cache: saves node lookups for hostnames that were recently seen
+        writer: commits the job together with other writes, otherwise the job
+            is committed on its own
+        allocation_cache: predictions of the package are dropped from it once
+            a develop build is committed
+        snapshot: committed develop builds are added to it, see publish_builds
 
-    returns: None in order to accommodate a 200 response for the webhook.
+    returns: id of the inserted job, None if the job was not inserted
     """
 
-    job = Job(
-        status=payload["build_status"],
-        gl_id=payload["build_id"],
-        start=payload["build_started_at"],
-        end=payload["build_finished_at"],
-        ref=payload["ref"],
+    return await job_flights.run(
+        payload["build_id"],
+        _fetch_job,
+        payload,
+        db_conn,
+        gitlab,
+        prometheus,
+        node_cache,
+        writer,
+        allocation_cache,
+        snapshot,
     )
 
-    # perform checks to see if we should collect data for this job
-    if (
-        job.status != "success"
-        # if the stage is not stage-NUMBER, it's not a build job
-        or not re.match(BUILD_STAGE_REGEX, payload["build_stage"])
-        # some jobs don't have runners..?
-        or payload["runner"] is None
-        # uo runners are not in Prometheus
-        or payload["runner"]["description"].strip().startswith("uo")
-        # job already in the database
-        or await db.job_exists(db_conn, job.gl_id)
-    ):
+
+async def _fetch_job(
+    payload: dict,
+    db_conn: aiosqlite.Connection,
+    gitlab: GitlabClient,
+    prometheus: PrometheusClient,
+    node_cache: NodeCache | None,
+    writer: db.DBWriter | None,
+    allocation_cache: AllocationCache | None,
+    snapshot: "ColumnarSnapshot | None",
+) -> int | None:
+    job = parse_job(payload)
+    if not await should_collect(job, payload, db_conn):
         return
 
     try:
         # all code that makes HTTP requests should be in this try block
 
-        # check if the job is a ghost
-        job_log = await gitlab.job_log(job.gl_id)
-        is_ghost = "No need to rebuild" in job_log
-        if is_ghost:
+        # the ghost check and the annotation lookup don't depend on each other.
+        # annotation errors are held back because a ghost is a reason to skip
+        # the job on its own, and may not have annotations at all
+        ghost, annotations = await asyncio.gather(
+            stage_seconds.timed(is_ghost(gitlab, job.gl_id), "gitlab_log"),
+            stage_seconds.timed(
+                prometheus.job.get_annotations(job.gl_id, job.midpoint), "annotations"
+            ),
+            return_exceptions=True,
+        )
+        if isinstance(ghost, BaseException):
+            raise ghost
+
+        if ghost:
             logger.warning(f"job {job.gl_id} is a ghost, skipping")
+            skipped_jobs.inc("ghost")
+            return
+        if ghost is None:
+            # storing a ghost would skew predictions, missing a build doesn't
+            logger.warning(f"job {job.gl_id} may be a ghost, skipping")
+            skipped_jobs.inc("maybe_ghost")
             return
 
-        annotations = await prometheus.job.get_annotations(job.gl_id, job.midpoint)
-        resources, node_hostname = await prometheus.job.get_resources(
-            annotations["pod"], job.midpoint
+        if isinstance(annotations, BaseException):
+            raise annotations
+
+        async def resources_and_node() -> tuple[dict, int | None, dict | None]:
+            # the node can only be looked up once we know where the pod ran
+            with stage_seconds.time("resources"):
+                resources, node_hostname = await prometheus.job.get_resources(
+                    annotations["pod"], job.midpoint
+                )
+            with stage_seconds.time("node"):
+                node_id, new_node = await lookup_node(
+                    db_conn, prometheus, node_hostname, job.midpoint, node_cache
+                )
+            return resources, node_id, new_node
+
+        # everything else only depends on the pod name
+        (resources, node_id, new_node), usage = await gather(
+            resources_and_node(),
+            stage_seconds.timed(
+                prometheus.job.get_usage(annotations["pod"], job.start, job.end),
+                "usage",
+            ),
         )
-        usage = await prometheus.job.get_usage(annotations["pod"], job.start, job.end)
-        node_id = await fetch_node(db_conn, prometheus, node_hostname, job.midpoint)
-    except aiohttp.ClientError as e:
-        logger.error(f"Request failed: {e}")
-        return
     except IncompleteData as e:
         # missing data, skip this job
         logger.error(f"{e} job={job.gl_id}")
+        skipped_jobs.inc("incomplete")
         return
 
-    job_id = await db.insert_job(
-        db_conn,
-        {
-            "node": node_id,
-            "start": job.start,
-            "end": job.end,
-            "gitlab_id": job.gl_id,
-            "job_status": job.status,
-            "ref": job.ref,
-            **annotations,
-            **resources,
-            **usage,
-        },
-    )
+    async def insert(conn: aiosqlite.Connection) -> tuple[int, int | None]:
+        # new nodes are only inserted once all of the job's data has been collected
+        # job and node will get saved at the same time to make sure
+        # we don't accidentally commit a node without a job
+        nonlocal node_id
+        if new_node:
+            node_id = await db.insert_node(conn, new_node)
+
+        return await db.insert_job(
+            conn, job_record(job, node_id, annotations, resources, usage)
+        )
+
+    with stage_seconds.time("insert"):
+        job_id = await db.write(db_conn, writer, insert)
 
-    # job and node will get saved at the same time to make sure
-    # we don't accidentally commit a node without a job
-    await db_conn.commit()
+    if new_node and node_cache:
+        node_cache.put(new_node["hostname"], new_node["uuid"], node_id, job.midpoint)
+    if job_id:
+        publish_builds(
+            [(job_id, job_record(job, node_id, annotations, resources, usage))],
+            allocation_cache,
+            snapshot,
+        )
 
     return job_id
 
 
+async def fetch_jobs(
+    payloads: list[dict],
+    db_conn: aiosqlite.Connection,
+    gitlab: GitlabClient,
+    prometheus: PrometheusClient,
+    node_cache: NodeCache | None = None,
+    writer: db.DBWriter | None = None,
+    allocation_cache: AllocationCache | None = None,
+    snapshot: "ColumnarSnapshot | None" = None,
+) -> list[int | None]:
+    """
+    Batched version of fetch_job for bursts and backfills.
+
+    Jobs are grouped by time window and the Prometheus data of each group is
+    fetched with one query per metric, matching all of the group's job ids or pods,
+    instead of one query per metric and job.
+
+    Unlike fetch_job, batches don't share collections with concurrent calls for
+    the same job (job_flights). Duplicates within the batch are collected once,
+    and a job collected by two calls at once is only inserted once because its
+    gitlab id is unique.
+
+    args:
+        payloads: list of Gitlab job hook payloads, see fetch_job
+
+    returns: in the order of payloads, ids of the inserted jobs, None for jobs
+        that weren't inserted, or the request error for jobs that could not be
+        collected (see is_request_error)
+    """
+
+    jobs = {}
+    for payload in payloads:
+        job = parse_job(payload)
+        if job.gl_id not in jobs and await should_collect(job, payload, db_conn):
+            jobs[job.gl_id] = job
+    jobs = list(jobs.values())
+
+    # ghost checks are specific to each job
+    ghosts = await asyncio.gather(
+        *(
+            stage_seconds.timed(is_ghost(gitlab, job.gl_id), "gitlab_log")
+            for job in jobs
+        ),
+        return_exceptions=True,
+    )
+    collectable = []
+    inserted = {}
+    for job, ghost in zip(jobs, ghosts):
+        if is_request_error(ghost):
+            logger.error(f"Request failed: {ghost!r} job={job.gl_id}")
+            inserted[job.gl_id] = ghost
+        elif isinstance(ghost, BaseException):
+            raise ghost
+        elif ghost:
+            logger.warning(f"job {job.gl_id} is a ghost, skipping")
+            skipped_jobs.inc("ghost")
+        elif ghost is None:
+            logger.warning(f"job {job.gl_id} may be a ghost, skipping")
+            skipped_jobs.inc("maybe_ghost")
+        else:
+            collectable.append(job)
+
+    for group in group_jobs(collectable, MAX_RESOLUTION):
+        inserted |= await fetch_job_group(
+            group,
+            db_conn,
+            prometheus,
+            node_cache,
+            writer,
+            allocation_cache,
+            snapshot,
+        )
+
+    return [inserted.get(payload["build_id"]) for payload in payloads]
+
+
+async def fetch_job_group(
+    jobs: list[Job],
+    db_conn: aiosqlite.Connection,
+    prometheus: PrometheusClient,
+    node_cache: NodeCache | None = None,
+    writer: db.DBWriter | None = None,
+    allocation_cache: AllocationCache | None = None,
+    snapshot: "ColumnarSnapshot | None" = None,
+) -> dict[int, int]:
+    """
+    Collects and inserts a group of jobs with batched queries, see fetch_jobs.
+
+    returns: {gitlab id: inserted job id or request error}
+    """
+
+    start = min(job.start for job in jobs)
+    end = max(job.end for job in jobs)
+
+    def complete(job: Job, result) -> bool:
+        if isinstance(result, IncompleteData):
+            # missing data, skip this job
+            logger.error(f"{result} job={job.gl_id}")
+            skipped_jobs.inc("incomplete")
+            return False
+        return True
+
+    try:
+        with stage_seconds.time("annotations"):
+            annotations = await prometheus.job.get_annotations_batch(
+                [job.gl_id for job in jobs], start, end
+            )
+        jobs = [job for job in jobs if complete(job, annotations[job.gl_id])]
+        if not jobs:
+            return {}
+
+        pods = {job.gl_id: annotations[job.gl_id]["pod"] for job in jobs}
+        resources, usage = await gather(
+            stage_seconds.timed(
+                prometheus.job.get_resources_batch(list(pods.values()), start, end),
+                "resources",
+            ),
+            stage_seconds.timed(
+                prometheus.job.get_usage_batch(
+                    {pods[job.gl_id]: (job.start, job.end) for job in jobs}
+                ),
+                "usage",
+            ),
+        )
+        jobs = [
+            job
+            for job in jobs
+            if complete(job, resources[pods[job.gl_id]])
+            and complete(job, usage[pods[job.gl_id]])
+        ]
+
+        # each node only needs to be looked up once per group. a group can span
+        # longer than a hostname is used by one node, so lookups are only shared
+        # by jobs in the same window
+        lookups = {}
+        for job in jobs:
+            hostname = resources[pods[job.gl_id]][1]
+            lookups.setdefault(node_key(hostname, job.midpoint), job)
+        with stage_seconds.time("node"):
+            nodes = dict(
+                zip(
+                    lookups,
+                    await asyncio.gather(
+                        *(
+                            lookup_node(
+                                db_conn, prometheus, hostname, job.midpoint, node_cache
+                            )
+                            for (hostname, _), job in lookups.items()
+                        ),
+                        return_exceptions=True,
+                    ),
+                )
+            )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Request failed: {e!r} jobs={[job.gl_id for job in jobs]}")
+        return {job.gl_id: e for job in jobs}
+
+    failed = {}
+    collected = []
+    for job in jobs:
+        node = nodes[node_key(resources[pods[job.gl_id]][1], job.midpoint)]
+        if isinstance(node, IncompleteData):
+            logger.error(f"{node} job={job.gl_id}")
+            skipped_jobs.inc("incomplete")
+            continue
+        elif is_request_error(node):
+            logger.error(f"Request failed: {node!r} job={job.gl_id}")
+            failed[job.gl_id] = node
+            continue
+        elif isinstance(node, BaseException):
+            raise node
+        collected.append(job)
+
+    new_nodes = {}
+    records = {}
+
+    async def insert(conn: aiosqlite.Connection) -> dict[int, int]:
+        inserted = {}
+        node_ids = {}
+        for job in collected:
+            pod = pods[job.gl_id]
+            job_resources, hostname = resources[pod]
+            key = node_key(hostname, job.midpoint)
+
+            if key not in node_ids:
+                node_id, new_node = nodes[key]
+                if new_node:
+                    node_id = await db.insert_node(conn, new_node)
+                    new_nodes[key] = (new_node["uuid"], node_id, job.midpoint)
+                node_ids[key] = node_id
+
+            records[job.gl_id] = job_record(
+                job,
+                node_ids[key],
+                annotations[job.gl_id],
+                job_resources,
+                usage[pod],
+            )
+            job_id = await db.insert_job(conn, records[job.gl_id])
+            if job_id:
+                inserted[job.gl_id] = job_id
+        return inserted
+
+    if not collected:
+        return failed
+
+    # the whole group is committed at once
+    with stage_seconds.time("insert"):
+        inserted = await db.write(db_conn, writer, insert)
+
+    if node_cache:
+        for (hostname, _), (uuid, node_id, query_time) in new_nodes.items():
+            node_cache.put(hostname, uuid, node_id, query_time)
+    publish_builds(
+        [(job_id, records[gl_id]) for gl_id, job_id in inserted.items()],
+        allocation_cache,
+        snapshot,
+    )
+
+    return inserted | failed
+
+
+def publish_builds(
+    builds: list[tuple[int, dict]],
+    allocation_cache: AllocationCache | None,
+    snapshot: "ColumnarSnapshot | None",
+) -> None:
+    """
+    Makes committed builds visible to predictions that don't read the database.
+    Only develop builds are used for predictions.
+
+    args:
+        builds: (job id, row of the jobs table) of each committed build
+    """
+
+    for job_id, job in builds:
+        if job["ref"] != "develop":
+            continue
+        # the snapshot is updated first, so predictions cached after
+        # the invalidation include the build
+        if snapshot:
+            snapshot.add(job_id, job)
+        if allocation_cache:
+            allocation_cache.invalidate(job["pkg_name"])
+
+
+def is_request_error(result) -> bool:
+    """
+    Whether a collection failed because of a request to Gitlab or Prometheus.
+    These are usually temporary (outages, timeouts, an expired cookie),
+    so the job can be collected again later.
+    """
+
+    # asyncio.TimeoutError is raised by the shared session when HTTP_TIMEOUT
+    # is exceeded
+    return isinstance(result, aiohttp.ClientError | asyncio.TimeoutError)
+
+
+async def is_ghost(gitlab: GitlabClient, gl_id: int) -> bool | None:
+    """
+    Checks whether a job was a ghost, meaning it didn't build anything because
+    the spec was already available. Spack decides this before installing
+    anything, so the log is only read until either outcome is known.
+
+    returns: None when neither outcome was found within gitlab.log_max_bytes
+    """
+
+    marker, read = await gitlab.scan_log(gl_id, [GHOST_LOG_MARKER, BUILD_LOG_MARKER])
+    logger.debug(f"read {read} bytes of the log job={gl_id}")
+    if marker is None and gitlab.log_max_bytes and read >= gitlab.log_max_bytes:
+        return None
+    return marker is GHOST_LOG_MARKER
+
+
+def group_jobs(jobs: list[Job], max_window: float) -> list[list[Job]]:
+    """
+    Groups jobs so that each group spans at most max_window seconds
+    from the earliest start to the latest end.
+    Jobs longer than max_window are placed in a group of their own.
+    """
+
+    groups = []
+    for job in sorted(jobs, key=lambda job: job.start):
+        if groups:
+            group = groups[-1]
+            group_start = group[0].start
+            group_end = max(j.end for j in group)
+            if max(group_end, job.end) - group_start <= max_window:
+                group.append(job)
+                continue
+        groups.append([job])
+
+    return groups
+
+
+def parse_job(payload: dict) -> Job:
+    return Job(
+        status=payload["build_status"],
+        gl_id=payload["build_id"],
+        start=payload["build_started_at"],
+        end=payload["build_finished_at"],
+        ref=payload["ref"],
+    )
+
+
+async def should_collect(job: Job, payload: dict, db_conn: aiosqlite.Connection):
+    """Checks whether we should collect data for this job"""
+
+    if not is_build_job(payload):
+        return False
+    # job already in the database
+    if await db.job_exists(db_conn, job.gl_id):
+        skipped_jobs.inc("exists")
+        return False
+    return True
+
+
+def is_build_job(payload: dict) -> bool:
+    """
+    Checks whether a job hook is for a successful build, using the payload only.
+    Gitlab sends a hook for each status change of every job in the pipeline,
+    so this is done before anything is stored.
+    """
+
+    return not (
+        payload["build_status"] != "success"
+        # if the stage is not stage-NUMBER, it's not a build job
+        or not re.match(BUILD_STAGE_REGEX, payload["build_stage"])
+        # some jobs don't have runners..?
+        or payload["runner"] is None
+        # uo runners are not in Prometheus
+        or payload["runner"]["description"].strip().startswith("uo")
+    )
+
+
+def job_record(
+    job: Job, node_id: int, annotations: dict, resources: dict, usage: dict
+) -> dict:
+    """Combines the collected data into a row of the jobs table"""
+
+    return {
+        "node": node_id,
+        "start": job.start,
+        "end": job.end,
+        "gitlab_id": job.gl_id,
+        "job_status": job.status,
+        "ref": job.ref,
+        **annotations,
+        **resources,
+        **usage,
+    }
+
+
 async def fetch_node(
     db_conn: aiosqlite.Connection,
     prometheus: PrometheusClient,
     hostname: dict,
     query_time: float,
+    node_cache: NodeCache | None = None,
 ) -> int:
     """
     Finds an existing node in the database or inserts a new one.
@@ -117,27 +564,284 @@ async def fetch_node(
         prometheus:
         hostname: the hostname of the node
         query_time: any point during node runtime, usually grabbed from job
+        node_cache: cache of nodes that are already in the database
 
     returns: id of the inserted or existing node
     """
 
+    node_id, new_node = await lookup_node(
+        db_conn, prometheus, hostname, query_time, node_cache
+    )
+    if new_node:
+        node_id = await db.insert_node(db_conn, new_node)
+
+    return node_id
+
+
+async def lookup_node(
+    db_conn: aiosqlite.Connection,
+    prometheus: PrometheusClient,
+    hostname: dict,
+    query_time: float,
+    node_cache: NodeCache | None = None,
+) -> tuple[int | None, dict | None]:
+    """
+    Finds an existing node in the database or collects the data needed to insert it.
+    See fetch_node for args.
+
+    returns: (id of the existing node, None) or (None, node to insert)
+    """
+
+    return await node_flights.run(
+        node_key(hostname, query_time),
+        _lookup_node,
+        db_conn,
+        prometheus,
+        hostname,
+        query_time,
+        node_cache,
+    )
+
+
+def node_key(hostname: str, query_time: float) -> tuple[str, int]:
+    """Lookups with the same key are expected to find the same node"""
+    return hostname, int(query_time // NODE_LOOKUP_WINDOW)
+
+
+async def _lookup_node(
+    db_conn: aiosqlite.Connection,
+    prometheus: PrometheusClient,
+    hostname: dict,
+    query_time: float,
+    node_cache: NodeCache | None,
+) -> tuple[int | None, dict | None]:
+    if node_cache:
+        if cached := node_cache.get(hostname, query_time):
+            return cached[1], None
+
     node_uuid = await prometheus.node.get_uuid(hostname, query_time)
 
+    if node_cache:
+        # an expired entry is still valid if the hostname wasn't reused
+        cached = node_cache.peek(hostname)
+        if cached and cached[0] == node_uuid:
+            node_cache.put(hostname, node_uuid, cached[1], query_time)
+            return cached[1], None
+
     # do not proceed if the node exists
     if existing_node := await db.get_node(db_conn, node_uuid):
-        return existing_node
+        if node_cache:
+            node_cache.put(hostname, node_uuid, existing_node, query_time)
+        return existing_node, None
 
     node_labels = await prometheus.node.get_labels(hostname, query_time)
-    return await db.insert_node(
-        db_conn,
-        {
-            "uuid": node_uuid,
-            "hostname": hostname,
-            "cores": node_labels["cores"],
-            # convert to bytes to be consistent with other resource metrics
-            "mem": node_labels["mem"] * MB_IN_BYTES,
-            "arch": node_labels["arch"],
-            "os": node_labels["os"],
-            "instance_type": node_labels["instance_type"],
-        },
-    )
+    return None, {
+        "uuid": node_uuid,
+        "hostname": hostname,
+        "cores": node_labels["cores"],
+        # convert to bytes to be consistent with other resource metrics
+        "mem": node_labels["mem"] * MB_IN_BYTES,
+        "arch": node_labels["arch"],
+        "os": node_labels["os"],
+        "instance_type": node_labels["instance_type"],
+    }
+
+
+class Collector:
+    """
+    Feeds jobs from the webhook inbox to a pool of collection workers.
+
+    Payloads are stored in the inbox before the webhook is answered, so jobs
+    that were queued or running when the process stopped are resumed on startup.
+    Rows that do not fit into the worker queue stay pending and are picked up
+    by a periodic sweep of the inbox.
+    """
+
+    def __init__(
+        self,
+        db_conn: aiosqlite.Connection,
+        gitlab: GitlabClient,
+        prometheus: PrometheusClient,
+        workers: int,
+        max_depth: int,
+        poll_interval: float,
+        batch_size: int = 1,
+        node_cache: NodeCache | None = None,
+        writer: db.DBWriter | None = None,
+        allocation_cache: AllocationCache | None = None,
+        snapshot: "ColumnarSnapshot | None" = None,
+    ):
+        """
+        args:
+            workers: number of concurrent collections
+            max_depth: maximum number of jobs waiting in the worker queue
+            poll_interval: seconds between sweeps of the inbox
+            batch_size: when above 1, jobs waiting in the queue are collected
+                together with batched queries (see fetch_jobs)
+            node_cache: shared by all collections, warmed on start
+            writer: when given, inbox updates and collected jobs are committed
+                in groups through it instead of one commit each
+            allocation_cache: predictions invalidated by collected builds
+            snapshot: in-memory copy of the builds that collected builds are
+                added to
+        """
+        self.db = db_conn
+        self.gitlab = gitlab
+        self.prometheus = prometheus
+        self.poll_interval = poll_interval
+        self.node_cache = node_cache
+        self.writer = writer
+        self.allocation_cache = allocation_cache
+        self.snapshot = snapshot
+        self.pool = WorkerPool(
+            self._collect,
+            workers,
+            max_depth,
+            batch_size=batch_size if batch_size > 1 else None,
+        )
+        # inbox ids that are in the worker queue or being collected
+        self.queued = set()
+        self.sweeper = None
+        # loop time of the last time old rows were deleted from the inbox
+        self.pruned = None
+
+    async def start(self):
+        if resumed := await db.reset_inbox(self.db):
+            logger.warning(f"resuming {resumed} interrupted collections")
+        await self.db.commit()
+        await self.prune()
+
+        if self.node_cache:
+            await self.node_cache.warm(self.db)
+
+        self.pool.start()
+        self.sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        self.sweeper.cancel()
+        await asyncio.gather(self.sweeper, return_exceptions=True)
+        # unfinished rows remain in the inbox for the next startup
+        await self.pool.stop()
+
+    async def receive(self, payload: dict) -> bool:
+        """
+        Durably stores a webhook payload and queues it for collection.
+
+        returns: whether the payload was stored, hooks of jobs that will never be
+            collected are not
+        """
+        # most hooks are for jobs that will never be collected
+        if not is_build_job(payload):
+            return False
+
+        inbox_id = await db.write(self.db, self.writer, db.append_inbox, payload)
+        await self._enqueue(inbox_id)
+        return True
+
+    async def prune(self) -> None:
+        """Deletes old done and failed rows from the inbox."""
+        self.pruned = asyncio.get_running_loop().time()
+        if pruned := await db.write(self.db, self.writer, db.prune_inbox):
+            logger.info(f"pruned {pruned} inbox rows")
+
+    async def sweep(self) -> None:
+        """Queues pending inbox rows while there is room in the worker queue."""
+        now = asyncio.get_running_loop().time()
+        if self.pruned is None or now - self.pruned >= INBOX_PRUNE_INTERVAL:
+            await self.prune()
+
+        room = self.pool.queue.maxsize - self.pool.queue.qsize()
+        if room <= 0:
+            return
+
+        # over-fetch by the number of ids we are already working on
+        for inbox_id in await db.pending_inbox(self.db, room + len(self.queued)):
+            if inbox_id not in self.queued and not await self._enqueue(inbox_id):
+                break
+
+    async def _enqueue(self, inbox_id: int) -> bool:
+        if not await self.pool.submit(inbox_id):
+            # the row stays pending until the next sweep
+            return False
+        self.queued.add(inbox_id)
+        return True
+
+    async def _sweep_forever(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("inbox sweep failed")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _collect(self, inbox_ids: int | list[int]):
+        if not isinstance(inbox_ids, list):
+            inbox_ids = [inbox_ids]
+
+        async def claim(conn: aiosqlite.Connection) -> list[tuple[int, dict]]:
+            claimed = []
+            for inbox_id in inbox_ids:
+                # None if the row was already handled
+                if (payload := await db.claim_inbox(conn, inbox_id)) is not None:
+                    claimed.append((inbox_id, payload))
+            return claimed
+
+        async def finish(conn: aiosqlite.Connection, results: list):
+            for (inbox_id, _), result in zip(claimed, results):
+                if is_request_error(result):
+                    # collected again by a later sweep
+                    await db.retry_inbox(conn, inbox_id)
+                else:
+                    await db.finish_inbox(conn, inbox_id, "done")
+
+        async def fail(conn: aiosqlite.Connection):
+            for inbox_id, _ in claimed:
+                await db.finish_inbox(conn, inbox_id, "failed")
+
+        try:
+            claimed = await db.write(self.db, self.writer, claim)
+            if not claimed:
+                return
+
+            payloads = [payload for _, payload in claimed]
+            try:
+                if len(payloads) == 1:
+                    try:
+                        results = [
+                            await fetch_job(
+                                payloads[0],
+                                self.db,
+                                self.gitlab,
+                                self.prometheus,
+                                self.node_cache,
+                                self.writer,
+                                self.allocation_cache,
+                                self.snapshot,
+                            )
+                        ]
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        logger.error(
+                            f"Request failed: {e!r} job={payloads[0]['build_id']}"
+                        )
+                        results = [e]
+                else:
+                    results = await fetch_jobs(
+                        payloads,
+                        self.db,
+                        self.gitlab,
+                        self.prometheus,
+                        self.node_cache,
+                        self.writer,
+                        self.allocation_cache,
+                        self.snapshot,
+                    )
+            except asyncio.CancelledError:
+                # shutting down, the rows are resumed on the next startup
+                raise
+            except Exception:
+                await db.write(self.db, self.writer, fail)
+                raise
+
+            await db.write(self.db, self.writer, finish, results)
+        finally:
+            self.queued.difference_update(inbox_ids)
@@ -0,0 +1,200 @@
+# optional, only imported when PREDICTION_SAMPLER=columnar
+import json
+from itertools import groupby
+from operator import itemgetter
+
+import aiosqlite
+import numpy as np
+
+from gantry.routes.prediction import (
+    EXPENSIVE_VARIANTS,
+    IDEAL_SAMPLE,
+    PARAM_COMBOS,
+    Sample,
+    expensive_variants_code,
+)
+from gantry.util.spec import variants_hash
+
+# the columns builds are matched on within their package, dictionary encoded
+MATCH_COLUMNS = (
+    "pkg_version",
+    "pkg_variants_hash",
+    "exp_variants",
+    "compiler_name",
+    "compiler_version",
+)
+# the columns of a sample, see get_sample
+USAGE_COLUMNS = ("cpu_mean", "cpu_max", "mem_mean", "mem_max")
+# the columns of each build in the snapshot, besides pkg_name
+SNAPSHOT_COLUMNS = ("id", "end", *MATCH_COLUMNS, *USAGE_COLUMNS)
+# the columns each tier of sample_tiers matches on besides pkg_name, by priority
+TIERS = [
+    tier
+    for combo in PARAM_COMBOS
+    for tier in (
+        combo[1:],
+        (
+            *(param for param in combo[1:] if param != "pkg_variants_hash"),
+            "exp_variants",
+        ),
+    )
+]
+
+
+class ColumnarSnapshot:
+    """
+    In-memory copy of the develop builds, which selects the same samples as
+    get_sample without going through the database.
+
+    The builds of each package are stored together as arrays, one per column,
+    in sample order. The columns builds are matched on are stored as integer codes,
+    so a sample is selected by comparing the package's codes to those of the spec
+    and taking the most recent builds of the first tier with enough matches.
+    Builds inserted after the snapshot was loaded are added with add.
+    """
+
+    def __init__(self):
+        # column -> {value: code}
+        self.codes = {column: {} for column in MATCH_COLUMNS}
+        # pkg_name -> {column: array} of the package's builds, oldest first
+        self.packages = {}
+        self.rows = 0
+
+    async def load(self, db: aiosqlite.Connection) -> int:
+        """
+        Copies the develop builds from the database.
+
+        returns: number of loaded builds
+        """
+
+        async with db.execute(
+            f"""
+            SELECT pkg_name, {", ".join(SNAPSHOT_COLUMNS)} FROM jobs WHERE ref='develop'
+            ORDER BY pkg_name, end, id
+            """
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+        self.packages = {
+            pkg_name: self._columns([build[1:] for build in builds])
+            for pkg_name, builds in groupby(rows, key=itemgetter(0))
+        }
+        self.rows = len(rows)
+
+        return self.rows
+
+    def add(self, job_id: int, job: dict) -> None:
+        """
+        Adds a build inserted after the snapshot was loaded.
+
+        args:
+            job: row of the jobs table, as passed to insert_job
+        """
+
+        variants = json.loads(job["pkg_variants"])
+        job = {
+            **job,
+            "id": job_id,
+            "pkg_variants_hash": variants_hash(variants),
+            "exp_variants": stored_variants_code(variants),
+        }
+        build = self._columns([tuple(job[column] for column in SNAPSHOT_COLUMNS)])
+        self.rows += 1
+
+        if (package := self.packages.get(job["pkg_name"])) is None:
+            self.packages[job["pkg_name"]] = build
+            return
+
+        # builds are usually collected after the ones already in the snapshot
+        position = int(np.searchsorted(package["end"], job["end"], side="left"))
+        while (
+            position < len(package["id"])
+            and package["end"][position] == job["end"]
+            and package["id"][position] < job_id
+        ):
+            position += 1
+        for column, values in package.items():
+            package[column] = np.insert(values, position, build[column], axis=0)
+
+    def sample(self, spec: dict) -> Sample:
+        """
+        Selects the sample of a spec, see get_sample
+
+        args:
+            spec: see predict
+        returns:
+            see get_sample
+        """
+
+        package = self.packages.get(spec["pkg_name"])
+        if package is None:
+            return Sample()
+
+        values = {
+            **spec,
+            "pkg_variants_hash": variants_hash(spec["pkg_variants_dict"]),
+            "exp_variants": expensive_variants_code(spec["pkg_variants_dict"]),
+        }
+        # values that no build has don't match any row
+        matches = {
+            column: package[column] == self.codes[column].get(values[column], -1)
+            for column in MATCH_COLUMNS
+        }
+
+        for tier, columns in enumerate(TIERS):
+            matched = np.flatnonzero(
+                np.logical_and.reduce([matches[column] for column in columns])
+            )
+            # we can accept the sample if it's 1 shorter
+            if len(matched) >= IDEAL_SAMPLE - 1:
+                sample = package["usage"][matched[: -IDEAL_SAMPLE - 1 : -1]]
+                # rows as returned by the database
+                return Sample([tuple(build) for build in sample.tolist()], tier)
+
+        return Sample()
+
+    def _columns(self, builds: list[tuple]) -> dict:
+        """builds: values of SNAPSHOT_COLUMNS of builds of the same package"""
+
+        values = dict(zip(SNAPSHOT_COLUMNS, zip(*builds)))
+        return {
+            "id": np.array(values["id"], dtype=np.int64),
+            "end": np.array(values["end"], dtype=np.float64),
+            **{
+                column: np.array(
+                    [self._encode(column, value) for value in values[column]],
+                    dtype=np.int32,
+                )
+                for column in MATCH_COLUMNS
+            },
+            # one row per build, as in a sample
+            "usage": np.column_stack(
+                [np.array(values[column], dtype=np.float64) for column in USAGE_COLUMNS]
+            ),
+        }
+
+    def _encode(self, column: str, value) -> int:
+        return self.codes[column].setdefault(value, len(self.codes[column]))
+
+
+def stored_variants_code(variants: dict) -> int:
+    """
+    The value of the exp_variants column of a build with these variants,
+    computed as in migrations/004_exp_variants.sql. Unlike expensive_variants_code,
+    which packs the variants of a spec, values other than booleans are stored as 3.
+    """
+
+    code = 0
+    for i, var in enumerate(sorted(EXPENSIVE_VARIANTS)):
+        value = variants.get(var)
+        if value is None:
+            continue
+        # json_extract returns booleans as 0 and 1, which SQL compares like numbers
+        if not isinstance(value, str) and value == 0:
+            code |= 1 << (2 * i)
+        elif not isinstance(value, str) and value == 1:
+            code |= 2 << (2 * i)
+        else:
+            code |= 3 << (2 * i)
+
+    return code
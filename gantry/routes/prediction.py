@@ -3,12 +3,15 @@ import logging
 import aiosqlite
 
 from gantry.util import k8s
+from gantry.util.metrics import Counter
+from gantry.util.spec import variants_hash
 
 logger = logging.getLogger(__name__)
 
 IDEAL_SAMPLE = 5
 DEFAULT_CPU_REQUEST = 1
 DEFAULT_MEM_REQUEST = 2 * 1_000_000_000  # 2GB in bytes
+# packed into the exp_variants column of jobs, changes need a migration
 EXPENSIVE_VARIANTS = {
     "sycl",
     "mpi",
@@ -19,21 +22,75 @@ EXPENSIVE_VARIANTS = {
     "openmp",
     "hdf5",
 }
+# ranked in order of priority, the params we would like to match on
+PARAM_COMBOS = (
+    (
+        "pkg_name",
+        "pkg_variants_hash",
+        "pkg_version",
+        "compiler_name",
+        "compiler_version",
+    ),
+    ("pkg_name", "pkg_variants_hash", "compiler_name", "compiler_version"),
+    ("pkg_name", "pkg_variants_hash", "pkg_version", "compiler_name"),
+    ("pkg_name", "pkg_variants_hash", "compiler_name"),
+    ("pkg_name", "pkg_variants_hash", "pkg_version"),
+    ("pkg_name", "pkg_variants_hash"),
+)
 
+predictions_clamped = Counter(
+    "gantry_predictions_clamped_total",
+    "predictions from a sample that were below the minimum and replaced by the "
+    "default request",
+    ["resource"],
+)
 
-async def predict(db: aiosqlite.Connection, spec: dict) -> dict:
+
+class Sample(list):
+    """
+    The builds selected by a sampler, see get_sample.
+    Compares equal to a list of the same builds.
+    """
+
+    def __init__(self, builds: list = (), tier: int | None = None):
+        """
+        args:
+            tier: index in sample_tiers of the tier the builds were selected from,
+                None when no tier had enough builds
+        """
+        super().__init__(builds)
+        self.tier = tier
+
+
+async def predict(
+    db: aiosqlite.Connection, spec: dict, sampler: str = "rollup"
+) -> dict:
     """
     Predict the resource usage of a spec
 
     args:
         spec: dict that contains pkg_name, pkg_version, pkg_variants,
         compiler_name, compiler_version
+        sampler: name of the function in SAMPLERS that selects the sample
     returns:
         dict of predicted resource usage: cpu_request, mem_request
         CPU in millicore, mem in MB
     """
 
-    sample = await get_sample(db, spec)
+    return allocate(spec, await SAMPLERS[sampler](db, spec))
+
+
+def allocate(spec: dict, sample: list) -> dict:
+    """
+    Turns a sample of builds into the response of predict
+
+    args:
+        spec: see predict
+        sample: see get_sample
+    returns:
+        see predict
+    """
+
     predictions = {}
     if not sample:
         predictions = {
@@ -52,9 +109,11 @@ async def predict(db: aiosqlite.Connection, spec: dict) -> dict:
     if predictions["cpu_request"] < 0.2:
         logger.warning(f"Warning: CPU request for {spec} is below 0.2 cores")
         predictions["cpu_request"] = DEFAULT_CPU_REQUEST
+        predictions_clamped.inc("cpu")
     if predictions["mem_request"] < 10_000_000:
         logger.warning(f"Warning: Memory request for {spec} is below 10MB")
         predictions["mem_request"] = DEFAULT_MEM_REQUEST
+        predictions_clamped.inc("mem")
 
     # convert predictions to k8s friendly format
     for k, v in predictions.items():
@@ -74,93 +133,208 @@ async def predict(db: aiosqlite.Connection, spec: dict) -> dict:
     }
 
 
-async def get_sample(db: aiosqlite.Connection, spec: dict) -> list:
+async def get_sample(db: aiosqlite.Connection, spec: dict) -> Sample:
     """
     Selects a sample of builds to use for prediction
 
+    The tiers (see sample_tiers) are evaluated in one statement. A CASE expression
+    returns the highest priority tier with enough builds and the ids of its sample,
+    and the builds are then looked up by id. CASE stops at the first tier that
+    matches, so lower priority tiers are only queried when they are needed.
+    This selects the same sample as querying the tiers one at a time,
+    in a single round trip.
+
     args:
         spec: see predict
     returns:
-        list of lists with cpu_mean, cpu_max, mem_mean, mem_max
-    """
-
-    # ranked in order of priority, the params we would like to match on
-    param_combos = (
-        (
-            "pkg_name",
-            "pkg_variants",
-            "pkg_version",
-            "compiler_name",
-            "compiler_version",
-        ),
-        ("pkg_name", "pkg_variants", "compiler_name", "compiler_version"),
-        ("pkg_name", "pkg_variants", "pkg_version", "compiler_name"),
-        ("pkg_name", "pkg_variants", "compiler_name"),
-        ("pkg_name", "pkg_variants", "pkg_version"),
-        ("pkg_name", "pkg_variants"),
+        Sample of tuples with cpu_mean, cpu_max, mem_mean, mem_max
+    """
+
+    tiers = sample_tiers(spec)
+    cases = []
+    values = []
+    for tier, (conditions, tier_values) in enumerate(tiers):
+        cases.append(
+            f"""
+            WHEN (
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM jobs WHERE ref='develop' AND {conditions}
+                    -- we can accept the sample if it's 1 shorter
+                    LIMIT {IDEAL_SAMPLE - 1}
+                )
+            ) = {IDEAL_SAMPLE - 1} THEN json_array({tier}, json((
+                SELECT json_group_array(id) FROM (
+                    SELECT id FROM jobs WHERE ref='develop' AND {conditions}
+                    ORDER BY end DESC, id DESC LIMIT {IDEAL_SAMPLE}
+                )
+            )))"""
+        )
+        values += tier_values * 2
+
+    query = f"""
+    WITH chosen(sample) AS MATERIALIZED (SELECT CASE {"".join(cases)} END)
+    SELECT
+        cpu_mean, cpu_max, mem_mean, mem_max,
+        (SELECT json_extract(sample, '$[0]') FROM chosen)
+    FROM jobs
+    WHERE id IN (SELECT value FROM json_each((SELECT sample FROM chosen), '$[1]'))
+    ORDER BY end DESC, id DESC
+    """
+
+    async with db.execute(query, values) as cursor:
+        return tiered_sample(await cursor.fetchall())
+
+
+async def get_sample_rollup(db: aiosqlite.Connection, spec: dict) -> Sample:
+    """
+    Selects the same sample as get_sample from the sample_rollup table,
+    which holds the ids of the sample of every key of every tier.
+    The cost of this doesn't grow with the number of builds.
+
+    args:
+        spec: see predict
+    returns:
+        see get_sample
+    """
+
+    lookups, values = tier_lookups(spec)
+    query = f"""
+    WITH chosen AS MATERIALIZED (
+        SELECT tier, sample FROM sample_rollup
+        WHERE ({lookups})
+        -- we can accept the sample if it's 1 shorter
+        AND json_array_length(sample) >= {IDEAL_SAMPLE - 1}
+        ORDER BY tier LIMIT 1
     )
+    SELECT cpu_mean, cpu_max, mem_mean, mem_max, (SELECT tier FROM chosen) FROM jobs
+    WHERE id IN (SELECT value FROM json_each((SELECT sample FROM chosen)))
+    ORDER BY end DESC, id DESC
+    """
 
-    async def select_sample(query: str, filters: dict, extra_params: list = []) -> list:
-        async with db.execute(query, list(filters.values()) + extra_params) as cursor:
-            sample = await cursor.fetchall()
-            # we can accept the sample if it's 1 shorter
-            if len(sample) >= IDEAL_SAMPLE - 1:
-                return sample
-        return []
+    async with db.execute(query, values) as cursor:
+        return tiered_sample(await cursor.fetchall())
 
-    for combo in param_combos:
-        filters = {param: spec[param] for param in combo}
 
-        # the first attempt at getting a sample is to match on all the params
-        # within this combo, variants included
-        query = f"""
-        SELECT cpu_mean, cpu_max, mem_mean, mem_max FROM jobs
-        WHERE ref='develop' AND {' AND '.join(f'{param}=?' for param in filters.keys())}
-        ORDER BY end DESC LIMIT {IDEAL_SAMPLE}
-        """
+def tiered_sample(rows: list) -> Sample:
+    """rows: the usage columns of each build, followed by the tier"""
+
+    return Sample([row[:4] for row in rows], rows[0][4] if rows else None)
+
 
-        if sample := await select_sample(query, filters):
-            return sample
+def tier_lookups(spec: dict) -> tuple[str, list]:
+    """
+    Matches the rows of a table keyed by tier and the values of its params
+    (see sample_rollup), for every tier of a spec
 
-        # if we are not able to get a sufficient sample, we'll try to filter
-        # by expensive variants, rather than an exact variant match
+    args:
+        spec: see predict
+    returns:
+        SQL condition on the tier and key columns, values for its placeholders
+    """
 
-        filters.pop("pkg_variants")
+    lookups = []
+    values = []
+    for tier, (_, tier_values) in enumerate(sample_tiers(spec)):
+        placeholders = ", ".join("?" for _ in tier_values)
+        lookups.append(f"(tier={tier} AND key=json_array({placeholders}))")
+        values += tier_values
 
-        exp_variant_conditions = []
-        exp_variant_values = []
+    return " OR ".join(lookups), values
 
-        # iterate through all the expensive variants and create a set of conditions
-        # for the select query
-        for var in EXPENSIVE_VARIANTS:
-            variant_value = spec["pkg_variants_dict"].get(var)
 
-            # check against specs where hdf5=none like quantum-espresso
-            if isinstance(variant_value, (bool, int)):
-                # if the client has queried for an expensive variant, we want to ensure
-                # that the sample has the same exact value
-                exp_variant_conditions.append(
-                    f"json_extract(pkg_variants, '$.{var}')=?"
-                )
+def spec_key(spec: dict) -> tuple:
+    """
+    Identifies the predictions of a spec, which only depend on these fields.
+    Starts with the package name, see AllocationCache.
 
-                exp_variant_values.append(int(variant_value))
-            else:
-                # if an expensive variant was not queried for,
-                # we want to make sure that the variant was not set within the sample
-                # as we want to ensure that the sample is not biased towards
-                # the presence of expensive variants (or lack thereof)
-                exp_variant_conditions.append(
-                    f"json_extract(pkg_variants, '$.{var}') IS NULL"
-                )
+    args:
+        spec: see predict
+    returns:
+        hashable key, equal for specs with the same prediction
+    """
+
+    return (
+        spec["pkg_name"],
+        spec["pkg_version"],
+        # canonical, so the order of the variants doesn't matter
+        spec["pkg_variants"],
+        spec["compiler_name"],
+        spec["compiler_version"],
+    )
 
-        query = f"""
-        SELECT cpu_mean, cpu_max, mem_mean, mem_max FROM jobs
-        WHERE ref='develop' AND {' AND '.join(f'{param}=?' for param in filters.keys())}
-        AND {' AND '.join(exp_variant_conditions)}
-        ORDER BY end DESC LIMIT {IDEAL_SAMPLE}
-        """
 
-        if sample := await select_sample(query, filters, exp_variant_values):
-            return sample
+def sample_tiers(spec: dict) -> list[tuple[str, list]]:
+    """
+    Lists the conditions builds in a sample must match, by priority.
+
+    For each combination of PARAM_COMBOS, the first attempt at getting a sample
+    is to match on all the params within this combo, variants included.
+    If that's not sufficient, we'll try to filter by expensive variants,
+    rather than an exact variant match.
 
-    return []
+    args:
+        spec: see predict
+    returns:
+        list of (SQL condition, values for its placeholders)
+    """
+
+    exp_code = expensive_variants_code(spec["pkg_variants_dict"])
+    spec = {**spec, "pkg_variants_hash": variants_hash(spec["pkg_variants_dict"])}
+
+    tiers = []
+    for combo in PARAM_COMBOS:
+        filters = {param: spec[param] for param in combo}
+        tiers.append(
+            (
+                " AND ".join(f"{param}=?" for param in filters),
+                list(filters.values()),
+            )
+        )
+
+        filters.pop("pkg_variants_hash")
+        tiers.append(
+            (
+                " AND ".join([*(f"{param}=?" for param in filters), "exp_variants=?"]),
+                [*filters.values(), exp_code],
+            )
+        )
+
+    return tiers
+
+
+def expensive_variants_code(variants: dict) -> int:
+    """
+    Packs the expensive variants of a spec into the format of the exp_variants
+    column (see migrations/004_exp_variants.sql)
+
+    args:
+        variants: pkg_variants_dict of a spec
+    returns:
+        the value of exp_variants in the builds that should be sampled
+    """
+
+    code = 0
+    for i, var in enumerate(sorted(EXPENSIVE_VARIANTS)):
+        variant_value = variants.get(var)
+
+        # check against specs where hdf5=none like quantum-espresso
+        if isinstance(variant_value, bool):
+            # if the client has queried for an expensive variant, we want to ensure
+            # that the sample has the same exact value
+            code |= (2 if variant_value else 1) << (2 * i)
+        # if an expensive variant was not queried for,
+        # we want to make sure that the variant was not set within the sample
+        # as we want to ensure that the sample is not biased towards
+        # the presence of expensive variants (or lack thereof)
+        # which is represented by 0
+
+    return code
+
+
+# ways of selecting the sample, see predict
+SAMPLERS = {
+    # reads builds from the jobs table
+    "jobs": get_sample,
+    # reads the ids of the builds from the sample_rollup table
+    "rollup": get_sample_rollup,
+}
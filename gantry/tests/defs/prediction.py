@@ -3,9 +3,10 @@
 
 from gantry.util.spec import parse_alloc_spec
 
-NORMAL_BUILD = parse_alloc_spec(
+NORMAL_SPEC = (
     "py-torch@2.2.1 ~caffe2+cuda+cudnn~debug+distributed+fbgemm+gloo+kineto~magma~metal+mkldnn+mpi~nccl+nnpack+numa+numpy+onnx_ml+openmp+qnnpack~rocm+tensorpipe~test+valgrind+xnnpack build_system=python_pip cuda_arch=80 arch=x86_64%gcc@11.4.0"
 )
+NORMAL_BUILD = parse_alloc_spec(NORMAL_SPEC)
 
 # everything in NORMAL_BUILD["package"]["variants"] except removing build_system=python_pip
 # in order to test the expensive variants filter
@@ -14,9 +15,8 @@ EXPENSIVE_VARIANT_BUILD = parse_alloc_spec(
 )
 
 # no variants should match this, so we expect the default prediction
-BAD_VARIANT_BUILD = parse_alloc_spec(
-    "py-torch@2.2.1 +no~expensive~variants+match arch=x86_64%gcc@11.4.0"
-)
+BAD_VARIANT_SPEC = "py-torch@2.2.1 +no~expensive~variants+match arch=x86_64%gcc@11.4.0"
+BAD_VARIANT_BUILD = parse_alloc_spec(BAD_VARIANT_SPEC)
 
 # calculated by running the baseline prediction algorithm on the sample data in gantry/tests/sql/insert_prediction.sql
 NORMAL_PREDICTION = {
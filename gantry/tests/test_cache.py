@@ -0,0 +1,70 @@
+from gantry.util.cache import AllocationCache, NodeCache
+
+
+def test_node_cache_expiry():
+    """Tests that entries are only fresh within ttl of the last sighting"""
+    cache = NodeCache(size=10, ttl=100)
+    cache.put("host", "uuid", 1, 1000)
+
+    assert cache.get("host", 1050) == ("uuid", 1)
+    # backfilled jobs may be older than the last sighting
+    assert cache.get("host", 950) == ("uuid", 1)
+    assert cache.get("host", 1200) is None
+    # expired entries can still be re-validated
+    assert cache.peek("host") == ("uuid", 1)
+
+    # sightings of the same node only move its window forward
+    cache.put("host", "uuid", 1, 500)
+    assert cache.get("host", 1050) == ("uuid", 1)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_node_cache_bounded():
+    """Tests that the least recently used hostnames are evicted"""
+    cache = NodeCache(size=2, ttl=100)
+    cache.put("a", "uuid-a", 1, 0)
+    cache.put("b", "uuid-b", 2, 0)
+    cache.get("a", 0)
+    cache.put("c", "uuid-c", 3, 0)
+
+    assert cache.peek("b") is None
+    assert cache.peek("a") == ("uuid-a", 1)
+    assert cache.peek("c") == ("uuid-c", 3)
+
+
+def test_allocation_cache_invalidation():
+    """Tests that predictions are dropped by package name"""
+    cache = AllocationCache(size=10)
+    cache.put(("gmsh", "4.8.4"), {"variables": 1}, cache.version("gmsh"))
+    cache.put(("hdf5", "1.14"), {"variables": 2}, cache.version("hdf5"))
+
+    assert cache.get(("gmsh", "4.8.4")) == {"variables": 1}
+    assert cache.invalidate("gmsh") == 1
+    assert cache.get(("gmsh", "4.8.4")) is None
+    assert cache.get(("hdf5", "1.14")) == {"variables": 2}
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_allocation_cache_stale_put():
+    """Tests that a prediction started before an insert of its package isn't kept"""
+    cache = AllocationCache(size=10)
+    version = cache.version("gmsh")
+    cache.invalidate("gmsh")
+    cache.put(("gmsh", "4.8.4"), {"variables": 1}, version)
+
+    assert cache.get(("gmsh", "4.8.4")) is None
+
+
+def test_allocation_cache_bounded():
+    """Tests that the least recently used specs are evicted"""
+    cache = AllocationCache(size=2)
+    cache.put(("a",), {}, 0)
+    cache.put(("b",), {}, 0)
+    cache.get(("a",))
+    cache.put(("c",), {}, 0)
+
+    assert cache.get(("b",)) is None
+    assert cache.evictions == 1
+    # evicted keys no longer belong to their package
+    assert cache.invalidate("b") == 0
+    assert cache.invalidate("a") == 1
@@ -1,16 +1,32 @@
+import asyncio
+import copy
+import json
+import time
+
+import aiohttp
 import pytest
 
+from gantry.clients.db import MAX_INBOX_ATTEMPTS, DBWriter
 from gantry.clients.gitlab import GitlabClient
-from gantry.clients.prometheus import PrometheusClient
-from gantry.routes.collection import fetch_job, fetch_node
+from gantry.clients.prometheus import PrometheusClient, util
+from gantry.clients.prometheus.job import PrometheusJobClient
+from gantry.routes.collection import (
+    Collector,
+    fetch_job,
+    fetch_job_group,
+    fetch_jobs,
+    fetch_node,
+    group_jobs,
+    is_ghost,
+    lookup_node,
+    parse_job,
+    stage_seconds,
+)
 from gantry.tests.defs import collection as defs
+from gantry.util.cache import AllocationCache, NodeCache
 
 # mapping of prometheus request shortcuts
 # to raw values that would be returned by resp.json()
-
-# note: the ordering of this dict indicated the order of the calls
-# if the order in which PrometheusClient._query is called changes,
-# this dict must be updated
 PROMETHEUS_REQS = {
     "job_annotations": defs.VALID_ANNOTATIONS,
     "job_resources": defs.VALID_RESOURCE_REQUESTS,
@@ -21,6 +37,41 @@ PROMETHEUS_REQS = {
     "node_labels": defs.VALID_NODE_LABELS,
 }
 
+# the metric that identifies each request in the query url
+# requests are issued concurrently, so responses can't be matched by call order
+PROMETHEUS_METRICS = {
+    "job_annotations": "kube_pod_annotations",
+    "job_resources": "kube_pod_container_resource_requests",
+    "job_limits": "kube_pod_container_resource_limits",
+    "job_memory_usage": "container_memory_working_set_bytes",
+    "job_cpu_usage": "container_cpu_usage_seconds_total",
+    "node_info": "kube_node_info",
+    "node_labels": "kube_node_labels",
+}
+
+
+def prometheus_responses(reqs: dict):
+    """Returns a side effect for PrometheusClient._query that answers from reqs"""
+
+    def query(url: str) -> dict:
+        for req, metric in PROMETHEUS_METRICS.items():
+            if metric in url:
+                return reqs[req]
+        raise ValueError(f"unexpected query {url}")
+
+    return query
+
+
+def log_stream(log: str, chunk_size: int = 4):
+    """Returns a replacement for GitlabClient._stream that serves log in chunks"""
+
+    async def stream(url, headers):
+        data = log.encode()
+        for i in range(0, len(data), chunk_size):
+            yield data[i : i + chunk_size]
+
+    return stream
+
 
 @pytest.fixture
 async def gitlab(mocker):
@@ -28,7 +79,9 @@ async def gitlab(mocker):
 
     # mock the request to the gitlab api
     # default is to return normal log that wouldn't be detected as a ghost job
-    mocker.patch.object(GitlabClient, "_request", return_value=defs.VALID_JOB_LOG)
+    mocker.patch.object(
+        GitlabClient, "_stream", side_effect=log_stream(defs.VALID_JOB_LOG)
+    )
     return GitlabClient("", "")
 
 
@@ -36,9 +89,8 @@ async def gitlab(mocker):
 async def prometheus(mocker):
     """Returns PrometheusClient with some default (mocked) behavior"""
 
-    # use dict value iterable to mock multiple calls
     mocker.patch.object(
-        PrometheusClient, "_query", side_effect=PROMETHEUS_REQS.values()
+        PrometheusClient, "_query", side_effect=prometheus_responses(PROMETHEUS_REQS)
     )
     return PrometheusClient("", "")
 
@@ -74,11 +126,64 @@ async def test_job_exists(db_conn):
     assert await fetch_job(defs.VALID_JOB, db_conn, None, None) is None
 
 
-async def test_ghost_job(db_conn, gitlab, mocker):
+async def test_ghost_job(db_conn, gitlab, prometheus, mocker):
     """Tests that a ghost job is detected"""
 
-    mocker.patch.object(gitlab, "_request", return_value=defs.GHOST_JOB_LOG)
-    assert await fetch_job(defs.VALID_JOB, db_conn, gitlab, None) is None
+    gitlab._stream.side_effect = log_stream(defs.GHOST_JOB_LOG)
+    # the annotation lookup runs alongside the ghost check, its result is ignored
+    p = PROMETHEUS_REQS.copy()
+    p["job_annotations"] = {}
+    prometheus._query.side_effect = prometheus_responses(p)
+    assert await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus) is None
+    assert prometheus._query.await_count == 1
+
+
+async def test_log_scan_stops(gitlab):
+    """Tests that the log is only read until a marker is found"""
+
+    log = "preamble\n==> Installing gmsh\n" + "build output\n" * 1000
+    gitlab._stream.side_effect = log_stream(log)
+    assert not await is_ghost(gitlab, 1)
+    assert gitlab.log_bytes_read < 40
+
+    # markers split between chunks are still found
+    gitlab._stream.side_effect = log_stream("x" * 7 + defs.GHOST_JOB_LOG, 5)
+    assert await is_ghost(gitlab, 1)
+    assert gitlab.logs_scanned == 2
+
+
+async def test_log_scan_range(db_conn, gitlab, prometheus):
+    """
+    Tests that the scan is limited to log_max_bytes, and that jobs without
+    an outcome within the limit are not collected
+    """
+
+    gitlab.log_max_bytes = 16
+    gitlab._stream.side_effect = log_stream("x" * 100 + defs.GHOST_JOB_LOG)
+    assert await is_ghost(gitlab, 1) is None
+    assert gitlab._stream.call_args.args[1] == {"Range": "bytes=0-15"}
+    assert gitlab.log_bytes_read == 16
+
+    assert await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus) is None
+    assert await fetch_jobs([defs.VALID_JOB], db_conn, gitlab, prometheus) == [None]
+
+
+async def test_log_scan_bootstrap(gitlab):
+    """Tests that spack bootstrapping its tools is not mistaken for a build"""
+
+    log = (
+        '==> Installing "clingo-bootstrap@spack%gcc@10.2.1" from a buildcache\n'
+        '==>\x1b[0m Installing "gnupg@2.3.4%gcc" from a buildcache\n'
+        "No need to rebuild gmsh/abcdef\n"
+    )
+    gitlab._stream.side_effect = log_stream(log)
+    assert await is_ghost(gitlab, 1)
+
+    gitlab._stream.side_effect = log_stream(
+        log.replace("No need to rebuild", "Rebuilding")
+        + "==>\x1b[0m Installing \x1b[0;36mgmsh-4.8.4-abcdef\n"
+    )
+    assert await is_ghost(gitlab, 1) is False
 
 
 @pytest.mark.parametrize(
@@ -99,7 +204,88 @@ async def test_missing_data(db_conn, gitlab, prometheus, req):
     p = PROMETHEUS_REQS.copy()
     # for each req in PROMETHEUS_REQS, set it to an empty dict
     p[req] = {}
-    prometheus._query.side_effect = p.values()
+    prometheus._query.side_effect = prometheus_responses(p)
+    assert await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus) is None
+
+
+async def test_concurrent_queries(db_conn, gitlab, prometheus):
+    """
+    Tests that the queries that only depend on the pod name are in flight
+    at the same time instead of being issued one after another
+    """
+
+    in_flight = 0
+    peak = 0
+    respond = prometheus_responses(PROMETHEUS_REQS)
+
+    async def slow_query(url):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return respond(url)
+
+    prometheus._query.side_effect = slow_query
+    assert await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus) == 1
+    # requests, limits, memory and cpu usage
+    assert peak == 4
+
+
+def stats_response(range_response: dict) -> dict:
+    """
+    Turns a range response into the response Prometheus would give
+    to a usage_stats_query over the same samples
+    """
+
+    stats = util.process_usage(PrometheusClient("").prettify_res(range_response))
+    return {
+        "status": "success",
+        "data": {
+            "resultType": "vector",
+            "result": [
+                {"metric": {"stat": stat}, "value": [1706118420, str(value)]}
+                for stat, value in stats.items()
+            ],
+        },
+    }
+
+
+async def test_aggregate_usage(db_conn, gitlab, prometheus):
+    """
+    Tests that usage statistics computed by Prometheus are stored
+    the same way as the ones computed from the downloaded samples
+    """
+
+    prometheus.usage_mode = "aggregate"
+    p = PROMETHEUS_REQS.copy()
+    p["job_memory_usage"] = stats_response(defs.VALID_MEMORY_USAGE)
+    p["job_cpu_usage"] = stats_response(defs.VALID_CPU_USAGE)
+    prometheus._query.side_effect = prometheus_responses(p)
+
+    assert await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus) == 1
+    usage_urls = [
+        call.args[0]
+        for call in prometheus._query.await_args_list
+        if "usage" in call.args[0] or "working_set" in call.args[0]
+    ]
+    assert len(usage_urls) == 2
+    assert all("/query?" in url and "avg_over_time" in url for url in usage_urls)
+
+    async with db_conn.execute("SELECT * FROM jobs WHERE id=?", (1,)) as cursor:
+        assert await cursor.fetchone() == pytest.approx(defs.INSERTED_JOB)
+
+
+async def test_aggregate_usage_missing(db_conn, gitlab, prometheus):
+    """Tests that a partial aggregated response is treated as missing data"""
+
+    prometheus.usage_mode = "aggregate"
+    p = PROMETHEUS_REQS.copy()
+    p["job_memory_usage"] = stats_response(defs.VALID_MEMORY_USAGE)
+    p["job_memory_usage"]["data"]["result"].pop()
+    p["job_cpu_usage"] = stats_response(defs.VALID_CPU_USAGE)
+    prometheus._query.side_effect = prometheus_responses(p)
+
     assert await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus) is None
 
 
@@ -109,10 +295,58 @@ async def test_invalid_usage(db_conn, gitlab, prometheus):
     p = PROMETHEUS_REQS.copy()
     # could also be cpu usage
     p["job_memory_usage"] = defs.INVALID_MEMORY_USAGE
-    prometheus._query.side_effect = p.values()
+    prometheus._query.side_effect = prometheus_responses(p)
     assert await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus) is None
 
 
+async def test_duplicate_webhooks(db_conn, gitlab, prometheus):
+    """Tests that concurrent collections of the same job share one execution"""
+
+    results = await asyncio.gather(
+        fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus),
+        fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus),
+    )
+    assert results == [1, 1]
+    assert prometheus._query.await_count == len(PROMETHEUS_REQS)
+
+
+async def test_concurrent_node_lookups(db_conn, prometheus):
+    """Tests that concurrent lookups of a new node only query Prometheus once"""
+
+    hostname = defs.INSERTED_NODE[2]
+    assert await asyncio.gather(
+        fetch_node(db_conn, prometheus, hostname, 0),
+        fetch_node(db_conn, prometheus, hostname, 0),
+    ) == [1, 1]
+    # node info and labels
+    assert prometheus._query.await_count == 2
+
+
+async def test_concurrent_reused_hostname(db_conn, prometheus):
+    """
+    Tests that concurrent lookups of a hostname at times far apart are not shared,
+    as the hostname may have been reused by a new node
+    """
+
+    new_node_info = copy.deepcopy(defs.VALID_NODE_INFO)
+    new_node_info["data"]["result"][0]["metric"]["system_uuid"] = "new-uuid"
+    query = prometheus_responses(PROMETHEUS_REQS)
+
+    def node_query(url: str) -> dict:
+        if "kube_node_info" in url and "time=3600" in url:
+            return new_node_info
+        return query(url)
+
+    prometheus._query.side_effect = node_query
+    hostname = defs.INSERTED_NODE[2]
+    (_, first), (_, second) = await asyncio.gather(
+        lookup_node(db_conn, prometheus, hostname, 0),
+        lookup_node(db_conn, prometheus, hostname, 3600),
+    )
+    assert first["uuid"] == defs.INSERTED_NODE[1]
+    assert second["uuid"] == "new-uuid"
+
+
 async def test_job_node_inserted(db_conn, gitlab, prometheus):
     """Tests that the job and node are in the database after calling fetch_node"""
 
@@ -126,20 +360,392 @@ async def test_job_node_inserted(db_conn, gitlab, prometheus):
     assert node == defs.INSERTED_NODE
 
 
+async def test_stages_observed(db_conn, gitlab, prometheus):
+    """Tests that the duration of each stage of a collection is recorded"""
+
+    def observed() -> dict:
+        return {
+            stage: sum(counts) for (stage,), (counts, _) in stage_seconds.series.items()
+        }
+
+    before = observed()
+    await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus)
+    after = observed()
+
+    assert {stage: after[stage] - before.get(stage, 0) for stage in after} == {
+        "gitlab_log": 1,
+        "annotations": 1,
+        "resources": 1,
+        "usage": 1,
+        "node": 1,
+        "insert": 1,
+    }
+
+
+async def test_job_node_written(db_conn, gitlab, prometheus):
+    """Tests that the job and node are committed through the writer"""
+
+    writer = DBWriter(db_conn, max_delay=0.01)
+    writer.start()
+    assert (
+        await fetch_job(defs.VALID_JOB, db_conn, gitlab, prometheus, writer=writer) == 1
+    )
+    await writer.stop()
+
+    assert writer.commits == 1
+    async with db_conn.execute("SELECT * FROM jobs") as cursor:
+        assert await cursor.fetchall() == [defs.INSERTED_JOB]
+
+
+@pytest.mark.parametrize("batch", [False, True])
+@pytest.mark.parametrize(
+    "ref,dropped",
+    [
+        ("develop", True),
+        # pull request builds are not used for predictions
+        (defs.VALID_JOB["ref"], False),
+    ],
+)
+async def test_allocation_cache_invalidated(
+    db_conn, gitlab, prometheus, batch, ref, dropped
+):
+    """Tests that collected develop builds drop the predictions of their package"""
+
+    cache = AllocationCache(size=10)
+    key = ("gmsh", "4.8.4")
+    cache.put(key, {}, 0)
+
+    job = defs.VALID_JOB | {"ref": ref}
+    if batch:
+        await fetch_jobs([job], db_conn, gitlab, prometheus, allocation_cache=cache)
+    else:
+        await fetch_job(job, db_conn, gitlab, prometheus, allocation_cache=cache)
+
+    assert (cache.get(key) is None) == dropped
+
+
 async def test_node_exists(db_conn, prometheus):
     """Tests that fetch_node returns the existing node id when the node
     is already in the database"""
 
-    # when fetch_node is called, only two prometheus requests are made
-    # (see comment above PROMETHEUS_REQS)
-    prometheus._query.side_effect = [
-        PROMETHEUS_REQS["node_info"],
-        PROMETHEUS_REQS["node_labels"],
-    ]
-
     # in the inserted row, the node id is 2 because if the fetch_node call
     # inserts a new node, the id would be set to 1
     with open("gantry/tests/sql/insert_node.sql") as f:
         await db_conn.executescript(f.read())
 
-    assert await fetch_node(db_conn, prometheus, None, None) == 2
+    assert await fetch_node(db_conn, prometheus, None, 0) == 2
+
+
+async def test_node_cache(db_conn, prometheus):
+    """Tests that cached nodes skip the lookup until their entry expires"""
+
+    with open("gantry/tests/sql/insert_node.sql") as f:
+        await db_conn.executescript(f.read())
+    with open("gantry/tests/sql/insert_job.sql") as f:
+        await db_conn.executescript(f.read())
+
+    hostname = defs.INSERTED_NODE[2]
+    job_end = parse_job(defs.VALID_JOB).end
+    cache = NodeCache(size=10, ttl=600)
+    assert await cache.warm(db_conn) == 1
+
+    assert await fetch_node(db_conn, prometheus, hostname, job_end, cache) == 2
+    assert prometheus._query.await_count == 0
+
+    # expired entries are re-validated with the node's uuid
+    later = job_end + 3600
+    assert await fetch_node(db_conn, prometheus, hostname, later, cache) == 2
+    assert prometheus._query.await_count == 1
+    assert cache.get(hostname, later) == (defs.INSERTED_NODE[1], 2)
+
+
+async def test_node_cache_reused_hostname(db_conn, prometheus):
+    """Tests that a hostname reused by a new node is looked up again"""
+
+    with open("gantry/tests/sql/insert_node.sql") as f:
+        await db_conn.executescript(f.read())
+
+    hostname = defs.INSERTED_NODE[2]
+    cache = NodeCache(size=10, ttl=600)
+    cache.put(hostname, "old-uuid", 5, 0)
+
+    assert await fetch_node(db_conn, prometheus, hostname, 3600, cache) == 2
+    assert cache.peek(hostname) == (defs.INSERTED_NODE[1], 2)
+
+
+async def test_batch_inserted(db_conn, gitlab, prometheus):
+    """
+    Tests that batched collection inserts the same rows as fetch_job,
+    using one query per metric for the whole batch
+    """
+
+    # no annotations will be found for this job
+    missing = defs.VALID_JOB | {"build_id": 1}
+    # not a build job, filtered before any request is made
+    skipped = defs.VALID_JOB | {"build_id": 2, "build_stage": defs.INVALID_STAGE}
+
+    assert await fetch_jobs(
+        [defs.VALID_JOB, missing, skipped], db_conn, gitlab, prometheus
+    ) == [1, None, None]
+    assert prometheus._query.await_count == len(PROMETHEUS_REQS)
+
+    async with db_conn.execute("SELECT * FROM jobs") as cursor:
+        assert await cursor.fetchall() == [defs.INSERTED_JOB]
+    async with db_conn.execute("SELECT * FROM nodes") as cursor:
+        assert await cursor.fetchall() == [defs.INSERTED_NODE]
+
+
+async def test_batch_duplicates(db_conn, gitlab, prometheus):
+    """Tests that a job that appears twice in a batch is collected once"""
+
+    assert await fetch_jobs(
+        [defs.VALID_JOB, defs.VALID_JOB], db_conn, gitlab, prometheus
+    ) == [1, 1]
+    assert prometheus._query.await_count == len(PROMETHEUS_REQS)
+
+
+async def test_batch_missing_data(db_conn, gitlab, prometheus):
+    """Tests that a batch with missing usage data doesn't insert the job"""
+
+    p = PROMETHEUS_REQS.copy()
+    p["job_cpu_usage"] = {}
+    prometheus._query.side_effect = prometheus_responses(p)
+    assert await fetch_jobs([defs.VALID_JOB], db_conn, gitlab, prometheus) == [None]
+
+
+async def test_batch_reused_hostname(db_conn, prometheus, mocker):
+    """
+    Tests that jobs of a group that ran hours apart on a reused hostname
+    are attributed to the node that held the hostname at the time
+    """
+
+    job = parse_job(defs.VALID_JOB)
+    later = parse_job(
+        defs.VALID_JOB
+        | {
+            "build_id": job.gl_id + 1,
+            "build_started_at": "2024-01-24 19:24:06 UTC",
+            "build_finished_at": "2024-01-24 19:47:00 UTC",
+        }
+    )
+    annotations = await prometheus.job.get_annotations(job.gl_id, job.midpoint)
+    resources = await prometheus.job.get_resources(annotations["pod"], job.midpoint)
+    usage = await prometheus.job.get_usage(annotations["pod"], job.start, job.end)
+
+    # the hostname belongs to a new node for the later job
+    new_node_info = copy.deepcopy(defs.VALID_NODE_INFO)
+    new_node_info["data"]["result"][0]["metric"]["system_uuid"] = "new-uuid"
+    query = prometheus_responses(PROMETHEUS_REQS)
+
+    def node_query(url: str) -> dict:
+        if "kube_node_info" in url and f"time={later.midpoint}" in url:
+            return new_node_info
+        return query(url)
+
+    prometheus._query.side_effect = node_query
+    pods = {job.gl_id: annotations["pod"], later.gl_id: "later-pod"}
+    mocker.patch.object(
+        PrometheusJobClient,
+        "get_annotations_batch",
+        return_value={gl_id: annotations | {"pod": pod} for gl_id, pod in pods.items()},
+    )
+    mocker.patch.object(
+        PrometheusJobClient,
+        "get_resources_batch",
+        return_value={pod: resources for pod in pods.values()},
+    )
+    mocker.patch.object(
+        PrometheusJobClient,
+        "get_usage_batch",
+        return_value={pod: usage for pod in pods.values()},
+    )
+
+    assert await fetch_job_group([job, later], db_conn, prometheus) == {
+        job.gl_id: 1,
+        later.gl_id: 2,
+    }
+    async with db_conn.execute(
+        "SELECT jobs.gitlab_id, nodes.uuid FROM jobs JOIN nodes ON jobs.node=nodes.id"
+    ) as cursor:
+        assert await cursor.fetchall() == [
+            (job.gl_id, defs.INSERTED_NODE[1]),
+            (later.gl_id, "new-uuid"),
+        ]
+
+
+def test_group_jobs():
+    """Tests that jobs are grouped by the window they span"""
+
+    def job(gl_id, start, end):
+        return parse_job(
+            defs.VALID_JOB
+            | {
+                "build_id": gl_id,
+                "build_started_at": f"2024-01-24 {start} UTC",
+                "build_finished_at": f"2024-01-24 {end} UTC",
+            }
+        )
+
+    jobs = [
+        job(1, "10:00:00", "10:30:00"),
+        job(2, "10:10:00", "11:00:00"),
+        # would stretch the first window past an hour
+        job(3, "10:20:00", "11:30:00"),
+        job(4, "12:00:00", "12:10:00"),
+    ]
+    groups = group_jobs(jobs, 60 * 60)
+    assert [[job.gl_id for job in group] for group in groups] == [[1, 2], [3], [4]]
+
+
+async def inbox_rows(db_conn) -> list:
+    async with db_conn.execute("SELECT id, status FROM inbox ORDER BY id") as cursor:
+        return await cursor.fetchall()
+
+
+async def test_collector_receive(db_conn, mocker):
+    """Tests that received payloads are stored, collected and marked done"""
+
+    fetch = mocker.patch("gantry.routes.collection.fetch_job")
+    writer = DBWriter(db_conn, max_delay=0.01)
+    writer.start()
+    collector = Collector(
+        db_conn, None, None, workers=1, max_depth=1, poll_interval=60, writer=writer
+    )
+    await collector.start()
+    await collector.receive(defs.VALID_JOB)
+    await collector.pool.queue.join()
+    await collector.stop()
+    await writer.stop()
+
+    fetch.assert_awaited_once_with(
+        defs.VALID_JOB, db_conn, None, None, None, writer, None, None
+    )
+    assert await inbox_rows(db_conn) == [(1, "done")]
+
+
+async def test_collector_failure(db_conn, mocker):
+    """Tests that a collection that raises is marked as failed"""
+
+    mocker.patch("gantry.routes.collection.fetch_job", side_effect=ValueError)
+    collector = Collector(db_conn, None, None, workers=1, max_depth=1, poll_interval=60)
+    await collector.start()
+    await collector.receive(defs.VALID_JOB)
+    await collector.pool.queue.join()
+    await collector.stop()
+
+    assert await inbox_rows(db_conn) == [(1, "failed")]
+
+
+async def test_collector_request_failure(db_conn, gitlab, prometheus):
+    """
+    Tests that jobs whose requests failed are collected again by a later sweep,
+    until they have been attempted too many times
+    """
+
+    prometheus._query.side_effect = aiohttp.ClientError
+    collector = Collector(
+        db_conn, gitlab, prometheus, workers=1, max_depth=1, poll_interval=60
+    )
+    await collector.start()
+    await collector.receive(defs.VALID_JOB)
+    await collector.pool.queue.join()
+    assert await inbox_rows(db_conn) == [(1, "pending")]
+
+    for _ in range(MAX_INBOX_ATTEMPTS - 1):
+        await collector.sweep()
+        await collector.pool.queue.join()
+    await collector.stop()
+
+    assert await inbox_rows(db_conn) == [(1, "failed")]
+
+
+async def test_batch_request_failure(db_conn, gitlab, prometheus):
+    """Tests that fetch_jobs reports the jobs whose requests failed"""
+
+    prometheus._query.side_effect = aiohttp.ClientError
+    other = defs.VALID_JOB | {"build_id": defs.VALID_JOB["build_id"] + 1}
+    results = await fetch_jobs([defs.VALID_JOB, other], db_conn, gitlab, prometheus)
+    assert all(isinstance(result, aiohttp.ClientError) for result in results)
+
+
+async def test_collector_ignored_events(db_conn, mocker):
+    """Tests that hooks for jobs that won't be collected are not stored"""
+
+    collector = Collector(db_conn, None, None, workers=1, max_depth=1, poll_interval=60)
+    for key, value in [
+        ("build_status", "running"),
+        ("build_stage", defs.INVALID_STAGE),
+        ("runner", None),
+    ]:
+        await collector.receive(defs.VALID_JOB | {key: value})
+
+    assert await inbox_rows(db_conn) == []
+
+
+async def test_collector_prune(db_conn, mocker):
+    """Tests that old done and failed rows are pruned by the sweep"""
+
+    mocker.patch("gantry.routes.collection.INBOX_PRUNE_INTERVAL", 0)
+    collector = Collector(db_conn, None, None, workers=1, max_depth=1, poll_interval=60)
+    await collector.start()
+    await db_conn.executemany(
+        "INSERT INTO inbox (payload, status, received, updated) VALUES ('{}', ?, 0, ?)",
+        [("done", 0), ("failed", 0), ("failed", time.time())],
+    )
+    await collector.sweep()
+    await collector.stop()
+
+    assert await inbox_rows(db_conn) == [(3, "failed")]
+
+
+async def test_collector_resume(db_conn, mocker):
+    """
+    Tests that rows left pending or running by a previous process are collected
+    on startup, and that rows interrupted too many times are given up on.
+    """
+
+    payload = json.dumps(defs.VALID_JOB)
+    await db_conn.executemany(
+        "INSERT INTO inbox (payload, status, attempts, received, updated) "
+        "VALUES (?, ?, ?, 0, 0)",
+        [
+            (payload, "pending", 0),
+            (payload, "running", 1),
+            (payload, "running", 3),
+            (payload, "done", 1),
+        ],
+    )
+    await db_conn.commit()
+
+    fetch = mocker.patch("gantry.routes.collection.fetch_job")
+    collector = Collector(db_conn, None, None, workers=2, max_depth=5, poll_interval=60)
+    await collector.start()
+    await collector.sweep()
+    await collector.pool.queue.join()
+    await collector.stop()
+
+    assert fetch.await_count == 2
+    # the done row is older than the retention period
+    assert await inbox_rows(db_conn) == [(1, "done"), (2, "done"), (3, "failed")]
+
+
+async def test_collector_overflow(db_conn, mocker):
+    """Tests that jobs that don't fit into the queue wait in the inbox"""
+
+    fetch = mocker.patch("gantry.routes.collection.fetch_job")
+    collector = Collector(db_conn, None, None, workers=1, max_depth=1, poll_interval=60)
+    # receive without workers running so the queue fills up
+    for _ in range(3):
+        await collector.receive(defs.VALID_JOB)
+    assert collector.pool.queue.qsize() == 1
+
+    await collector.start()
+    # each sweep queues as many pending rows as fit
+    for _ in range(3):
+        await collector.pool.queue.join()
+        await collector.sweep()
+    await collector.pool.queue.join()
+    await collector.stop()
+
+    assert fetch.await_count == 3
+    assert [status for _, status in await inbox_rows(db_conn)] == ["done"] * 3
@@ -1,5 +1,16 @@
+import asyncio
+import sqlite3
+
+import aiosqlite
+import pytest
+
+from gantry.__main__ import apply_migrations
 from gantry.clients.db.insert import insert_job, insert_node
+from gantry.clients.db.pool import ReadPool, configure
+from gantry.clients.db.writer import DBWriter
+from gantry.tests.defs import collection as collection_defs
 from gantry.tests.defs import db as defs
+from gantry.util.spec import variants_hash
 
 
 async def test_node_insert_race(db_conn):
@@ -28,3 +39,194 @@ async def test_insert_node_incomplete(db_conn):
 async def test_insert_job_incomplete(db_conn):
     """See test_insert_node_incomplete"""
     assert await insert_job(db_conn, {"node": None}) is None
+
+
+@pytest.fixture
+async def db_conn_v4():
+    """Connection to a database that has migrations up to 004 applied"""
+    db = await aiosqlite.connect(":memory:")
+    try:
+        for migration in [
+            "001_initial.sql",
+            "002_spec_index.sql",
+            "003_inbox.sql",
+            "004_exp_variants.sql",
+        ]:
+            with open(f"migrations/{migration}") as f:
+                await db.executescript(f.read())
+        await db.execute("PRAGMA user_version = 4")
+        yield db
+    finally:
+        await db.close()
+
+
+async def test_variants_migration(db_conn_v4):
+    """Tests that the variants of existing jobs are rewritten in canonical form"""
+    await insert_node(db_conn_v4, defs.NODE_INSERT_DICT)
+    # the inserted job as stored before the migration, with unsorted variants
+    job = list(collection_defs.INSERTED_JOB[:30])
+    job[10] = '{"shared": true, "patches": ["b", "a"], "mpi": false}'
+    await db_conn_v4.execute(f"INSERT INTO jobs VALUES ({', '.join('?' * 30)})", job)
+    await db_conn_v4.commit()
+
+    await apply_migrations(db_conn_v4)
+    async with db_conn_v4.execute(
+        "SELECT pkg_variants, pkg_variants_hash FROM jobs"
+    ) as cursor:
+        assert await cursor.fetchall() == [
+            (
+                '{"mpi": false, "patches": ["a", "b"], "shared": true}',
+                variants_hash({"mpi": False, "patches": ["a", "b"], "shared": True}),
+            )
+        ]
+
+
+async def count_nodes(db_conn) -> int:
+    async with db_conn.execute("SELECT COUNT(*) FROM nodes") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def test_writer_group_commit(db_conn):
+    """Tests that concurrent writes share one commit and get their own results"""
+    writer = DBWriter(db_conn, max_batch=10, max_delay=0.01)
+    writer.start()
+
+    nodes = [defs.NODE_INSERT_DICT | {"uuid": f"uuid-{i}"} for i in range(3)]
+    ids = await asyncio.gather(*(writer.submit(insert_node, node) for node in nodes))
+    await writer.stop()
+
+    assert ids == [1, 2, 3]
+    assert writer.commits == 1
+    assert not db_conn.in_transaction
+    assert await count_nodes(db_conn) == 3
+
+
+async def test_writer_failure(db_conn):
+    """Tests that a failing write only rolls back its own changes"""
+    writer = DBWriter(db_conn, max_batch=10, max_delay=0.01)
+    writer.start()
+
+    async def insert_and_fail(conn):
+        await insert_node(conn, defs.NODE_INSERT_DICT | {"uuid": "bad"})
+        raise ValueError("bad node")
+
+    results = await asyncio.gather(
+        writer.submit(insert_node, defs.NODE_INSERT_DICT),
+        writer.submit(insert_and_fail),
+        return_exceptions=True,
+    )
+    await writer.stop()
+
+    assert results[0] == 1
+    with pytest.raises(ValueError, match="bad node"):
+        raise results[1]
+    assert await count_nodes(db_conn) == 1
+
+
+async def test_writer_rollback_failure(db_conn, mocker):
+    """Tests that the writer keeps going when a group can't be committed or undone"""
+    writer = DBWriter(db_conn, max_delay=0.01)
+    writer.start()
+
+    mocker.patch.object(db_conn, "commit", side_effect=sqlite3.OperationalError)
+    mocker.patch.object(db_conn, "rollback", side_effect=sqlite3.OperationalError)
+    with pytest.raises(sqlite3.OperationalError):
+        await writer.submit(insert_node, defs.NODE_INSERT_DICT)
+    mocker.stopall()
+
+    assert await writer.submit(insert_node, defs.NODE_INSERT_DICT) == 1
+    await asyncio.wait_for(writer.stop(), 1)
+
+
+async def test_writer_stop_dead_task(db_conn):
+    """Tests that stopping doesn't wait for a writer task that has died"""
+    writer = DBWriter(db_conn)
+    writer.start()
+    writer.task.cancel()
+    await asyncio.gather(writer.task, return_exceptions=True)
+
+    submitted = asyncio.create_task(writer.submit(insert_node, defs.NODE_INSERT_DICT))
+    await asyncio.sleep(0)
+    await asyncio.wait_for(writer.stop(), 1)
+
+    with pytest.raises(RuntimeError, match="writer stopped"):
+        await submitted
+
+
+async def test_read_pool(tmp_path):
+    """Tests that pooled connections see committed writes and can't write"""
+    path = tmp_path / "gantry.db"
+    writer = await aiosqlite.connect(path)
+    await configure(writer, wal=True)
+    await apply_migrations(writer)
+
+    pool = ReadPool(path, size=2)
+    await pool.open()
+    await insert_node(writer, defs.NODE_INSERT_DICT)
+    await writer.commit()
+
+    async with pool.acquire() as first, pool.acquire() as second:
+        assert first is not second
+        async with first.execute("SELECT COUNT(*) FROM nodes") as cursor:
+            assert await cursor.fetchone() == (1,)
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            await second.execute("DELETE FROM nodes")
+
+    async with writer.execute("PRAGMA journal_mode") as cursor:
+        assert await cursor.fetchone() == ("wal",)
+
+    await pool.close()
+    await writer.close()
+
+
+async def test_read_pool_fair(tmp_path):
+    """Tests that connections go to waiting callers in arrival order"""
+    path = tmp_path / "gantry.db"
+    writer = await aiosqlite.connect(path)
+    await apply_migrations(writer)
+    pool = ReadPool(path, size=1)
+    await pool.open()
+
+    order = []
+
+    async def read(name):
+        for _ in range(2):
+            async with pool.acquire():
+                order.append(name)
+                await asyncio.sleep(0)
+
+    await asyncio.gather(read("a"), read("b"))
+    assert order == ["a", "b", "a", "b"]
+
+    await pool.close()
+    await writer.close()
+
+
+async def test_read_pool_cancelled_waiter(tmp_path):
+    """
+    Tests that a connection released while a waiting caller is being cancelled
+    goes back to the pool
+    """
+    path = tmp_path / "gantry.db"
+    writer = await aiosqlite.connect(path)
+    await apply_migrations(writer)
+    pool = ReadPool(path, size=1)
+    await pool.open()
+
+    async def read():
+        async with pool.acquire():
+            pass
+
+    async with pool.acquire() as conn:
+        waiting = asyncio.create_task(read())
+        await asyncio.sleep(0)
+        # the connection is released before the cancelled caller runs again
+        waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+
+    assert waiting.cancelled()
+    assert pool.idle == [conn]
+    assert not pool.waiters
+
+    await pool.close()
+    await writer.close()
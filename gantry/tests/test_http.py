@@ -0,0 +1,53 @@
+from aiohttp import web
+
+from gantry.clients.gitlab import GitlabClient
+from gantry.clients.http import create_session, pool_stats, upstream_seconds
+
+
+async def ok(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+async def test_pool_reuse(aiohttp_server, monkeypatch):
+    """Tests that the shared session reuses connections and records pool stats"""
+
+    monkeypatch.setenv("HTTP_POOL_LIMIT", "5")
+    monkeypatch.setenv("HTTP_POOL_LIMIT_PER_HOST", "2")
+
+    app = web.Application()
+    app.router.add_get("/", ok)
+    server = await aiohttp_server(app)
+
+    def responses() -> int:
+        counts, _ = upstream_seconds.series.get((server.host, "200"), ([], 0))
+        return sum(counts)
+
+    observed = responses()
+    session = create_session()
+    for _ in range(3):
+        async with session.get(server.make_url("/")) as resp:
+            assert await resp.text() == "ok"
+
+    stats = pool_stats(session)
+    await session.close()
+
+    assert stats["limit"] == 5
+    assert stats["limit_per_host"] == 2
+    host = stats["hosts"][server.host]
+    assert host["requests"] == 3
+    assert host["in_flight"] == 0
+    # one handshake, then keep-alive
+    assert host["connections_created"] == 1
+    assert host["connections_reused"] == 2
+    assert responses() - observed == 3
+
+
+async def test_no_session(aiohttp_server):
+    """Tests that clients created without a shared session can still make requests"""
+
+    app = web.Application()
+    app.router.add_get("/jobs/1/trace", ok)
+    server = await aiohttp_server(app)
+
+    gitlab = GitlabClient(str(server.make_url("")), "")
+    assert await gitlab.job_log(1) == "ok"
@@ -0,0 +1,66 @@
+import asyncio
+
+from gantry.util.metrics import Counter, Histogram, family, render
+
+
+def test_counter():
+    counter = Counter("jobs_total", "jobs", ["result"], registry=None)
+    counter.inc("done")
+    counter.inc("done", amount=2)
+    counter.inc('say "hi"\n')
+
+    assert render([counter]).splitlines() == [
+        "# HELP jobs_total jobs",
+        "# TYPE jobs_total counter",
+        'jobs_total{result="done"} 3',
+        'jobs_total{result="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_histogram():
+    """Buckets are cumulative and include their upper bound"""
+
+    histogram = Histogram("query_seconds", "queries", buckets=(0.1, 1), registry=None)
+    for value in (0.1, 0.5, 2):
+        histogram.observe(value)
+
+    assert render([histogram]).splitlines() == [
+        "# HELP query_seconds queries",
+        "# TYPE query_seconds histogram",
+        'query_seconds_bucket{le="0.1"} 1',
+        'query_seconds_bucket{le="1"} 2',
+        'query_seconds_bucket{le="+Inf"} 3',
+        "query_seconds_sum 2.6",
+        "query_seconds_count 3",
+    ]
+
+
+async def test_histogram_timed():
+    """Awaitables are observed whether they return or raise"""
+
+    histogram = Histogram("stage_seconds", "", ["stage"], registry=None)
+
+    async def fail():
+        raise ValueError
+
+    assert await histogram.timed(asyncio.sleep(0, result=1), "sleep") == 1
+    try:
+        await histogram.timed(fail(), "fail")
+    except ValueError:
+        pass
+
+    assert {
+        labels: sum(counts) for labels, (counts, _) in histogram.series.items()
+    } == {
+        ("sleep",): 1,
+        ("fail",): 1,
+    }
+
+
+def test_family():
+    assert family("in_flight", "gauge", "requests", {("gitlab",): 2.0}, ["host"]) == [
+        "# HELP in_flight requests",
+        "# TYPE in_flight gauge",
+        'in_flight{host="gitlab"} 2',
+    ]
+    assert family("entries", "gauge", "entries", 0)[-1] == "entries 0"
@@ -1,8 +1,18 @@
+import itertools
+import json
+import random
+import sqlite3
+
+import aiosqlite
 import pytest
 
+from gantry.__main__ import apply_migrations
+from gantry.clients.db import insert_job
 from gantry.routes import prediction
+from gantry.routes.artifact import PredictionArtifact, export_predictions
+from gantry.routes.bench import bench_predict, sample_tier
 from gantry.tests.defs import prediction as defs
-from gantry.util.spec import parse_alloc_spec
+from gantry.util.spec import canonical_variants, parse_alloc_spec, variants_hash
 
 
 @pytest.fixture
@@ -73,6 +83,384 @@ async def test_empty_sample(db_conn):
     )
 
 
+def synthetic_job(i: int, variants: dict, **fields) -> dict:
+    """A job in the samples' node with the given attributes"""
+    return {
+        "pod": f"pod-{i}",
+        "node": 6789,
+        # unique so both engines order the sample the same way
+        "start": i,
+        "end": i + 100,
+        "gitlab_id": i,
+        "job_status": "success",
+        "pkg_variants": canonical_variants(variants),
+        "arch": "linux-ubuntu20.04-x86_64_v3",
+        "stack": "e4s",
+        "build_jobs": 16,
+        "cpu_request": 1,
+        "cpu_mean": random.uniform(0.5, 16),
+        "cpu_median": 1,
+        "cpu_max": random.uniform(16, 32),
+        "cpu_min": 1,
+        "cpu_stddev": 1,
+        "mem_request": 1,
+        "mem_limit": 1,
+        "mem_mean": random.uniform(1e9, 16e9),
+        "mem_median": 1,
+        "mem_max": random.uniform(16e9, 32e9),
+        "mem_min": 1,
+        "mem_stddev": 1,
+        **fields,
+    }
+
+
+async def reference_sample(db, spec: dict) -> list:
+    """
+    How samples were selected before the tiers were combined into one statement,
+    with one query per tier and the expensive variants matched in pkg_variants.
+    Ties are broken by id, as in get_sample.
+    """
+
+    param_combos = (
+        (
+            "pkg_name",
+            "pkg_variants",
+            "pkg_version",
+            "compiler_name",
+            "compiler_version",
+        ),
+        ("pkg_name", "pkg_variants", "compiler_name", "compiler_version"),
+        ("pkg_name", "pkg_variants", "pkg_version", "compiler_name"),
+        ("pkg_name", "pkg_variants", "compiler_name"),
+        ("pkg_name", "pkg_variants", "pkg_version"),
+        ("pkg_name", "pkg_variants"),
+    )
+
+    async def select_sample(query: str, filters: dict, extra_params: list = []) -> list:
+        async with db.execute(query, list(filters.values()) + extra_params) as cursor:
+            sample = await cursor.fetchall()
+            if len(sample) >= prediction.IDEAL_SAMPLE - 1:
+                return sample
+        return []
+
+    for combo in param_combos:
+        filters = {param: spec[param] for param in combo}
+        query = f"""
+        SELECT cpu_mean, cpu_max, mem_mean, mem_max FROM jobs
+        WHERE ref='develop' AND {' AND '.join(f'{param}=?' for param in filters)}
+        ORDER BY end DESC, id DESC LIMIT {prediction.IDEAL_SAMPLE}
+        """
+        if sample := await select_sample(query, filters):
+            return sample
+
+        filters.pop("pkg_variants")
+        exp_variant_conditions = []
+        exp_variant_values = []
+        for var in prediction.EXPENSIVE_VARIANTS:
+            variant_value = spec["pkg_variants_dict"].get(var)
+            if isinstance(variant_value, bool):
+                exp_variant_conditions.append(
+                    f"json_extract(pkg_variants, '$.{var}')=?"
+                )
+                exp_variant_values.append(int(variant_value))
+            else:
+                exp_variant_conditions.append(
+                    f"json_extract(pkg_variants, '$.{var}') IS NULL"
+                )
+
+        query = f"""
+        SELECT cpu_mean, cpu_max, mem_mean, mem_max FROM jobs
+        WHERE ref='develop' AND {' AND '.join(f'{param}=?' for param in filters)}
+        AND {' AND '.join(exp_variant_conditions)}
+        ORDER BY end DESC, id DESC LIMIT {prediction.IDEAL_SAMPLE}
+        """
+        if sample := await select_sample(query, filters, exp_variant_values):
+            return sample
+
+    return []
+
+
+SYNTHETIC_VARIANTS = [
+    {"shared": True},
+    {"shared": False},
+    {"shared": True, "mpi": True},
+    {"shared": True, "mpi": False, "cuda": True},
+]
+
+
+async def insert_synthetic_jobs(db, count: int, first: int = 0) -> list:
+    """
+    Inserts jobs with random attributes that overlap enough to fill every tier
+
+    returns: (id, job) of the inserted jobs
+    """
+
+    random.seed(0)
+    attributes = {
+        "ref": ["develop", "develop", "develop", "pr"],
+        "pkg_name": ["zlib", "hdf5"],
+        "pkg_version": ["1.0", "2.0"],
+        "compiler_name": ["gcc", "oneapi"],
+        "compiler_version": ["11.4.0", "12.3.0"],
+    }
+    inserted = []
+    for i in range(first, first + count):
+        job = synthetic_job(
+            i,
+            random.choice(SYNTHETIC_VARIANTS),
+            **{field: random.choice(values) for field, values in attributes.items()},
+        )
+        inserted.append((await insert_job(db, job), job))
+
+    return inserted
+
+
+def parity_specs() -> list:
+    """Specs that match the synthetic jobs in every tier, or not at all"""
+
+    specs = [defs.NORMAL_BUILD, defs.EXPENSIVE_VARIANT_BUILD, defs.BAD_VARIANT_BUILD]
+    for name, version, compiler, compiler_version, variants in itertools.product(
+        ["zlib", "hdf5", "missing"],
+        ["1.0", "3.0"],
+        ["gcc", "clang"],
+        ["11.4.0", "13.0.0"],
+        SYNTHETIC_VARIANTS + [{"shared": True, "cuda": False}],
+    ):
+        specs.append(
+            {
+                "pkg_name": name,
+                "pkg_version": version,
+                "pkg_variants": canonical_variants(variants),
+                "pkg_variants_dict": variants,
+                "compiler_name": compiler,
+                "compiler_version": compiler_version,
+            }
+        )
+
+    return specs
+
+
+async def test_sample_parity(db_conn_inserted):
+    """
+    The single statement and the rollup select the same sample
+    as the original queries
+    """
+
+    await insert_synthetic_jobs(db_conn_inserted, 600)
+
+    sizes = set()
+    for spec in parity_specs():
+        sample = await prediction.get_sample(db_conn_inserted, spec)
+        assert sample == await reference_sample(db_conn_inserted, spec)
+        rollup = await prediction.get_sample_rollup(db_conn_inserted, spec)
+        assert sample == rollup
+        assert sample.tier == rollup.tier == await sample_tier(db_conn_inserted, spec)
+        sizes.add(len(sample))
+
+    # full samples, samples that are one short and no sample were all selected
+    assert sizes == {0, 4, 5}
+
+
+async def test_columnar_parity(db_conn_inserted):
+    """
+    The columnar snapshot selects the same samples as the database,
+    from loaded builds and from builds added after loading
+    """
+
+    columnar = pytest.importorskip("gantry.routes.columnar")
+    await insert_synthetic_jobs(db_conn_inserted, 300)
+    snapshot = columnar.ColumnarSnapshot()
+    assert await snapshot.load(db_conn_inserted) > 0
+
+    for spec in parity_specs():
+        sample = await prediction.get_sample(db_conn_inserted, spec)
+        assert snapshot.sample(spec) == sample
+        assert snapshot.sample(spec).tier == sample.tier
+
+    for job_id, job in await insert_synthetic_jobs(db_conn_inserted, 300, first=300):
+        if job["ref"] == "develop":
+            snapshot.add(job_id, job)
+    # older builds can be collected late
+    for job_id, job in await insert_synthetic_jobs(db_conn_inserted, 100, first=-100):
+        if job["ref"] == "develop":
+            snapshot.add(job_id, job)
+
+    for spec in parity_specs():
+        assert snapshot.sample(spec) == await prediction.get_sample(
+            db_conn_inserted, spec
+        )
+
+
+async def test_prediction_artifact(db_conn_inserted, tmp_path):
+    """The exported artifact gives the same answers as predict"""
+
+    await insert_synthetic_jobs(db_conn_inserted, 600)
+    path = str(tmp_path / "predictions.db")
+    assert await export_predictions(db_conn_inserted, path) > 0
+
+    artifact = PredictionArtifact(path)
+    try:
+        for spec in parity_specs():
+            assert artifact.predict(spec) == await prediction.predict(
+                db_conn_inserted, spec
+            )
+        assert artifact.allocation(defs.NORMAL_SPEC) == defs.NORMAL_PREDICTION
+        assert artifact.allocation("invalid") is None
+    finally:
+        artifact.close()
+
+    # exports replace the previous artifact
+    await export_predictions(db_conn_inserted, path)
+    with sqlite3.connect(path) as db:
+        db.execute("UPDATE metadata SET value=0 WHERE name='version'")
+    db.close()
+    with pytest.raises(ValueError, match="unsupported artifact version"):
+        PredictionArtifact(path)
+
+
+async def test_bench_predict(tmp_path):
+    """The replay predicts every job and leaves the database untouched"""
+
+    path = tmp_path / "gantry.db"
+    async with aiosqlite.connect(path) as db:
+        await apply_migrations(db)
+        with open("gantry/tests/sql/insert_samples.sql") as f:
+            await db.executescript(f.read())
+        await insert_synthetic_jobs(db, 300)
+        await db.commit()
+
+    report = await bench_predict(path, jobs=100, concurrency=4)
+
+    assert report["jobs"] == 100
+    assert sum(report["tiers"].values()) == pytest.approx(1)
+    assert report["cpu"]["ratio"].keys() == report["latency"].keys()
+    async with aiosqlite.connect(path) as db:
+        async with db.execute("SELECT COUNT(*) FROM jobs") as cursor:
+            assert await cursor.fetchone() == (305,)
+
+
+async def test_rollup_backfill(db_conn_inserted):
+    """
+    Tests that the migration builds the same rollup for existing builds
+    as the trigger does while inserting them
+    """
+
+    await insert_synthetic_jobs(db_conn_inserted, 200)
+    async with db_conn_inserted.execute(
+        "SELECT * FROM sample_rollup ORDER BY tier, key"
+    ) as cursor:
+        inserted = await cursor.fetchall()
+    assert len(inserted) > 0
+
+    await db_conn_inserted.execute("DELETE FROM sample_rollup")
+    with open("migrations/006_sample_rollup.sql") as f:
+        backfill = f.read().split("-- existing builds")[1]
+    await db_conn_inserted.executescript(backfill)
+
+    async with db_conn_inserted.execute(
+        "SELECT * FROM sample_rollup ORDER BY tier, key"
+    ) as cursor:
+        backfilled = await cursor.fetchall()
+
+    # the order of ids within a sample doesn't matter
+    def normalize(rows):
+        return [(tier, key, sorted(json.loads(ids))) for tier, key, ids in rows]
+
+    assert normalize(backfilled) == normalize(inserted)
+
+
+EXPENSIVE_VARIANT_CHOICES = [
+    {},
+    {"cuda": True},
+    {"cuda": False, "mpi": True},
+    {"hdf5": "none", "mpi": True},
+    {"openmp": None, "rocm": True, "sycl": False},
+    {"fortran": ["a", "b"], "python": True},
+    {"cuda": True, "fortran": True, "hdf5": True, "mpi": True, "openmp": True},
+]
+
+
+async def test_expensive_variants_column(db_conn_inserted):
+    """
+    Filtering on the exp_variants column selects the same builds as matching
+    each expensive variant in pkg_variants
+    """
+
+    for i, variants in enumerate(EXPENSIVE_VARIANT_CHOICES):
+        await insert_job(
+            db_conn_inserted,
+            synthetic_job(
+                i,
+                variants,
+                ref="develop",
+                pkg_name="zlib",
+                pkg_version="1.0",
+                compiler_name="gcc",
+                compiler_version="11.4.0",
+            ),
+        )
+
+    for variants in EXPENSIVE_VARIANT_CHOICES:
+        conditions = []
+        values = []
+        for var in prediction.EXPENSIVE_VARIANTS:
+            if isinstance(variants.get(var), bool):
+                conditions.append(f"json_extract(pkg_variants, '$.{var}')=?")
+                values.append(int(variants[var]))
+            else:
+                conditions.append(f"json_extract(pkg_variants, '$.{var}') IS NULL")
+
+        async with db_conn_inserted.execute(
+            f"SELECT id FROM jobs WHERE {' AND '.join(conditions)}", values
+        ) as cursor:
+            expected = await cursor.fetchall()
+        async with db_conn_inserted.execute(
+            "SELECT id FROM jobs WHERE exp_variants=?",
+            (prediction.expensive_variants_code(variants),),
+        ) as cursor:
+            assert await cursor.fetchall() == expected
+
+
+async def test_columnar_variants_code(db_conn_inserted):
+    """Builds added to the columnar snapshot are packed as in the exp_variants column"""
+
+    columnar = pytest.importorskip("gantry.routes.columnar")
+    for i, variants in enumerate(EXPENSIVE_VARIANT_CHOICES):
+        await insert_job(db_conn_inserted, synthetic_job(i, variants))
+
+    async with db_conn_inserted.execute(
+        "SELECT pkg_variants, exp_variants FROM jobs"
+    ) as cursor:
+        for variants, code in await cursor.fetchall():
+            assert columnar.stored_variants_code(json.loads(variants)) == code
+
+
+async def test_tier_indexes(db_conn):
+    """
+    The sample of each tier is read in order from the index of its tier,
+    without reading the jobs table when variants are matched exactly
+    """
+
+    for tier, (conditions, values) in enumerate(
+        prediction.sample_tiers(defs.EXPENSIVE_VARIANT_BUILD)
+    ):
+        async with db_conn.execute(
+            f"""
+            EXPLAIN QUERY PLAN SELECT id FROM jobs WHERE ref='develop' AND {conditions}
+            ORDER BY end DESC, id DESC LIMIT {prediction.IDEAL_SAMPLE}
+            """,
+            values,
+        ) as cursor:
+            plan = [row[3] for row in await cursor.fetchall()]
+
+        # sqlite reads the virtual exp_variants column from the table
+        covering = "" if "exp_variants" in conditions else "COVERING "
+        assert len(plan) == 1
+        assert plan[0].startswith(
+            f"SEARCH jobs USING {covering}INDEX develop_tier_{tier} "
+        )
+
+
 # Test validate_payload
 def test_valid_spec():
     """Tests that a valid spec is parsed correctly."""
@@ -89,6 +477,24 @@ def test_valid_spec():
     }
 
 
+def test_canonical_variants():
+    """Specs with the same variants in a different order are stored the same way"""
+
+    spec = parse_alloc_spec(
+        "emacs@29.2 ~native+json patches=b,a arch=x86_64%gcc@12.3.0"
+    )
+    reordered = parse_alloc_spec(
+        "emacs@29.2 patches=a,b +json~native arch=x86_64%gcc@12.3.0"
+    )
+    assert spec["pkg_variants"] == reordered["pkg_variants"]
+    assert spec["pkg_variants"] == (
+        '{"json": true, "native": false, "patches": ["a", "b"]}'
+    )
+    assert variants_hash(spec["pkg_variants_dict"]) == variants_hash(
+        reordered["pkg_variants_dict"]
+    )
+
+
 def test_invalid_specs():
     """Test a series of invalid specs"""
 
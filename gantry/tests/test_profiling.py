@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from gantry.util.profiling import Profiler, ProfileStore, folded, profile_requests
+from gantry.views import routes
+
+TOKEN = "secret"
+
+
+async def wait(request: web.Request) -> web.Response:
+    await asyncio.sleep(0.05)
+    return web.Response(text="ok")
+
+
+async def block(request: web.Request) -> web.Response:
+    # holds the loop, as a slow computation would
+    time.sleep(0.05)
+    return web.Response(text="ok")
+
+
+async def spawn(request: web.Request) -> web.Response:
+    async def child():
+        await asyncio.sleep(0.05)
+
+    await asyncio.create_task(child())
+    return web.Response(text="ok")
+
+
+@pytest.fixture
+async def client(aiohttp_client):
+    """Returns a client of an application that profiles requests sent with a header"""
+
+    store = ProfileStore(size=2)
+    app = web.Application(
+        middlewares=[
+            profile_requests(
+                store,
+                Profiler(interval=0.002),
+                sample_rate=0,
+                header="X-Gantry-Profile",
+                token=TOKEN,
+            )
+        ]
+    )
+    app.add_routes(routes)
+    app.router.add_get("/wait", wait)
+    app.router.add_get("/block", block)
+    app.router.add_get("/spawn", spawn)
+    app["profiles"] = store
+    app["profile_token"] = TOKEN
+
+    return await aiohttp_client(app)
+
+
+async def profile(client, path: str) -> dict:
+    resp = await client.get(path, headers={"X-Gantry-Profile": TOKEN})
+    assert resp.status == 200
+    return client.app["profiles"].profiles()[0]
+
+
+async def test_awaiting_profile(client):
+    """Time spent waiting is attributed to the awaiting coroutines"""
+
+    stacks = (await profile(client, "/wait"))["stacks"]
+    stack, _ = stacks.most_common(1)[0]
+    assert stack[0].startswith("wait (") and "test_profiling.py:" in stack[0]
+    assert stack[1].startswith("sleep (")
+    assert stack[-1] == "<awaiting Future>"
+
+
+async def test_running_profile(client):
+    """Time spent running is attributed to the functions called by the task"""
+
+    stacks = (await profile(client, "/block"))["stacks"]
+    stack, _ = stacks.most_common(1)[0]
+    assert len(stack) == 1
+    assert stack[0].startswith("block (") and "test_profiling.py:" in stack[0]
+    assert folded({"stacks": {stack: 3}}) == f"{stack[0]} 3\n"
+
+
+async def test_child_tasks(client):
+    """Tasks created by the request are sampled into its profile"""
+
+    stacks = (await profile(client, "/spawn"))["stacks"]
+    roots = {stack[0].split(" ")[0] for stack in stacks}
+    assert roots == {"spawn", "spawn.<locals>.child"}
+    assert any(stack[-1] == "<awaiting task spawn.<locals>.child>" for stack in stacks)
+
+
+async def test_unsampled(client):
+    """Requests are only profiled with the header, when none are sampled"""
+
+    for headers in ({}, {"X-Gantry-Profile": "guess"}):
+        resp = await client.get("/wait", headers=headers)
+        assert resp.status == 200
+    assert client.app["profiles"].profiles() == []
+
+
+def test_slowest_kept():
+    store = ProfileStore(size=2)
+    for duration in (0.3, 0.1, 0.5, 0.2):
+        store.add({"duration": duration})
+
+    assert [p["duration"] for p in store.profiles()] == [0.5, 0.3]
+    assert store.get(3)["duration"] == 0.5
+    # replaced by slower profiles
+    assert store.get(2) is None
+
+
+async def test_admin_endpoints(client):
+    await profile(client, "/wait")
+
+    resp = await client.get("/admin/profiles")
+    assert resp.status == 401
+    resp = await client.get(
+        "/admin/profiles", headers={"Authorization": "Bearer guess"}
+    )
+    assert resp.status == 401
+
+    auth = {"Authorization": f"Bearer {TOKEN}"}
+    resp = await client.get("/admin/profiles", headers=auth)
+    assert resp.status == 200
+    [listed] = await resp.json()
+    assert listed["path"] == "/wait"
+    assert listed["samples"] > 0
+
+    resp = await client.get(f"/admin/profiles/{listed['id']}", headers=auth)
+    assert resp.status == 200
+    assert "<awaiting Future>" in await resp.text()
+
+    resp = await client.get("/admin/profiles/1000", headers=auth)
+    assert resp.status == 404
+
+
+async def test_admin_disabled(aiohttp_client):
+    """Without a token, the admin endpoints don't exist"""
+
+    app = web.Application()
+    app.add_routes(routes)
+    client = await aiohttp_client(app)
+
+    resp = await client.get("/admin/profiles", headers={"Authorization": "Bearer "})
+    assert resp.status == 404
@@ -17,3 +17,22 @@ def test_process_query():
     assert util.process_query(defs.QUERY_STR) == defs.ENCODED_QUERY_STR
     with pytest.raises(ValueError):
         util.process_query(defs.INVALID_QUERY)
+
+
+def test_query_multiple_values():
+    """Test that list filters are turned into an anchored regex match"""
+    assert (
+        util.query_to_str("metric", {"pod": ["a-1", "b.2"], "container": "build"})
+        == 'metric{pod=~"a\\\\-1|b\\\\.2", container="build"}'
+    )
+
+
+def test_slice_range():
+    """Test that only samples within the window are kept"""
+    res = [
+        {"labels": {"pod": "a"}, "values": [[1, "1"], [2, "2"], [3, "3"]]},
+        {"labels": {"pod": "b"}, "values": [[5, "1"]]},
+    ]
+    assert util.slice_range(res, 2, 3) == [
+        {"labels": {"pod": "a"}, "values": [[2, "2"], [3, "3"]]}
+    ]
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from gantry.util.tasks import SingleFlight, gather
+
+
+async def test_gather_results():
+    """Tests that results are returned in argument order"""
+
+    async def value(v, delay):
+        await asyncio.sleep(delay)
+        return v
+
+    assert await gather(value(1, 0.02), value(2, 0)) == [1, 2]
+
+
+async def test_gather_cancels_on_error():
+    """Tests that the first exception is raised and the other awaitables cancelled"""
+    cancelled = asyncio.Event()
+
+    async def fail():
+        raise ValueError("missing")
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(ValueError, match="missing"):
+        await gather(slow(), fail())
+    assert cancelled.is_set()
+
+
+async def test_single_flight_shared():
+    """Tests that concurrent calls for a key share one execution"""
+    flights = SingleFlight()
+    calls = 0
+
+    async def lookup(v):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return v
+
+    results = await asyncio.gather(
+        flights.run("a", lookup, 1),
+        flights.run("a", lookup, 2),
+        flights.run("b", lookup, 3),
+    )
+    assert results == [1, 1, 3]
+    assert calls == 2
+    assert (flights.executions, flights.shared) == (2, 1)
+    assert not flights.flights
+
+    # finished calls are not remembered
+    assert await flights.run("a", lookup, 4) == 4
+
+
+async def test_single_flight_errors():
+    """Tests that every waiter receives the exception of the shared call"""
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("missing")
+
+    results = await asyncio.gather(
+        flights.run("a", fail), flights.run("a", fail), return_exceptions=True
+    )
+    assert [type(r) for r in results] == [ValueError, ValueError]
+    assert results[0] is results[1]
+
+
+async def test_single_flight_cancel():
+    """Tests that the call only stops once every waiter is cancelled"""
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def wait():
+        await release.wait()
+        return "done"
+
+    first = asyncio.create_task(flights.run("a", wait))
+    second = asyncio.create_task(flights.run("a", wait))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    assert await second == "done"
+
+    release.clear()
+    third = asyncio.create_task(flights.run("a", wait))
+    await asyncio.sleep(0)
+    task = flights.flights["a"][0]
+    third.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await third
+    await asyncio.sleep(0)
+    assert task.cancelled()
@@ -0,0 +1,132 @@
+import asyncio
+
+import aiosqlite
+import pytest
+from aiohttp import web
+
+from gantry.__main__ import apply_migrations
+from gantry.clients.db import ReadPool, configure
+from gantry.routes.prediction import Sample
+from gantry.tests.defs import prediction as defs
+from gantry.util.cache import AllocationCache
+from gantry.views import allocations_by_tier, cached_predict, prediction_flights, routes
+
+
+@pytest.fixture
+async def client(aiohttp_client, tmp_path):
+    """Returns a client of the API, backed by a database with 5 samples inserted"""
+
+    path = tmp_path / "gantry.db"
+    db = await aiosqlite.connect(path)
+    await configure(db, wal=True)
+    await apply_migrations(db)
+    with open("gantry/tests/sql/insert_samples.sql") as f:
+        await db.executescript(f.read())
+
+    reader = ReadPool(path, size=1)
+    await reader.open()
+
+    app = web.Application()
+    app.add_routes(routes)
+    app["db_read"] = reader
+    app["prediction_sampler"] = "rollup"
+    app["prediction_snapshot"] = None
+    app["allocation_cache"] = AllocationCache(size=10)
+
+    try:
+        yield await aiohttp_client(app)
+    finally:
+        await reader.close()
+        await db.close()
+
+
+async def test_allocation(client):
+    """Tests that repeated allocations are answered from the cache"""
+
+    for _ in range(2):
+        resp = await client.get("/v1/allocation", params={"spec": defs.NORMAL_SPEC})
+        assert resp.status == 200
+        assert await resp.json() == defs.NORMAL_PREDICTION
+
+    cache = client.app["allocation_cache"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+async def test_allocations(client):
+    """Tests that a batch reports invalid specs without failing the others"""
+
+    resp = await client.post(
+        "/v1/allocations",
+        json=[defs.NORMAL_SPEC, "invalid", defs.BAD_VARIANT_SPEC, 1, defs.NORMAL_SPEC],
+    )
+    assert resp.status == 200
+    assert await resp.json() == {
+        "allocations": [
+            defs.NORMAL_PREDICTION,
+            {"error": "invalid spec"},
+            defs.DEFAULT_PREDICTION,
+            {"error": "invalid spec"},
+            defs.NORMAL_PREDICTION,
+        ]
+    }
+    # identical specs are predicted once
+    cache = client.app["allocation_cache"]
+    assert len(cache.entries) == 2
+
+
+@pytest.mark.parametrize("body", ["{", '{"spec": "py-torch"}'])
+async def test_allocations_invalid(client, body):
+    """Tests that a batch that isn't a JSON list is rejected"""
+
+    resp = await client.post("/v1/allocations", data=body)
+    assert resp.status == 400
+
+
+async def test_coalesced_predictions(client, mocker):
+    """Tests that identical specs requested concurrently share one prediction"""
+
+    release = asyncio.Event()
+
+    async def sample(db, spec):
+        await release.wait()
+        return Sample()
+
+    sampler = mocker.AsyncMock(side_effect=sample)
+    mocker.patch.dict("gantry.views.SAMPLERS", {"rollup": sampler})
+    shared = prediction_flights.shared
+    app = client.app
+
+    requests = [
+        asyncio.create_task(cached_predict(app, [defs.NORMAL_BUILD])) for _ in range(3)
+    ]
+    await asyncio.sleep(0.01)
+    # builds inserted during the prediction aren't in its sample
+    app["allocation_cache"].invalidate(defs.NORMAL_BUILD["pkg_name"])
+    requests.append(asyncio.create_task(cached_predict(app, [defs.NORMAL_BUILD])))
+    await asyncio.sleep(0.01)
+    release.set()
+
+    assert await asyncio.gather(*requests) == [[defs.DEFAULT_PREDICTION]] * 4
+    assert sampler.await_count == 2
+    assert prediction_flights.shared - shared == 2
+
+
+async def test_metrics(client):
+    """Tests that allocations are counted by tier, including cached ones"""
+
+    def allocated(tier: str) -> int:
+        return allocations_by_tier.values.get((tier,), 0)
+
+    exact, default = allocated("0"), allocated("default")
+    for spec in (defs.NORMAL_SPEC, defs.NORMAL_SPEC, defs.BAD_VARIANT_SPEC):
+        resp = await client.get("/v1/allocation", params={"spec": spec})
+        assert resp.status == 200
+    assert (allocated("0") - exact, allocated("default") - default) == (2, 1)
+
+    resp = await client.get("/metrics")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+    lines = (await resp.text()).splitlines()
+    assert f'gantry_allocations_total{{tier="0"}} {allocated("0")}' in lines
+    assert 'gantry_allocation_cache_lookups_total{result="hit"} 1' in lines
+    assert "# TYPE gantry_db_query_seconds histogram" in lines
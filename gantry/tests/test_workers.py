@@ -0,0 +1,108 @@
+import asyncio
+
+from gantry.util.workers import WorkerPool
+
+
+async def test_items_processed():
+    """Tests that every submitted item reaches the handler"""
+    seen = []
+
+    async def handler(item):
+        seen.append(item)
+
+    pool = WorkerPool(handler, workers=2, max_depth=10)
+    pool.start()
+    for i in range(5):
+        assert await pool.submit(i)
+    await pool.queue.join()
+    await pool.stop()
+
+    assert sorted(seen) == [0, 1, 2, 3, 4]
+    stats = pool.stats()
+    assert stats["processed"] == 5
+    assert stats["depth"] == 0
+    assert stats["busy_workers"] == 0
+
+
+async def test_concurrency_bounded():
+    """Tests that no more than the configured number of workers run at once"""
+    running = 0
+    peak = 0
+
+    async def handler(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    pool = WorkerPool(handler, workers=3, max_depth=100)
+    pool.start()
+    for i in range(20):
+        await pool.submit(i)
+    await pool.queue.join()
+    await pool.stop()
+
+    assert peak == 3
+    assert pool.stats()["busy_seconds"] > 0
+
+
+async def test_queue_full_sheds():
+    """Tests that items are rejected when the queue stays full"""
+    release = asyncio.Event()
+
+    async def handler(item):
+        await release.wait()
+
+    pool = WorkerPool(handler, workers=1, max_depth=1, put_timeout=0.01)
+    pool.start()
+    # first item is picked up by the worker, second waits in the queue
+    assert await pool.submit(1)
+    await asyncio.sleep(0)
+    assert await pool.submit(2)
+    assert not await pool.submit(3)
+
+    release.set()
+    await pool.queue.join()
+    await pool.stop()
+
+    stats = pool.stats()
+    assert stats["rejected"] == 1
+    assert stats["processed"] == 2
+
+
+async def test_handler_failure():
+    """Tests that a failing item does not stop the worker"""
+
+    async def handler(item):
+        if item == "bad":
+            raise ValueError(item)
+
+    pool = WorkerPool(handler, workers=1, max_depth=10)
+    pool.start()
+    await pool.submit("bad")
+    await pool.submit("good")
+    await pool.queue.join()
+    await pool.stop()
+
+    assert pool.stats()["failed"] == 1
+    assert pool.stats()["processed"] == 1
+
+
+async def test_batches():
+    """Tests that queued items are handed to the handler in batches"""
+    batches = []
+
+    async def handler(items):
+        batches.append(items)
+
+    pool = WorkerPool(handler, workers=1, max_depth=10, batch_size=3)
+    # queue everything before the worker starts so it can batch
+    for i in range(7):
+        await pool.submit(i)
+    pool.start()
+    await pool.queue.join()
+    await pool.stop()
+
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert pool.stats()["processed"] == 7
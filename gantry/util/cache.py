@@ -0,0 +1,160 @@
+from collections import OrderedDict
+
+import aiosqlite
+
+from gantry.clients import db
+
+
+class NodeCache:
+    """
+    Bounded LRU cache of hostname -> (node uuid, node id).
+
+    Karpenter reuses hostnames, which are derived from private IPs, so an entry
+    is only trusted for jobs within ttl seconds of the last job seen on the node.
+    Jobs are not always collected in order, so freshness is measured on the job
+    timeline (query times) rather than the wall clock. Expired entries are kept
+    so the caller can re-validate them with a single uuid lookup.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        """
+        args:
+            size: maximum number of hostnames kept
+            ttl: seconds around the last sighting of a node in which its
+                hostname is assumed to still belong to it
+        """
+        self.size = size
+        self.ttl = ttl
+        # hostname -> (uuid, node id, last seen)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, hostname: str, time: float) -> tuple[str, int] | None:
+        """returns (uuid, node id) if the entry is fresh at time, otherwise None"""
+
+        entry = self.entries.get(hostname)
+        if entry is None or abs(time - entry[2]) > self.ttl:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(hostname)
+        return entry[0], entry[1]
+
+    def peek(self, hostname: str) -> tuple[str, int] | None:
+        """returns (uuid, node id) regardless of freshness, for re-validation"""
+
+        if entry := self.entries.get(hostname):
+            return entry[0], entry[1]
+        return None
+
+    def put(self, hostname: str, uuid: str, node_id: int, time: float) -> None:
+        """records that the node was seen under hostname at time"""
+
+        if (entry := self.entries.get(hostname)) and entry[0] == uuid:
+            time = max(time, entry[2])
+
+        self.entries[hostname] = (uuid, node_id, time)
+        self.entries.move_to_end(hostname)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def warm(self, db_conn: aiosqlite.Connection) -> int:
+        """
+        Fills the cache with the most recently used nodes.
+
+        returns: number of cached hostnames
+        """
+
+        # oldest first, so a reused hostname ends up pointing to its latest node
+        for hostname, uuid, node_id, last_seen in reversed(
+            await db.recent_nodes(db_conn, self.size)
+        ):
+            self.put(hostname, uuid, node_id, last_seen)
+
+        return len(self.entries)
+
+
+class AllocationCache:
+    """
+    Bounded LRU cache of predictions by spec key (see prediction.spec_key),
+    which starts with the package name.
+
+    A prediction can only change when a develop build of its package is inserted,
+    so entries don't expire, they are dropped by package name on insert instead.
+    """
+
+    def __init__(self, size: int):
+        """
+        args:
+            size: maximum number of specs kept, 0 disables the cache
+        """
+        self.size = size
+        # spec key -> prediction
+        self.entries = OrderedDict()
+        # pkg_name -> keys of the cached specs of the package
+        self.packages = {}
+        # pkg_name -> number of invalidations, see version.
+        # one int per package that was ever built, so this is not bounded by size
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> dict | None:
+        """returns the cached prediction of a spec, otherwise None"""
+
+        prediction = self.entries.get(key)
+        if prediction is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return prediction
+
+    def version(self, pkg_name: str) -> int:
+        """
+        Identifies the builds of a package that predictions are currently based on.
+        Read it before predicting and pass it to put.
+        """
+
+        return self.versions.get(pkg_name, 0)
+
+    def put(self, key: tuple, prediction: dict, version: int) -> None:
+        """
+        Caches the prediction of a spec, unless a build of the package was
+        inserted since version was read, as the prediction may not include it.
+        """
+
+        pkg_name = key[0]
+        if self.size <= 0 or self.version(pkg_name) != version:
+            return
+
+        self.entries[key] = prediction
+        self.entries.move_to_end(key)
+        self.packages.setdefault(pkg_name, set()).add(key)
+        while len(self.entries) > self.size:
+            evicted, _ = self.entries.popitem(last=False)
+            self._forget(evicted)
+            self.evictions += 1
+
+    def invalidate(self, pkg_name: str) -> int:
+        """
+        Drops the predictions of a package after one of its builds was inserted.
+
+        returns: number of dropped predictions
+        """
+
+        self.versions[pkg_name] = self.version(pkg_name) + 1
+        keys = self.packages.pop(pkg_name, set())
+        for key in keys:
+            del self.entries[key]
+        return len(keys)
+
+    def _forget(self, key: tuple) -> None:
+        keys = self.packages[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.packages[key[0]]
@@ -0,0 +1,206 @@
+import bisect
+import time
+from typing import Awaitable
+
+# upper bounds in seconds, from a cached read to a slow upstream request
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+# metrics of the application, served at /metrics in the order they were created
+REGISTRY = []
+
+
+class Counter:
+    """
+    A count for each combination of label values.
+
+    Metrics are updated on hot paths, so an update is a dict lookup and an
+    addition. Nothing is locked, since everything runs on the event loop.
+    """
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (), registry: list | None = REGISTRY
+    ):
+        """
+        args:
+            labels: names of the labels, whose values are passed to inc
+            registry: the metric is rendered with the others of this list
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # label values -> count
+        self.values = {}
+        if registry is not None:
+            registry.append(self)
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        return family(self.name, "counter", self.help, self.values, self.labels)
+
+
+class Histogram:
+    """
+    Counts observations (usually durations) in buckets, for each combination
+    of label values. Only the bucket an observation falls into is incremented,
+    the cumulative counts of the text format are summed when rendering.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+        registry: list | None = REGISTRY,
+    ):
+        """
+        args:
+            buckets: sorted upper bounds, an unbounded bucket is added after them
+            see Counter for the others
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count of each bucket, sum of the observations]
+        self.series = {}
+        if registry is not None:
+            registry.append(self)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0]
+        # buckets are inclusive upper bounds
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *label_values: str) -> "Timer":
+        """Observes the seconds spent in a with block, also when it raises"""
+
+        return Timer(self, label_values)
+
+    async def timed(self, aw: Awaitable, *label_values: str):
+        """Awaits aw and observes how long it took, see time"""
+
+        with self.time(*label_values):
+            return await aw
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {escape_help(self.help)}",
+            f"# TYPE {self.name} histogram",
+        ]
+        bounds = [*map(format_value, self.buckets), "+Inf"]
+        for label_values, (counts, total) in self.series.items():
+            labels = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{format_labels(labels + [('le', bound)])} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_sum{format_labels(labels)} {format_value(total)}"
+            )
+            lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Timer:
+    # a class rather than contextlib.contextmanager, which costs a few
+    # microseconds per block on the hot paths
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+def family(
+    name: str, kind: str, help: str, samples: dict | float, labels: tuple = ()
+) -> list[str]:
+    """
+    Renders a metric of the text format from values read elsewhere,
+    e.g. counters kept by a component of the application.
+
+    args:
+        kind: counter or gauge
+        samples: {label values: value}, or the value of a metric without labels
+    returns:
+        lines of the text format
+    """
+
+    if not isinstance(samples, dict):
+        samples = {(): samples}
+
+    return [
+        f"# HELP {name} {escape_help(help)}",
+        f"# TYPE {name} {kind}",
+        *(
+            f"{name}{format_labels(zip(labels, label_values))} {format_value(value)}"
+            for label_values, value in samples.items()
+        ),
+    ]
+
+
+def render(metrics: list) -> str:
+    """
+    Renders metrics in the Prometheus text format (version 0.0.4)
+
+    args:
+        metrics: Counter, Histogram, or lines returned by family
+    """
+
+    lines = []
+    for metric in metrics:
+        lines += metric if isinstance(metric, list) else metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels) -> str:
+    """labels: (name, value) pairs"""
+
+    labels = ",".join(f'{name}="{escape_label(value)}"' for name, value in labels)
+    return f"{{{labels}}}" if labels else ""
+
+
+def format_value(value: float) -> str:
+    # integers without a trailing .0, which is how bounds are usually written
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
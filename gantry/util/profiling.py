@@ -0,0 +1,272 @@
+import asyncio
+import contextvars
+import heapq
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Awaitable, Callable
+
+from aiohttp import web
+
+# the stack counts of the profiled request a task runs for, inherited by the tasks
+# it creates (see Profiler.follow_tasks)
+profiled = contextvars.ContextVar("profiled", default=None)
+
+
+class Profiler:
+    """
+    Samples the stacks of tasks from a background thread, in wall-clock time.
+
+    A task waiting for the database or an upstream doesn't run, so a CPU profiler
+    (or cProfile, which also records every other task running on the loop) can't
+    tell where its time went. At every tick, the stack of each profiled task is
+    rebuilt from its chain of awaiting coroutines, and extended with the frames
+    of the loop's thread when the task is the one running. Waits are recorded as
+    a frame naming what the task is suspended on.
+
+    Work is often handed to other tasks (SingleFlight, gather), so the tasks
+    created by a profiled task are sampled into the same profile, as stacks of
+    their own: while they run, the profiled task is usually waiting for them.
+
+    The thread only runs while a task is being profiled.
+    """
+
+    def __init__(self, interval: float):
+        """
+        args:
+            interval: seconds between samples
+        """
+        self.interval = interval
+        # task -> (thread of its loop, frame the stacks start below, stack counts)
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        # loops whose new tasks are checked for a profiled parent
+        self.loops = set()
+
+    def start(self, task: asyncio.Task, root, stacks: Counter) -> None:
+        """
+        Starts sampling a task, from the thread running its loop.
+
+        args:
+            root: frame of the task whose callers are left out of the stacks,
+                None to keep the whole stack
+            stacks: the number of samples of each stack (tuples of frames,
+                outermost first), filled until stop is called
+        """
+
+        with self.lock:
+            self.active[task] = (threading.get_ident(), root, stacks)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._sample_forever, name="profiler", daemon=True
+                )
+                self.thread.start()
+
+    def stop(self, stacks: Counter) -> None:
+        """Stops sampling the tasks of a profile, including those still running"""
+
+        with self.lock:
+            for task in [t for t, (_, _, s) in self.active.items() if s is stacks]:
+                del self.active[task]
+
+    def follow_tasks(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Samples the tasks created while profiled is set into its profile.
+        This wraps the task factory of the loop, so it is only done once a first
+        request is profiled.
+        """
+
+        if loop in self.loops:
+            return
+        self.loops.add(loop)
+        previous = loop.get_task_factory()
+
+        def factory(loop, coro, **kwargs):
+            if previous is None:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+            else:
+                task = previous(loop, coro, **kwargs)
+            if (stacks := profiled.get()) is not None:
+                self.start(task, None, stacks)
+            return task
+
+        loop.set_task_factory(factory)
+
+    def _sample_forever(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    # started again by the next profile
+                    self.thread = None
+                    return
+                threads = sys._current_frames()
+                for task, (thread, root, stacks) in self.active.items():
+                    if stack := task_stack(task, threads.get(thread), root):
+                        stacks[stack] += 1
+
+
+def task_stack(task: asyncio.Task, thread_frame, root) -> tuple[str, ...]:
+    """
+    returns: the frames of a task below root (see Profiler.start), outermost
+        first, empty if root isn't in the task's stack or the task is done
+    """
+
+    frames = []
+    awaited = task.get_coro()
+    while (frame := getattr(awaited, "cr_frame", None)) is not None:
+        frames.append(frame)
+        awaited = awaited.cr_await
+    if not frames:
+        return ()
+
+    # the task is running, its stack continues into the functions it called
+    running = []
+    while thread_frame is not None:
+        running.append(thread_frame)
+        thread_frame = thread_frame.f_back
+    running.reverse()
+    if frames[0] in running:
+        frames = running[running.index(frames[0]) :]
+        waiting = []
+    else:
+        # the future the task is suspended on. the innermost coroutine only
+        # holds an iterator over it
+        waiter = getattr(task, "_fut_waiter", None)
+        if waiter is None:
+            # scheduled, waiting for its turn on the loop
+            waiting = ["<ready>"]
+        elif isinstance(waiter, asyncio.Task):
+            waiting = [f"<awaiting task {waiter.get_coro().__qualname__}>"]
+        else:
+            waiting = [f"<awaiting {type(waiter).__name__}>"]
+
+    if root is not None:
+        if root not in frames:
+            return ()
+        frames = frames[frames.index(root) + 1 :]
+    return (*map(format_frame, frames), *waiting)
+
+
+def format_frame(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({short_path(code.co_filename)}:{frame.f_lineno})"
+
+
+def short_path(path: str) -> str:
+    """path of a module relative to the entry of sys.path it was imported from"""
+
+    for entry in sorted(sys.path, key=len, reverse=True):
+        if entry and path.startswith(entry + os.sep):
+            return path[len(entry) + 1 :]
+    return path
+
+
+class ProfileStore:
+    """Keeps the profiles of the slowest requests, up to size of them"""
+
+    def __init__(self, size: int):
+        self.size = size
+        # min-heap of (duration, id, profile), so the fastest is replaced first
+        self.heap = []
+        self.ids = itertools.count(1)
+
+    def add(self, profile: dict) -> None:
+        """
+        args:
+            profile: see profile_requests, without an id
+        """
+
+        profile["id"] = next(self.ids)
+        entry = (profile["duration"], profile["id"], profile)
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def profiles(self) -> list[dict]:
+        """returns: the kept profiles, slowest first"""
+
+        return [profile for _, _, profile in sorted(self.heap, reverse=True)]
+
+    def get(self, profile_id: int) -> dict | None:
+        return next((p for _, i, p in self.heap if i == profile_id), None)
+
+
+def profile_requests(
+    store: ProfileStore,
+    profiler: Profiler,
+    sample_rate: float,
+    header: str,
+    token: str,
+) -> Callable:
+    """
+    Middleware that profiles a sample_rate fraction of the requests, and the
+    requests whose header is set to token.
+
+    The profile of a request is a dict with id, method, path (with the query),
+    status (None when the handler raised), started (unix time), duration
+    (seconds), interval (seconds between samples) and stacks (see Profiler.start).
+    """
+
+    def requested(request: web.Request) -> bool:
+        value = request.headers.get(header)
+        # constant time, so the token can't be guessed one character at a time
+        return value is not None and hmac.compare_digest(value.encode(), token.encode())
+
+    @web.middleware
+    async def middleware(
+        request: web.Request, handler: Callable[..., Awaitable[web.StreamResponse]]
+    ) -> web.StreamResponse:
+        if not (random.random() < sample_rate or requested(request)):
+            return await handler(request)
+
+        profiler.follow_tasks(asyncio.get_running_loop())
+        stacks = Counter()
+        started = time.time()
+        start = time.perf_counter()
+        # the stacks start at the handler, below this middleware
+        profiler.start(asyncio.current_task(), sys._getframe(), stacks)
+        profiled.set(stacks)
+        status = None
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            profiler.stop(stacks)
+            profiled.set(None)
+            store.add(
+                {
+                    "method": request.method,
+                    "path": request.path_qs,
+                    "status": status,
+                    "started": started,
+                    "duration": time.perf_counter() - start,
+                    "interval": profiler.interval,
+                    "stacks": stacks,
+                }
+            )
+
+    return middleware
+
+
+def folded(profile: dict) -> str:
+    """
+    Renders the stacks of a profile in the folded format read by flamegraph.pl
+    and speedscope: one line per stack, its frames separated by semicolons,
+    followed by its number of samples
+    """
+
+    return "".join(
+        f"{';'.join(stack)} {count}\n" for stack, count in profile["stacks"].items()
+    )
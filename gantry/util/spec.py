@@ -1,3 +1,4 @@
+import hashlib
 import json
 import re
 
@@ -33,6 +34,43 @@ def spec_variants(spec: str) -> dict:
     return variants
 
 
+def canonical_variants(variants: dict) -> str:
+    """
+    Serializes variants so that equivalent specs are stored and matched the same way,
+    regardless of the order their variants were written in.
+
+    args:
+        variants: dict in the format of spec_variants
+    returns:
+        JSON with sorted keys and sorted multi-value variants
+    """
+
+    return json.dumps(
+        {
+            name: sorted(value) if isinstance(value, list) else value
+            for name, value in variants.items()
+        },
+        sort_keys=True,
+    )
+
+
+def variants_hash(variants: dict) -> int:
+    """
+    Compact identifier of a set of variants, stored in jobs.pkg_variants_hash
+    so exact variant matches don't have to index the full JSON.
+
+    args:
+        variants: dict in the format of spec_variants
+    returns:
+        signed 64-bit integer (the range of an sqlite integer)
+    """
+
+    digest = hashlib.blake2b(
+        canonical_variants(variants).encode(), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
 def parse_alloc_spec(spec: str) -> dict:
     """
     Parses a spec in the format emacs@29.2 +json+native+treesitter%gcc@12.3.0
@@ -80,7 +118,7 @@ def parse_alloc_spec(spec: str) -> dict:
         # two representations of the variants are returned here
         # to cut down on repeated conversions in later functions
         # variants are represented as JSON in the database
-        "pkg_variants": json.dumps(pkg_variants_dict),
+        "pkg_variants": canonical_variants(pkg_variants_dict),
         # variants dict is also returned for the client
         "pkg_variants_dict": pkg_variants_dict,
         "compiler_name": compiler_name,
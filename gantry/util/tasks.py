@@ -0,0 +1,73 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+async def gather(*aws: Awaitable) -> list[Any]:
+    """
+    Runs awaitables concurrently and returns their results in order.
+
+    Unlike asyncio.gather, the remaining awaitables are cancelled as soon as one
+    of them raises, and that exception is re-raised unchanged so callers can
+    handle it exactly as if the awaitables had been run one after another.
+    """
+
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        # also reached when the caller itself is cancelled
+        for task in tasks:
+            task.cancel()
+        # wait for cancellations to finish and retrieve every exception
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    for task in tasks:
+        if not task.cancelled() and (e := task.exception()):
+            raise e
+
+    return [task.result() for task in tasks]
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key.
+
+    While a call for a key is running, later calls for the same key wait for it
+    and receive its result or exception instead of running again. Nothing is
+    remembered once the call finishes.
+    """
+
+    def __init__(self):
+        # key -> [task, number of callers waiting for it]
+        self.flights = {}
+        # calls that ran func, and calls that waited for one of those instead
+        self.executions = 0
+        self.shared = 0
+
+    async def run(self, key: Hashable, func: Callable[..., Awaitable], *args) -> Any:
+        """Awaits func(*args), or the call already in flight for key."""
+
+        if (flight := self.flights.get(key)) is None:
+            flight = [asyncio.ensure_future(func(*args)), 0]
+            self.flights[key] = flight
+            flight[0].add_done_callback(lambda _: self._land(key, flight))
+            self.executions += 1
+        else:
+            self.shared += 1
+
+        task = flight[0]
+        flight[1] += 1
+        try:
+            # one caller being cancelled should not cancel the others
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and flight[1] == 1:
+                # nobody else is waiting for the result
+                task.cancel()
+            raise
+        finally:
+            flight[1] -= 1
+
+    def _land(self, key: Hashable, flight: list) -> None:
+        if self.flights.get(key) is flight:
+            del self.flights[key]
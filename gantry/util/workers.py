@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    A fixed number of workers consuming a bounded in-process queue.
+
+    Submitting to a full queue waits up to put_timeout seconds for a free slot
+    (backpressure) and reports the item as rejected afterwards (load shedding).
+
+    When batch_size is set, workers take up to batch_size items that are already
+    waiting in the queue and call the handler with a list of them.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable],
+        workers: int,
+        max_depth: int,
+        put_timeout: float = 0,
+        batch_size: int | None = None,
+    ):
+        """
+        args:
+            handler: coroutine function called with each submitted item
+            workers: number of items that are processed concurrently
+            max_depth: maximum number of items waiting in the queue
+            put_timeout: seconds submit waits for a free slot when the queue is full
+            batch_size: maximum number of items passed to the handler at once
+        """
+        self.handler = handler
+        self.batch_size = batch_size
+        self.num_workers = workers
+        self.put_timeout = put_timeout
+        self.queue = asyncio.Queue(maxsize=max_depth)
+        self.tasks = []
+
+        self.started_at = None
+        self.busy = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.dequeued = 0
+        self.processed = 0
+        self.failed = 0
+        # time items spent waiting in the queue before a worker picked them up
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        # time workers spent running the handler
+        self.busy_seconds = 0.0
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.tasks = [
+            asyncio.create_task(self._work()) for _ in range(self.num_workers)
+        ]
+
+    async def stop(self):
+        """Cancels the workers. Items still waiting in the queue are dropped."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+        if dropped := self.queue.qsize():
+            logger.warning(f"worker pool stopped with {dropped} queued items")
+
+    async def submit(self, item: Any) -> bool:
+        """
+        Queues an item for processing.
+
+        returns: False if the queue stayed full for put_timeout seconds
+        """
+        entry = (time.monotonic(), item)
+        try:
+            if self.put_timeout > 0:
+                await asyncio.wait_for(self.queue.put(entry), self.put_timeout)
+            else:
+                self.queue.put_nowait(entry)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.rejected += 1
+            return False
+
+        self.submitted += 1
+        return True
+
+    async def _work(self):
+        while True:
+            entries = [await self.queue.get()]
+            if self.batch_size:
+                while len(entries) < self.batch_size and not self.queue.empty():
+                    entries.append(self.queue.get_nowait())
+
+            started = time.monotonic()
+            for queued_at, _ in entries:
+                waited = started - queued_at
+                self.dequeued += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+            items = [item for _, item in entries]
+            self.busy += 1
+            try:
+                await self.handler(items if self.batch_size else items[0])
+                self.processed += len(items)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # a failing item should never take down the worker
+                self.failed += len(items)
+                logger.exception("worker failed to process item")
+            finally:
+                self.busy -= 1
+                self.busy_seconds += time.monotonic() - started
+                for _ in entries:
+                    self.queue.task_done()
+
+    def stats(self) -> dict:
+        """Returns queue depth, wait time and worker utilization counters."""
+        uptime = time.monotonic() - self.started_at if self.started_at else 0
+
+        return {
+            "depth": self.queue.qsize(),
+            "max_depth": self.queue.maxsize,
+            "workers": self.num_workers,
+            "busy_workers": self.busy,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_seconds": self.wait_seconds,
+            "mean_wait_seconds": (
+                self.wait_seconds / self.dequeued if self.dequeued else 0
+            ),
+            "max_wait_seconds": self.max_wait_seconds,
+            "busy_seconds": self.busy_seconds,
+            # share of the available worker time spent processing items
+            "utilization": (
+                self.busy_seconds / (uptime * self.num_workers) if uptime else 0
+            ),
+        }
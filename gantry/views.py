@@ -1,40 +1,66 @@
-import asyncio
+import hmac
 import json
 import logging
 import os
 
 from aiohttp import web
 
-from gantry.routes.collection import fetch_job
-from gantry.routes.prediction import predict
+from gantry.clients.db import query_seconds
+from gantry.clients.http import pool_stats
+from gantry.routes import collection
+from gantry.routes.prediction import SAMPLERS, allocate, spec_key
+from gantry.util import metrics
+from gantry.util.profiling import folded
 from gantry.util.spec import parse_alloc_spec
+from gantry.util.tasks import SingleFlight
 
 logger = logging.getLogger(__name__)
 routes = web.RouteTableDef()
 
+# maximum number of specs in a request to /v1/allocations
+MAX_BATCH_SPECS = 50_000
+
+# identical specs requested at the same time (the same dependency in several
+# stacks of a pipeline) share one prediction
+prediction_flights = SingleFlight()
+
+webhooks = metrics.Counter(
+    "gantry_webhooks_total", "webhooks received, by outcome", ["result"]
+)
+webhook_seconds = metrics.Histogram(
+    "gantry_webhook_store_seconds", "seconds to store a webhook payload in the inbox"
+)
+allocations_by_tier = metrics.Counter(
+    "gantry_allocations_total",
+    "specs allocated, by the tier of sample_tiers their sample was selected from "
+    "(default when no tier had enough builds), including cached predictions",
+    ["tier"],
+)
+
 
 @routes.post("/v1/collect")
 async def collect_job(request: web.Request) -> web.Response:
     try:
         payload = await request.json()
     except json.decoder.JSONDecodeError:
+        webhooks.inc("invalid_json")
         return web.Response(status=400, text="invalid json")
 
     if request.headers.get("X-Gitlab-Token") != os.environ["GITLAB_WEBHOOK_TOKEN"]:
+        webhooks.inc("invalid_token")
         return web.Response(status=401, text="invalid token")
 
     if request.headers.get("X-Gitlab-Event") != "Job Hook":
         logger.error(f"invalid event type {request.headers.get('X-Gitlab-Event')}")
+        webhooks.inc("invalid_event")
         # return 200 so gitlab doesn't disable the webhook -- this is not fatal
         return web.Response(status=200)
 
-    # will return immediately, but will not block the event loop
-    # allowing fetch_job to run in the background
-    asyncio.ensure_future(
-        fetch_job(
-            payload, request.app["db"], request.app["gitlab"], request.app["prometheus"]
-        )
-    )
+    # the payload is stored before responding and collected in the background
+    # so the webhook can be answered immediately
+    with webhook_seconds.time():
+        stored = await request.app["collector"].receive(payload)
+    webhooks.inc("stored" if stored else "not_build")
 
     return web.Response(status=200)
 
@@ -68,4 +94,374 @@ async def allocation(request: web.Request) -> web.Response:
     if not parsed_spec:
         return web.Response(status=400, text="invalid spec")
 
-    return web.json_response(await predict(request.app["db"], parsed_spec))
+    [prediction] = await cached_predict(request.app, [parsed_spec])
+    return web.json_response(prediction)
+
+
+@routes.post("/v1/allocations")
+async def allocations(request: web.Request) -> web.Response:
+    """
+    Batched version of allocation for pipeline generation.
+
+    Expects a JSON list of specs in the format accepted by allocation.
+
+    returns:
+
+    {
+        "allocations": [{"variables": {}} or {"error": str}, ...]
+    }
+
+    in the order of the specs. invalid specs are reported in their entry
+    without failing the others
+    """
+    try:
+        specs = await request.json()
+    except json.decoder.JSONDecodeError:
+        return web.Response(status=400, text="invalid json")
+
+    if not isinstance(specs, list):
+        return web.Response(status=400, text="expected a list of specs")
+    if len(specs) > MAX_BATCH_SPECS:
+        return web.Response(status=400, text=f"more than {MAX_BATCH_SPECS} specs")
+
+    results = [{"error": "invalid spec"}] * len(specs)
+    # specs of the same package read the same builds
+    packages = {}
+    for i, spec in enumerate(specs):
+        if isinstance(spec, str) and (parsed_spec := parse_alloc_spec(spec)):
+            packages.setdefault(parsed_spec["pkg_name"], []).append((i, parsed_spec))
+
+    # packages are predicted one after the other, so a batch holds at most one
+    # read connection at a time and single allocations are not held up by it
+    for package_specs in packages.values():
+        predictions = await cached_predict(
+            request.app, [parsed_spec for _, parsed_spec in package_specs]
+        )
+        for (i, _), prediction in zip(package_specs, predictions):
+            results[i] = prediction
+
+    return web.json_response({"allocations": results})
+
+
+async def cached_predict(app: web.Application, specs: list[dict]) -> list[dict]:
+    """
+    Predicts parsed specs, reading the database only on cache misses.
+    Identical specs are predicted once, including those of concurrent requests.
+
+    returns: predictions in the order of specs
+    """
+
+    cache = app["allocation_cache"]
+    # spec key -> (prediction, tier)
+    predictions = {}
+    for spec in specs:
+        key = spec_key(spec)
+        if key in predictions:
+            continue
+        if (predicted := cache.get(key)) is None:
+            # predictions that started before a build of the package was inserted
+            # are not shared with requests made after it
+            flight = (key, cache.version(spec["pkg_name"]))
+            predicted = await prediction_flights.run(flight, _predict, app, spec)
+        predictions[key] = predicted
+
+    results = []
+    for spec in specs:
+        prediction, tier = predictions[spec_key(spec)]
+        allocations_by_tier.inc(tier)
+        results.append(prediction)
+
+    return results
+
+
+async def _predict(app: web.Application, spec: dict) -> tuple[dict, str]:
+    """returns: the prediction, and the tier of its sample as a metric label"""
+
+    cache = app["allocation_cache"]
+    # read before the database, so a build inserted during the prediction
+    # keeps it out of the cache
+    version = cache.version(spec["pkg_name"])
+    sampler = app["prediction_sampler"]
+    if (snapshot := app["prediction_snapshot"]) is not None:
+        sample = snapshot.sample(spec)
+    else:
+        async with app["db_read"].acquire() as db:
+            with query_seconds.time(f"sample_{sampler}"):
+                sample = await SAMPLERS[sampler](db, spec)
+    # the tier is cached with the prediction, so cached predictions are counted
+    predicted = (
+        allocate(spec, sample),
+        "default" if sample.tier is None else str(sample.tier),
+    )
+    cache.put(spec_key(spec), predicted, version)
+
+    return predicted
+
+
+@routes.get("/metrics")
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """
+    Serves the metrics of the application in the Prometheus text format,
+    see docs/api.md
+    """
+
+    text = metrics.render([*metrics.REGISTRY, *component_metrics(request.app)])
+    return web.Response(
+        body=text.encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+@routes.get("/admin/profiles")
+async def list_profiles(request: web.Request) -> web.Response:
+    """
+    Lists the profiles of the slowest profiled requests, slowest first,
+    see docs/api.md
+    """
+
+    if (denied := check_admin(request)) is not None:
+        return denied
+
+    return web.json_response(
+        [
+            {
+                **{key: value for key, value in profile.items() if key != "stacks"},
+                "samples": sum(profile["stacks"].values()),
+            }
+            for profile in request.app["profiles"].profiles()
+        ]
+    )
+
+
+@routes.get("/admin/profiles/{id}")
+async def download_profile(request: web.Request) -> web.Response:
+    """Returns the stacks of a profile in the folded format"""
+
+    if (denied := check_admin(request)) is not None:
+        return denied
+
+    try:
+        profile = request.app["profiles"].get(int(request.match_info["id"]))
+    except ValueError:
+        profile = None
+    if profile is None:
+        return web.Response(status=404, text="profile not found")
+
+    return web.Response(
+        text=folded(profile),
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{profile["id"]}.txt"'
+        },
+    )
+
+
+def check_admin(request: web.Request) -> web.Response | None:
+    """returns: the response to requests that can't use the admin endpoints"""
+
+    # unset, or the test application
+    token = request.app.get("profile_token")
+    if not token:
+        return web.Response(status=404, text="profiling is disabled")
+    # constant time, so the token can't be guessed one character at a time
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()
+    ):
+        return web.Response(status=401, text="invalid token")
+    return None
+
+
+def component_metrics(app: web.Application) -> list[list[str]]:
+    """
+    The counters the components of the application keep for themselves,
+    read when the metrics are scraped rather than mirrored on every update.
+    Components that were not started are left out.
+
+    returns: families, see metrics.family
+    """
+
+    # (name, kind, help, samples, label names)
+    families = [
+        (
+            "gantry_singleflight_calls_total",
+            "counter",
+            "deduplicated calls, by whether they ran or shared a call in flight",
+            {
+                (name, outcome): getattr(flights, outcome)
+                for name, flights in (
+                    ("job", collection.job_flights),
+                    ("node", collection.node_flights),
+                    ("prediction", prediction_flights),
+                )
+                for outcome in ("executions", "shared")
+            },
+            ("flight", "outcome"),
+        )
+    ]
+
+    if (cache := app.get("allocation_cache")) is not None:
+        families += [
+            (
+                "gantry_allocation_cache_lookups_total",
+                "counter",
+                "lookups of cached predictions, by result",
+                {("hit",): cache.hits, ("miss",): cache.misses},
+                ("result",),
+            ),
+            (
+                "gantry_allocation_cache_evictions_total",
+                "counter",
+                "predictions dropped to make room for others",
+                cache.evictions,
+                (),
+            ),
+            (
+                "gantry_allocation_cache_entries",
+                "gauge",
+                "cached predictions",
+                len(cache.entries),
+                (),
+            ),
+        ]
+
+    if (snapshot := app.get("prediction_snapshot")) is not None:
+        families.append(
+            (
+                "gantry_prediction_snapshot_builds",
+                "gauge",
+                "builds in memory for the columnar sampler",
+                snapshot.rows,
+                (),
+            )
+        )
+
+    if (writer := app.get("db_writer")) is not None:
+        families += [
+            (
+                "gantry_db_commits_total",
+                "counter",
+                "commits of the database writer",
+                writer.commits,
+                (),
+            ),
+            (
+                "gantry_db_writes_total",
+                "counter",
+                "writes committed by the database writer",
+                writer.writes,
+                (),
+            ),
+        ]
+
+    if (collector := app.get("collector")) is not None:
+        stats = collector.pool.stats()
+        families += [
+            (
+                "gantry_collection_queue_depth",
+                "gauge",
+                "jobs waiting for a collection worker",
+                stats["depth"],
+                (),
+            ),
+            (
+                "gantry_collection_busy_workers",
+                "gauge",
+                "collection workers that are collecting",
+                stats["busy_workers"],
+                (),
+            ),
+            (
+                "gantry_collection_jobs_total",
+                "counter",
+                "jobs handed to the collection workers, by outcome",
+                {
+                    (outcome,): stats[outcome]
+                    for outcome in ("submitted", "rejected", "processed", "failed")
+                },
+                ("outcome",),
+            ),
+            (
+                "gantry_collection_wait_seconds_total",
+                "counter",
+                "seconds jobs waited for a collection worker",
+                stats["wait_seconds"],
+                (),
+            ),
+            (
+                "gantry_collection_busy_seconds_total",
+                "counter",
+                "seconds the collection workers spent collecting",
+                stats["busy_seconds"],
+                (),
+            ),
+        ]
+        if (node_cache := collector.node_cache) is not None:
+            families.append(
+                (
+                    "gantry_node_cache_lookups_total",
+                    "counter",
+                    "lookups of cached nodes, by result",
+                    {("hit",): node_cache.hits, ("miss",): node_cache.misses},
+                    ("result",),
+                )
+            )
+
+    if (gitlab := app.get("gitlab")) is not None:
+        families += [
+            (
+                "gantry_gitlab_logs_scanned_total",
+                "counter",
+                "job logs read to detect ghost jobs",
+                gitlab.logs_scanned,
+                (),
+            ),
+            (
+                "gantry_gitlab_log_bytes_total",
+                "counter",
+                "bytes read from job logs",
+                gitlab.log_bytes_read,
+                (),
+            ),
+        ]
+
+    if (session := app.get("http")) is not None:
+        hosts = pool_stats(session)["hosts"]
+        # (name, kind, counter of PoolStats, help)
+        for name, kind, counter, help in (
+            ("requests_total", "counter", "requests", "upstream requests"),
+            ("in_flight", "gauge", "in_flight", "upstream requests in flight"),
+            (
+                "connections_created_total",
+                "counter",
+                "connections_created",
+                "connections opened to upstreams",
+            ),
+            (
+                "connections_reused_total",
+                "counter",
+                "connections_reused",
+                "upstream requests sent on an open connection",
+            ),
+            (
+                "queued_total",
+                "counter",
+                "queued",
+                "upstream requests that waited for a free connection",
+            ),
+            (
+                "queued_seconds_total",
+                "counter",
+                "queued_seconds",
+                "seconds upstream requests waited for a free connection",
+            ),
+        ):
+            families.append(
+                (
+                    f"gantry_upstream_{name}",
+                    kind,
+                    f"{help}, by host",
+                    {(host,): stats[counter] for host, stats in hosts.items()},
+                    ("host",),
+                )
+            )
+
+    return [metrics.family(*family) for family in families]
@@ -0,0 +1,12 @@
+-- webhook payloads waiting for (or done with) collection
+-- rows survive restarts so interrupted collections can be resumed
+CREATE TABLE IF NOT EXISTS inbox (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    -- pending, running, done, failed
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    received INTEGER NOT NULL,
+    updated INTEGER NOT NULL
+);
+CREATE INDEX inbox_status on inbox(status, id);
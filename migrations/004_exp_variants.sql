@@ -0,0 +1,73 @@
+-- the expensive variants of a job (see gantry.routes.prediction.EXPENSIVE_VARIANTS)
+-- packed into one integer so samples can be filtered by them with an index.
+-- each variant takes 2 bits, in alphabetical order starting from the lowest bits:
+-- 0 when it's not set, 1 when false, 2 when true and 3 for any other value.
+-- the column is virtual, so existing rows are backfilled by creating the index
+-- and new rows are covered without changes to inserts
+ALTER TABLE jobs ADD COLUMN exp_variants INTEGER GENERATED ALWAYS AS (
+    -- cuda
+    ((CASE
+        WHEN json_extract(pkg_variants, '$.cuda') IS NULL THEN 0
+        WHEN json_extract(pkg_variants, '$.cuda') = 0 THEN 1
+        WHEN json_extract(pkg_variants, '$.cuda') = 1 THEN 2
+        ELSE 3
+    END) << 0)
+    |
+    -- fortran
+    ((CASE
+        WHEN json_extract(pkg_variants, '$.fortran') IS NULL THEN 0
+        WHEN json_extract(pkg_variants, '$.fortran') = 0 THEN 1
+        WHEN json_extract(pkg_variants, '$.fortran') = 1 THEN 2
+        ELSE 3
+    END) << 2)
+    |
+    -- hdf5
+    ((CASE
+        WHEN json_extract(pkg_variants, '$.hdf5') IS NULL THEN 0
+        WHEN json_extract(pkg_variants, '$.hdf5') = 0 THEN 1
+        WHEN json_extract(pkg_variants, '$.hdf5') = 1 THEN 2
+        ELSE 3
+    END) << 4)
+    |
+    -- mpi
+    ((CASE
+        WHEN json_extract(pkg_variants, '$.mpi') IS NULL THEN 0
+        WHEN json_extract(pkg_variants, '$.mpi') = 0 THEN 1
+        WHEN json_extract(pkg_variants, '$.mpi') = 1 THEN 2
+        ELSE 3
+    END) << 6)
+    |
+    -- openmp
+    ((CASE
+        WHEN json_extract(pkg_variants, '$.openmp') IS NULL THEN 0
+        WHEN json_extract(pkg_variants, '$.openmp') = 0 THEN 1
+        WHEN json_extract(pkg_variants, '$.openmp') = 1 THEN 2
+        ELSE 3
+    END) << 8)
+    |
+    -- python
+    ((CASE
+        WHEN json_extract(pkg_variants, '$.python') IS NULL THEN 0
+        WHEN json_extract(pkg_variants, '$.python') = 0 THEN 1
+        WHEN json_extract(pkg_variants, '$.python') = 1 THEN 2
+        ELSE 3
+    END) << 10)
+    |
+    -- rocm
+    ((CASE
+        WHEN json_extract(pkg_variants, '$.rocm') IS NULL THEN 0
+        WHEN json_extract(pkg_variants, '$.rocm') = 0 THEN 1
+        WHEN json_extract(pkg_variants, '$.rocm') = 1 THEN 2
+        ELSE 3
+    END) << 12)
+    |
+    -- sycl
+    ((CASE
+        WHEN json_extract(pkg_variants, '$.sycl') IS NULL THEN 0
+        WHEN json_extract(pkg_variants, '$.sycl') = 0 THEN 1
+        WHEN json_extract(pkg_variants, '$.sycl') = 1 THEN 2
+        ELSE 3
+    END) << 14)
+) VIRTUAL;
+
+CREATE INDEX exp_variants_spec on jobs(pkg_name, exp_variants, pkg_version, compiler_name, compiler_version, end);
@@ -0,0 +1,10 @@
+-- variants are stored in a canonical form (sorted keys and multi-value variants),
+-- so specs match regardless of the order their variants were written in.
+-- canonical_variants and variants_hash are defined by apply_migrations
+-- with the functions of the same name in gantry/util/spec.py
+UPDATE jobs SET pkg_variants = canonical_variants(pkg_variants);
+ALTER TABLE jobs ADD COLUMN pkg_variants_hash INTEGER;
+UPDATE jobs SET pkg_variants_hash = variants_hash(pkg_variants);
+-- exact variant matches go through the hash, which is smaller to index than the JSON
+DROP INDEX complete_spec;
+CREATE INDEX variants_spec on jobs(pkg_name, pkg_variants_hash, pkg_version, compiler_name, compiler_version, end);
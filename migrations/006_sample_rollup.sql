@@ -0,0 +1,187 @@
+-- the ids of the most recent develop builds (up to IDEAL_SAMPLE) for each key
+-- of each tier of the sample (see gantry.routes.prediction.sample_tiers), so a
+-- prediction only needs one primary key lookup per tier.
+-- tier is the position of the tier in sample_tiers, key is json_array() of the
+-- values of its params. rows are kept up to date by the trigger below,
+-- changes to the tiers need a new migration
+CREATE TABLE sample_rollup (
+    tier INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    -- JSON array of job ids
+    sample TEXT NOT NULL,
+    PRIMARY KEY (tier, key)
+) WITHOUT ROWID;
+
+CREATE TRIGGER sample_rollup_insert AFTER INSERT ON jobs WHEN new.ref = 'develop'
+BEGIN
+    -- pkg_name, pkg_variants_hash, pkg_version, compiler_name, compiler_version
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (0, json_array(new.pkg_name, new.pkg_variants_hash, new.pkg_version, new.compiler_name, new.compiler_version), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, pkg_version, compiler_name, compiler_version, exp_variants
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (1, json_array(new.pkg_name, new.pkg_version, new.compiler_name, new.compiler_version, new.exp_variants), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, pkg_variants_hash, compiler_name, compiler_version
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (2, json_array(new.pkg_name, new.pkg_variants_hash, new.compiler_name, new.compiler_version), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, compiler_name, compiler_version, exp_variants
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (3, json_array(new.pkg_name, new.compiler_name, new.compiler_version, new.exp_variants), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, pkg_variants_hash, pkg_version, compiler_name
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (4, json_array(new.pkg_name, new.pkg_variants_hash, new.pkg_version, new.compiler_name), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, pkg_version, compiler_name, exp_variants
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (5, json_array(new.pkg_name, new.pkg_version, new.compiler_name, new.exp_variants), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, pkg_variants_hash, compiler_name
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (6, json_array(new.pkg_name, new.pkg_variants_hash, new.compiler_name), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, compiler_name, exp_variants
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (7, json_array(new.pkg_name, new.compiler_name, new.exp_variants), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, pkg_variants_hash, pkg_version
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (8, json_array(new.pkg_name, new.pkg_variants_hash, new.pkg_version), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, pkg_version, exp_variants
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (9, json_array(new.pkg_name, new.pkg_version, new.exp_variants), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, pkg_variants_hash
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (10, json_array(new.pkg_name, new.pkg_variants_hash), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+    -- pkg_name, exp_variants
+    INSERT INTO sample_rollup (tier, key, sample) VALUES (11, json_array(new.pkg_name, new.exp_variants), json_array(new.id))
+    ON CONFLICT DO UPDATE SET sample = (
+        SELECT json_group_array(id) FROM (
+            SELECT id FROM jobs WHERE id IN (SELECT value FROM json_each(sample)) OR id = new.id
+            ORDER BY end DESC, id DESC LIMIT 5
+        )
+    );
+END;
+
+-- existing builds
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 0, json_array(pkg_name, pkg_variants_hash, pkg_version, compiler_name, compiler_version), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_variants_hash, pkg_version, compiler_name, compiler_version, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_variants_hash, pkg_version, compiler_name, compiler_version ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_variants_hash, pkg_version, compiler_name, compiler_version;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 1, json_array(pkg_name, pkg_version, compiler_name, compiler_version, exp_variants), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_version, compiler_name, compiler_version, exp_variants, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_version, compiler_name, compiler_version, exp_variants ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_version, compiler_name, compiler_version, exp_variants;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 2, json_array(pkg_name, pkg_variants_hash, compiler_name, compiler_version), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_variants_hash, compiler_name, compiler_version, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_variants_hash, compiler_name, compiler_version ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_variants_hash, compiler_name, compiler_version;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 3, json_array(pkg_name, compiler_name, compiler_version, exp_variants), json_group_array(id) FROM (
+    SELECT pkg_name, compiler_name, compiler_version, exp_variants, id, row_number() OVER (
+        PARTITION BY pkg_name, compiler_name, compiler_version, exp_variants ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, compiler_name, compiler_version, exp_variants;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 4, json_array(pkg_name, pkg_variants_hash, pkg_version, compiler_name), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_variants_hash, pkg_version, compiler_name, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_variants_hash, pkg_version, compiler_name ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_variants_hash, pkg_version, compiler_name;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 5, json_array(pkg_name, pkg_version, compiler_name, exp_variants), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_version, compiler_name, exp_variants, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_version, compiler_name, exp_variants ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_version, compiler_name, exp_variants;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 6, json_array(pkg_name, pkg_variants_hash, compiler_name), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_variants_hash, compiler_name, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_variants_hash, compiler_name ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_variants_hash, compiler_name;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 7, json_array(pkg_name, compiler_name, exp_variants), json_group_array(id) FROM (
+    SELECT pkg_name, compiler_name, exp_variants, id, row_number() OVER (
+        PARTITION BY pkg_name, compiler_name, exp_variants ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, compiler_name, exp_variants;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 8, json_array(pkg_name, pkg_variants_hash, pkg_version), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_variants_hash, pkg_version, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_variants_hash, pkg_version ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_variants_hash, pkg_version;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 9, json_array(pkg_name, pkg_version, exp_variants), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_version, exp_variants, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_version, exp_variants ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_version, exp_variants;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 10, json_array(pkg_name, pkg_variants_hash), json_group_array(id) FROM (
+    SELECT pkg_name, pkg_variants_hash, id, row_number() OVER (
+        PARTITION BY pkg_name, pkg_variants_hash ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, pkg_variants_hash;
+INSERT INTO sample_rollup (tier, key, sample)
+SELECT 11, json_array(pkg_name, exp_variants), json_group_array(id) FROM (
+    SELECT pkg_name, exp_variants, id, row_number() OVER (
+        PARTITION BY pkg_name, exp_variants ORDER BY end DESC, id DESC
+    ) AS n FROM jobs WHERE ref = 'develop'
+) WHERE n <= 5 GROUP BY pkg_name, exp_variants;
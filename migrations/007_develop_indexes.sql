@@ -0,0 +1,39 @@
+-- partial indexes of the develop builds, which are the only ones predictions are
+-- made from, one per tier of the sample (see gantry.routes.prediction.sample_tiers).
+-- each holds the params of its tier followed by end, so the most recent builds of a
+-- tier are read in order, without sorting all the builds of a package. the ids of a
+-- sample are the rowids stored in the index, and ref is included (even though it is
+-- always develop) so the queries of the tiers with exact variants never read the
+-- jobs table. sqlite reads exp_variants from the table rather than from an index,
+-- so the other tiers still read the rows of the builds they count and return.
+-- builds of other refs aren't indexed, which makes their inserts cheaper.
+-- changes to the tiers need a new migration
+
+-- pkg_name, pkg_variants_hash, pkg_version, compiler_name, compiler_version
+CREATE INDEX develop_tier_0 ON jobs(ref, pkg_name, pkg_variants_hash, pkg_version, compiler_name, compiler_version, end) WHERE ref = 'develop';
+-- pkg_name, pkg_version, compiler_name, compiler_version, exp_variants
+CREATE INDEX develop_tier_1 ON jobs(ref, pkg_name, pkg_version, compiler_name, compiler_version, exp_variants, end) WHERE ref = 'develop';
+-- pkg_name, pkg_variants_hash, compiler_name, compiler_version
+CREATE INDEX develop_tier_2 ON jobs(ref, pkg_name, pkg_variants_hash, compiler_name, compiler_version, end) WHERE ref = 'develop';
+-- pkg_name, compiler_name, compiler_version, exp_variants
+CREATE INDEX develop_tier_3 ON jobs(ref, pkg_name, compiler_name, compiler_version, exp_variants, end) WHERE ref = 'develop';
+-- pkg_name, pkg_variants_hash, pkg_version, compiler_name
+CREATE INDEX develop_tier_4 ON jobs(ref, pkg_name, pkg_variants_hash, pkg_version, compiler_name, end) WHERE ref = 'develop';
+-- pkg_name, pkg_version, compiler_name, exp_variants
+CREATE INDEX develop_tier_5 ON jobs(ref, pkg_name, pkg_version, compiler_name, exp_variants, end) WHERE ref = 'develop';
+-- pkg_name, pkg_variants_hash, compiler_name
+CREATE INDEX develop_tier_6 ON jobs(ref, pkg_name, pkg_variants_hash, compiler_name, end) WHERE ref = 'develop';
+-- pkg_name, compiler_name, exp_variants
+CREATE INDEX develop_tier_7 ON jobs(ref, pkg_name, compiler_name, exp_variants, end) WHERE ref = 'develop';
+-- pkg_name, pkg_variants_hash, pkg_version
+CREATE INDEX develop_tier_8 ON jobs(ref, pkg_name, pkg_variants_hash, pkg_version, end) WHERE ref = 'develop';
+-- pkg_name, pkg_version, exp_variants
+CREATE INDEX develop_tier_9 ON jobs(ref, pkg_name, pkg_version, exp_variants, end) WHERE ref = 'develop';
+-- pkg_name, pkg_variants_hash
+CREATE INDEX develop_tier_10 ON jobs(ref, pkg_name, pkg_variants_hash, end) WHERE ref = 'develop';
+-- pkg_name, exp_variants
+CREATE INDEX develop_tier_11 ON jobs(ref, pkg_name, exp_variants, end) WHERE ref = 'develop';
+
+-- only the tiers of get_sample used them, and they also index the jobs of other refs
+DROP INDEX variants_spec;
+DROP INDEX exp_variants_spec;